@@ -0,0 +1,302 @@
+"""Benchmark suite for the calculator implementations.
+
+Runs a fixed corpus of expressions through every calculator engine in the
+repo and reports per-expression latency percentiles, throughput and peak
+allocation per call, plus end-to-end HTTP numbers through the Flask test
+client for the Flask based services.
+
+Engines:
+    default             safe_eval in default/calculator (compiled + cached)
+    default-uncached    same, with the compiled expression cache cleared per call
+    nekodigi/calculator     eval with cost check in nekodigi/calculator
+    nekodigi/calculator2    eval with cost check in nekodigi/calculator2
+    calculator-streamlit    Streamlit app in nekodigi/calculator-streamlit, via AppTest
+    streamlit3              Streamlit app in nekodigi/streamlit3/calculator-app
+
+The Streamlit engines only support what their keypads can type, so they run
+the keypad subset of the corpus. Their key entry happens in the browser, so
+each expression is measured as the one script rerun that submitting it costs.
+
+Usage:
+    python bench/calculator.py [--repeat N] [--engine NAME ...] [--no-http] [--json]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fixed corpus: category -> expressions. Every engine runs the categories it supports.
+CORPUS = {
+    'keypad': [
+        '1+2',
+        '12345+67890',
+        '98*76',
+        '1000/8',
+        '3.5*2',
+        '999999-1',
+    ],
+    'simple': [
+        '2+3*4-5/6',
+        '(1+2)*(3+4)',
+        '100/7+22/7-3',
+        '1.5*2.5+3.25',
+    ],
+    'trig': [
+        'sin(π/4)**2+cos(π/4)**2',
+        'atan(1)*4',
+        'sqrt(2)*ln(10)/log(100)',
+        'exp(sin(1))+tan(0.5)-asin(0.5)',
+    ],
+    'nested': [
+        '((((((1+2)*3)-4)/5)+6)*7)',
+        '-(-(-(-(-(2)))))',
+        '(((((((((((1)))))))))))+((((2))))',
+        '+'.join(str(i) for i in range(1, 100)),
+    ],
+    'bigint': [
+        '2**4096',
+        '3**2000*7**1000',
+        '(10**500+1)**3',
+        '12345678901234567890**50',
+    ],
+}
+
+
+def load_module(name, path):
+    """Import a module from a file path under a unique name"""
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Engine:
+    """One calculator implementation under benchmark"""
+
+    categories = ('keypad', 'simple', 'trig', 'nested', 'bigint')
+
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, expression):
+        raise NotImplementedError
+
+    def http_client(self):
+        """Return (client, path) for HTTP benchmarks, or None"""
+        return None
+
+
+class DefaultEngine(Engine):
+    def __init__(self, name='default', cached=True):
+        super().__init__(name)
+        self.main = load_module('default_calculator_main', os.path.join(ROOT, 'default', 'calculator', 'main.py'))
+        self.engine = sys.modules['engine']
+        self.cached = cached
+
+    def evaluate(self, expression):
+        if not self.cached:
+            self.engine.expression_cache.clear()
+        return self.main.safe_eval(expression)
+
+    def http_client(self):
+        if not self.cached:
+            return None
+        from flask import Flask, request
+
+        app = Flask('default_calculator')
+
+        @app.route('/<path:path>', methods=['POST'])
+        def catch_all(path):
+            return self.main.main(request)
+
+        return app.test_client(), '/api/calculate'
+
+
+class EvalEngine(Engine):
+    """nekodigi/calculator and calculator2: eval behind a static cost check"""
+
+    categories = ('keypad', 'simple', 'nested', 'bigint')
+
+    def __init__(self, name, directory):
+        super().__init__(name)
+        module_name = directory.replace('/', '_') + '_main'
+        self.main = load_module(module_name, os.path.join(ROOT, directory, 'main.py'))
+
+    def evaluate(self, expression):
+        body, status = self.main.evaluate_expression(expression)
+        if status != 200:
+            raise ValueError(body['error'])
+        return body['result']
+
+    def http_client(self):
+        return self.main.app.test_client(), '/api/calculate'
+
+
+class StreamlitEngine(Engine):
+    """Measures one Streamlit script rerun per expression through AppTest
+
+    Key entry runs in a browser-side component, so a whole expression costs
+    the single rerun triggered when "=" submits it. AppTest cannot drive the
+    component itself, so this times that rerun rather than the evaluation.
+    """
+
+    categories = ('keypad',)
+
+    def __init__(self, name, path):
+        super().__init__(name)
+        from streamlit.testing.v1 import AppTest
+
+        self.path = path
+        self.app = AppTest.from_file(path, default_timeout=30)
+        self._run()
+
+    def _run(self):
+        # calculator-streamlit relaunches itself through the CLI when argv is empty
+        argv = sys.argv
+        sys.argv = [self.path, '--bench']
+        try:
+            self.app.run()
+        finally:
+            sys.argv = argv
+
+    def evaluate(self, expression):
+        self._run()
+
+
+ENGINES = {
+    'default': lambda: DefaultEngine(),
+    'default-uncached': lambda: DefaultEngine('default-uncached', cached=False),
+    'nekodigi/calculator': lambda: EvalEngine('nekodigi/calculator', 'nekodigi/calculator'),
+    'nekodigi/calculator2': lambda: EvalEngine('nekodigi/calculator2', 'nekodigi/calculator2'),
+    'calculator-streamlit': lambda: StreamlitEngine(
+        'calculator-streamlit', os.path.join(ROOT, 'nekodigi', 'calculator-streamlit', 'main.py')),
+    'streamlit3': lambda: StreamlitEngine(
+        'streamlit3', os.path.join(ROOT, 'nekodigi', 'streamlit3', 'calculator-app', 'app.py')),
+}
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples_ns):
+    """Latency percentiles (microseconds) and throughput for a list of samples"""
+    values = sorted(samples_ns)
+    total = sum(values)
+    return {
+        'calls': len(values),
+        'p50_us': percentile(values, 0.50) / 1000,
+        'p90_us': percentile(values, 0.90) / 1000,
+        'p99_us': percentile(values, 0.99) / 1000,
+        'mean_us': statistics.fmean(values) / 1000,
+        'throughput_per_s': len(values) / (total / 1e9) if total else float('inf'),
+    }
+
+
+def measure(call, expressions, repeat, warmup):
+    """Time every expression ``repeat`` times after ``warmup`` untimed calls"""
+    samples = []
+    for expression in expressions:
+        for _ in range(warmup):
+            call(expression)
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            call(expression)
+            samples.append(time.perf_counter_ns() - start)
+    return samples
+
+
+def peak_allocation(call, expressions, repeat):
+    """Mean peak traced allocation per call, in bytes"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for expression in expressions:
+            for _ in range(repeat):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                call(expression)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return statistics.fmean(peaks)
+
+
+def http_call(client, path):
+    def call(expression):
+        response = client.post(path, json={'expression': expression})
+        if response.status_code != 200:
+            raise ValueError(response.get_json())
+    return call
+
+
+def run_engine(engine, repeat, warmup, http):
+    rows = []
+    for category in engine.categories:
+        expressions = CORPUS[category]
+        row = {'engine': engine.name, 'mode': 'call', 'category': category}
+        row.update(summarize(measure(engine.evaluate, expressions, repeat, warmup)))
+        row['peak_alloc_bytes'] = peak_allocation(engine.evaluate, expressions, max(1, repeat // 10))
+        rows.append(row)
+
+        client = engine.http_client() if http else None
+        if client is not None:
+            call = http_call(*client)
+            row = {'engine': engine.name, 'mode': 'http', 'category': category}
+            row.update(summarize(measure(call, expressions, repeat, warmup)))
+            row['peak_alloc_bytes'] = peak_allocation(call, expressions, max(1, repeat // 10))
+            rows.append(row)
+    return rows
+
+
+def print_table(rows):
+    header = f"{'engine':<22} {'mode':<5} {'category':<8} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'ops/s':>11} {'peak KiB':>9}"
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print(
+            f"{row['engine']:<22} {row['mode']:<5} {row['category']:<8} "
+            f"{row['p50_us']:>10.1f} {row['p90_us']:>10.1f} {row['p99_us']:>10.1f} "
+            f"{row['throughput_per_s']:>11.0f} {row['peak_alloc_bytes'] / 1024:>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help='timed calls per expression')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed calls per expression')
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINES), help='engines to run (default: all)')
+    parser.add_argument('--no-http', action='store_true', help='skip Flask test client benchmarks')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    rows = []
+    for name in args.engine or ENGINES:
+        try:
+            engine = ENGINES[name]()
+        except ImportError as e:
+            print(f'skipping {name}: {e}', file=sys.stderr)
+            continue
+        # Streamlit reruns are orders of magnitude slower than a function call
+        repeat = args.repeat if isinstance(engine, (DefaultEngine, EvalEngine)) else max(1, args.repeat // 50)
+        rows.extend(run_engine(engine, repeat, args.warmup if repeat == args.repeat else 1, not args.no_http))
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
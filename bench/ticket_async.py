@@ -0,0 +1,154 @@
+"""Sync vs asyncio throughput benchmark for nekodigi/ticket-app validations.
+
+Runs the same burst of POST /api/validate-ticket calls against the
+Firebase stand-in (nekodigi/ticket-app/firebase_standin.py) with an
+artificial round trip, through:
+
+    sync    main.py's Flask app on a fixed pool of worker threads, like a
+            gunicorn gthread worker (--workers threads)
+    async   asgi.py's Starlette app on one event loop, with up to
+            --in-flight validations outstanding at once
+
+Every ticket is validated once, so each call does the full read-with-ETag
+and conditional write. The streaming ticket cache is disabled so that both
+paths go to the stand-in for every call. The stand-in runs in its own
+process so that its request handling does not share the GIL with the
+client under test.
+
+Usage:
+    python bench/ticket_async.py [--tickets N] [--latency-ms MS] [--workers N] [--in-flight N] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, 'nekodigi', 'ticket-app')
+STANDIN = os.path.join(APP_DIR, 'firebase_standin.py')
+
+
+def start_standin(latency_ms):
+    """Run the stand-in on a free port in a child process; returns (process, url)"""
+    process = subprocess.Popen(
+        [sys.executable, STANDIN, '--port', '0', '--latency-ms', str(latency_ms)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    return process, process.stdout.readline().split()[-1]
+
+
+def load_apps(database_url):
+    os.environ['FIREBASE_DATABASE_URL'] = database_url
+    os.environ['TICKET_CACHE'] = '0'
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    for name in ('asgi', 'main', 'firebase_client'):
+        sys.modules.pop(name, None)
+    import asgi
+    import main
+    return main, asgi
+
+
+def create_tickets(main, count):
+    # Written directly, without rendering QR codes nobody looks at
+    records = main.new_ticket_records('bench', count)
+    main.firebase_patch("", main.create_updates(records, 'bench'))
+    return list(records)
+
+
+def summarize(mode, concurrency, samples, elapsed, accepted):
+    samples.sort()
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'validations': len(samples),
+        'accepted': accepted,
+        'per_s': len(samples) / elapsed,
+        'p50_ms': samples[len(samples) // 2] / 1e6,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1e6,
+    }
+
+
+def run_sync(main, ids, workers):
+    def validate(ticket_id):
+        began = time.perf_counter_ns()
+        response = main.app.test_client().post('/api/validate-ticket', json={'ticket_id': ticket_id})
+        return time.perf_counter_ns() - began, response.get_json().get('valid')
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(validate, ids))
+    elapsed = time.perf_counter() - began
+    return summarize('sync', workers, [sample for sample, _ in results], elapsed, sum(1 for _, valid in results if valid))
+
+
+def run_async(asgi, ids, in_flight):
+    import httpx
+
+    async def burst():
+        limit = asyncio.Semaphore(in_flight)
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            async def validate(ticket_id):
+                async with limit:
+                    began = time.perf_counter_ns()
+                    response = await client.post('/api/validate-ticket', json={'ticket_id': ticket_id})
+                    return time.perf_counter_ns() - began, response.json().get('valid')
+
+            began = time.perf_counter()
+            results = await asyncio.gather(*(validate(ticket_id) for ticket_id in ids))
+            elapsed = time.perf_counter() - began
+            # Let the background stats updates finish before the stand-in stops
+            if asgi._background_tasks:
+                await asyncio.wait(asgi._background_tasks)
+            await asgi.firebase.aclose()
+            return results, elapsed
+
+    results, elapsed = asyncio.run(burst())
+    return summarize('async', in_flight, [sample for sample, _ in results], elapsed, sum(1 for _, valid in results if valid))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=2000, help='tickets to validate per mode')
+    parser.add_argument('--latency-ms', type=float, default=100.0, help='stand-in delay per request')
+    parser.add_argument('--workers', type=int, default=8, help='sync worker threads')
+    parser.add_argument('--in-flight', type=int, default=1000, help='concurrent async validations')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    rows = []
+    for mode in ('sync', 'async'):
+        standin, url = start_standin(args.latency_ms)
+        try:
+            main_module, asgi = load_apps(url)
+            ids = create_tickets(main_module, args.tickets)
+            if mode == 'sync':
+                rows.append(run_sync(main_module, ids, args.workers))
+                main_module.get_background().shutdown(wait=True)
+            else:
+                rows.append(run_async(asgi, ids, args.in_flight))
+        finally:
+            standin.terminate()
+            standin.wait()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        header = f"{'mode':<6} {'concurrency':>11} {'validations':>11} {'accepted':>9} {'per s':>9} {'p50 ms':>9} {'p99 ms':>9}"
+        print(header)
+        print('-' * len(header))
+        for row in rows:
+            print(
+                f"{row['mode']:<6} {row['concurrency']:>11} {row['validations']:>11} {row['accepted']:>9} "
+                f"{row['per_s']:>9.0f} {row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Concurrent gate benchmark for nekodigi/ticket-app against the Firebase stand-in.
+
+Starts nekodigi/ticket-app/firebase_standin.py in-process with an
+artificial round-trip delay, points nekodigi/ticket-app at it, creates a
+batch of tickets and has many gate threads POST /api/validate-ticket for
+every ticket at the same time. Each ticket must be accepted (valid: true)
+exactly once.
+
+Scenarios:
+    cold     validate-ticket only (read with ETag, then conditional write)
+    checked  check-ticket first, untimed, so the ETag is cached and the
+             timed validate-ticket is a single conditional write (with the
+             streaming ticket cache the check is served locally and the
+             ETag is fetched in the background, which this waits for)
+    legacy   the previous read-then-PATCH redeem, as a baseline that shows
+             the double-entry race
+
+Usage:
+    python bench/ticket_gates.py [--tickets N] [--gates N] [--latency-ms MS] [--scenario NAME ...] [--json]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, 'nekodigi', 'ticket-app')
+
+sys.path.insert(0, APP_DIR)
+from firebase_standin import FirebaseStandIn  # noqa: E402
+
+
+def load_app(database_url):
+    os.environ['FIREBASE_DATABASE_URL'] = database_url
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    spec = importlib.util.spec_from_file_location('nekodigi_ticket_app_main', os.path.join(APP_DIR, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_validate(app, ticket_id):
+    """The read-then-PATCH redeem this app used before conditional writes"""
+    ticket = app.firebase_get(f"tickets/{ticket_id}")
+    if not ticket or ticket.get('used'):
+        return False
+    app.firebase_patch(f"tickets/{ticket_id}", {'used': True, 'used_at': time.time()})
+    return True
+
+
+def run(scenario, tickets, gates, latency):
+    standin = FirebaseStandIn(latency=latency).start()
+    try:
+        app = load_app(standin.url)
+        cache = app.get_ticket_cache()
+        if cache is not None:
+            cache.wait_ready(5)
+        client = app.app.test_client()
+        created = client.post('/api/create-ticket', json={'event_name': 'bench', 'ticket_count': tickets}).get_json()
+        ids = [ticket['ticket_id'] for ticket in created['tickets']]
+
+        local = threading.local()
+
+        def validate(ticket_id):
+            if scenario == 'legacy':
+                return legacy_validate(app, ticket_id)
+            gate_client = getattr(local, 'client', None)
+            if gate_client is None:
+                gate_client = local.client = app.app.test_client()
+            return gate_client.post('/api/validate-ticket', json={'ticket_id': ticket_id}).get_json().get('valid')
+
+        wins = Counter()
+        wins_lock = threading.Lock()
+        samples = []
+        barrier = threading.Barrier(gates)
+
+        def gate(n):
+            gate_client = app.app.test_client()
+            for ticket_id in ids:
+                if scenario == 'checked':
+                    gate_client.post('/api/check-ticket', json={'ticket_id': ticket_id})
+                    deadline = time.monotonic() + 1.0
+                    while ticket_id not in app._ticket_etags and time.monotonic() < deadline:
+                        time.sleep(0.001)
+                # Every gate scans the same ticket at the same moment
+                barrier.wait()
+                began = time.perf_counter_ns()
+                valid = validate(ticket_id)
+                elapsed = time.perf_counter_ns() - began
+                with wins_lock:
+                    samples.append(elapsed)
+                    if valid:
+                        wins[ticket_id] += 1
+
+        requests_before = standin.db.requests
+        threads = [threading.Thread(target=gate, args=(n,)) for n in range(gates)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Stats counters are updated in the background after responding
+        app.get_background().shutdown(wait=True)
+        if app.ticket_cache is not None:
+            app.ticket_cache.stop()
+
+        samples.sort()
+        return {
+            'scenario': scenario,
+            'validations': len(samples),
+            'accepted': sum(wins.values()),
+            'double_redemptions': sum(1 for count in wins.values() if count > 1),
+            'missed': len(ids) - len(wins),
+            'db_requests': standin.db.requests - requests_before,
+            'p50_ms': samples[len(samples) // 2] / 1e6,
+            'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1e6,
+        }
+    finally:
+        standin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=100, help='tickets to create')
+    parser.add_argument('--gates', type=int, default=4, help='concurrent gate threads')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='stand-in delay per request')
+    parser.add_argument('--scenario', action='append', choices=('cold', 'checked', 'legacy'),
+                        help='scenarios (default: all)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    rows = [run(scenario, args.tickets, args.gates, args.latency_ms / 1000)
+            for scenario in args.scenario or ('cold', 'checked', 'legacy')]
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        header = f"{'scenario':<8} {'validations':>11} {'accepted':>9} {'double':>7} {'missed':>7} {'db reqs':>8} {'p50 ms':>8} {'p99 ms':>8}"
+        print(header)
+        print('-' * len(header))
+        for row in rows:
+            print(
+                f"{row['scenario']:<8} {row['validations']:>11} {row['accepted']:>9} {row['double_redemptions']:>7} "
+                f"{row['missed']:>7} {row['db_requests']:>8} {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+            )
+
+    if any(row['scenario'] != 'legacy' and (row['double_redemptions'] or row['missed']) for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Memory per ticket for nekokazu/ticket-app's in-memory store.
+
+Adds tickets shaped like the ones POST /api/tickets/create makes (fresh
+UUID and timestamp strings, a few distinct names, descriptions parsed
+from each request) and reports the traced allocation growth per ticket.
+A quarter of them are redeemed, so the used_at side is exercised too.
+
+Usage:
+    python bench/ticket_memory.py [--tickets N] [--json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'nekokazu', 'ticket-app'))
+from storage import MemoryTicketStore  # noqa: E402
+
+NAMES = ['一般チケット', 'VIPチケット', '学生チケット', 'チケット']
+
+
+def measure(count):
+    tracemalloc.start()
+    store = MemoryTicketStore()
+    before = tracemalloc.get_traced_memory()[0]
+    ids = []
+    for n in range(count):
+        name = NAMES[n % len(NAMES)]
+        ticket_id = str(uuid.uuid4())
+        store.add({
+            'id': ticket_id,
+            'name': name,
+            # A new string each time, as json.loads would produce
+            'description': ''.join([name, 'の説明']),
+            'created_at': datetime.now().isoformat(),
+            'used': False,
+            'used_at': None,
+        })
+        ids.append(ticket_id)
+    for ticket_id in ids[::4]:
+        store.redeem(ticket_id, datetime.now().isoformat())
+    del ids
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {'tickets': count, 'bytes': used, 'bytes_per_ticket': used / count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=200000, help='tickets to add')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    row = measure(args.tickets)
+    if args.json:
+        print(json.dumps(row, indent=2))
+    else:
+        print(f"{row['tickets']} tickets: {row['bytes'] / 2**20:.1f} MiB, {row['bytes_per_ticket']:.0f} bytes/ticket")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""QR code rendering benchmark: qrcode + PIL vs the NumPy renderer (qr_render.py).
+
+Renders the same payloads the ticket apps put in their QR codes, three ways:
+
+    pil         qrcode.QRCode.make() + make_image() + PIL PNG save, the
+                path both apps used before qr_render.py
+    png         qr_render.render_png (1-bit paletted PNG)
+    svg         qr_render.render_svg (one path of horizontal runs)
+
+all at box_size=10, border=4. Payload kinds:
+
+    json        nekodigi's unsigned {"ticket_id", "event_name"} JSON
+    token       nekodigi's 35-character signed token
+    url         nekokazu's /api/tickets/<id>/verify URL
+
+Every PNG from qr_render is decoded and compared pixel for pixel with the
+PIL image, so the exit status is non-zero if the two ever disagree.
+Needs Pillow, which the apps themselves no longer do.
+
+Usage:
+    python bench/ticket_qr.py [--codes N] [--json]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'nekodigi', 'ticket-app'))
+from qr_render import render_png, render_svg  # noqa: E402
+from ticket_token import TicketSigner  # noqa: E402
+
+
+def payloads(kind, count):
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    if kind == 'json':
+        return [json.dumps({'ticket_id': ticket_id, 'event_name': 'イベント'}) for ticket_id in ids]
+    if kind == 'token':
+        signer = TicketSigner('bench')
+        return [signer.sign(ticket_id) for ticket_id in ids]
+    return [f'https://tickets.example.com/api/tickets/{ticket_id}/verify' for ticket_id in ids]
+
+
+def render_pil(data):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'pil': render_pil,
+    'png': lambda data: render_png(data, box_size=10, border=4),
+    'svg': lambda data: render_svg(data, box_size=10, border=4).encode('utf-8'),
+}
+
+
+def pixels(png):
+    return np.asarray(Image.open(io.BytesIO(png)).convert('L'))
+
+
+def run(kind, count):
+    data = payloads(kind, count)
+    rows, outputs = [], {}
+    for name, render in RENDERERS.items():
+        render(data[0])  # warm-up (per-version tables)
+        began = time.perf_counter()
+        outputs[name] = [render(payload) for payload in data]
+        elapsed = time.perf_counter() - began
+        rows.append({
+            'payload': kind,
+            'renderer': name,
+            'codes': count,
+            'ms_per_code': elapsed / count * 1000,
+            'bytes_per_code': sum(map(len, outputs[name])) / count,
+        })
+    identical = all(
+        np.array_equal(pixels(old), pixels(new))
+        for old, new in zip(outputs['pil'], outputs['png'])
+    )
+    return rows, identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--codes', type=int, default=500, help='QR codes per payload kind')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    rows, identical = [], True
+    for kind in ('json', 'token', 'url'):
+        kind_rows, kind_identical = run(kind, args.codes)
+        rows += kind_rows
+        identical &= kind_identical
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        header = f"{'payload':<7} {'renderer':<8} {'codes':>6} {'ms/code':>8} {'bytes/code':>10} {'speedup':>8}"
+        print(header)
+        print('-' * len(header))
+        for row in rows:
+            baseline = next(r for r in rows if r['payload'] == row['payload'] and r['renderer'] == 'pil')
+            print(
+                f"{row['payload']:<7} {row['renderer']:<8} {row['codes']:>6} {row['ms_per_code']:>8.2f} "
+                f"{row['bytes_per_code']:>10.0f} {baseline['ms_per_code'] / row['ms_per_code']:>7.1f}x"
+            )
+        print('png pixels identical to pil:', 'yes' if identical else 'NO')
+
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
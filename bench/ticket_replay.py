@@ -0,0 +1,113 @@
+"""Scanner backlog replay benchmark for nekodigi/ticket-app.
+
+A handheld scanner that comes back from a dead zone has a queue of scans
+to upload. This replays the same backlog against the Firebase stand-in
+(nekodigi/ticket-app/firebase_standin.py) with an artificial round
+trip, two ways:
+
+    single  one POST /api/validate-ticket per scan, in order, as the
+            scanner does today
+    bulk    one POST /api/validate-tickets carrying the whole backlog
+
+The backlog scans every ticket once and repeats --duplicates of them
+(double scans at the gate), so both modes must accept exactly --tickets.
+
+Usage:
+    python bench/ticket_replay.py [--tickets N] [--duplicates N] [--latency-ms MS] [--json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, 'nekodigi', 'ticket-app')
+
+sys.path.insert(0, APP_DIR)
+from firebase_standin import FirebaseStandIn  # noqa: E402
+
+
+def load_app(database_url):
+    os.environ['FIREBASE_DATABASE_URL'] = database_url
+    os.environ['TICKET_CACHE'] = '0'
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    sys.modules.pop('main', None)
+    import main
+    return main
+
+
+def backlog(ids, duplicates):
+    start = datetime(2026, 1, 1, 18, 0)
+    scans = [(ticket_id, start + timedelta(seconds=n)) for n, ticket_id in enumerate(ids)]
+    for ticket_id in random.sample(ids, duplicates):
+        scans.append((ticket_id, start + timedelta(seconds=len(scans))))
+    return [{'ticket_id': ticket_id, 'scanned_at': scanned.isoformat()} for ticket_id, scanned in scans]
+
+
+def run(mode, tickets, duplicates, latency):
+    standin = FirebaseStandIn(latency=latency).start()
+    try:
+        app = load_app(standin.url)
+        records = app.new_ticket_records('bench', tickets)
+        app.firebase_patch("", app.create_updates(records, 'bench'))
+        scans = backlog(list(records), duplicates)
+        client = app.app.test_client()
+
+        requests_before = standin.db.requests
+        began = time.perf_counter()
+        if mode == 'single':
+            accepted = sum(
+                1 for scan in scans
+                if client.post('/api/validate-ticket', json={'ticket_id': scan['ticket_id']}).get_json().get('valid')
+            )
+            app.get_background().shutdown(wait=True)
+        else:
+            results = client.post('/api/validate-tickets', json={'scans': scans}).get_json()['results']
+            accepted = sum(1 for result in results if result['valid'])
+        elapsed = time.perf_counter() - began
+
+        return {
+            'mode': mode,
+            'scans': len(scans),
+            'http_requests': len(scans) if mode == 'single' else 1,
+            'accepted': accepted,
+            'db_requests': standin.db.requests - requests_before,
+            'seconds': elapsed,
+        }
+    finally:
+        standin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=300, help='tickets in the backlog')
+    parser.add_argument('--duplicates', type=int, default=30, help='extra repeat scans')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='stand-in delay per request')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    rows = [run(mode, args.tickets, args.duplicates, args.latency_ms / 1000) for mode in ('single', 'bulk')]
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        header = f"{'mode':<6} {'scans':>6} {'http reqs':>9} {'accepted':>9} {'db reqs':>8} {'seconds':>8}"
+        print(header)
+        print('-' * len(header))
+        for row in rows:
+            print(
+                f"{row['mode']:<6} {row['scans']:>6} {row['http_requests']:>9} {row['accepted']:>9} "
+                f"{row['db_requests']:>8} {row['seconds']:>8.2f}"
+            )
+
+    if any(row['accepted'] != args.tickets for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Concurrent redeem stress benchmark for nekokazu/ticket-app.
+
+Creates a batch of tickets, then has many threads ("gate scanners") redeem
+them at the same time, every ticket being scanned by several gates at once.
+Each ticket must be redeemed exactly once; any ticket with more than one
+successful redeem is reported as a double redemption and makes the run fail.
+
+Modes:
+    store   call the storage backend's redeem() directly
+    http    POST /api/tickets/<id>/verify through the Flask test client
+
+Backends:
+    memory  MemoryTicketStore (lock-striped compare-and-set)
+    sqlite  SQLiteTicketStore in a temporary WAL database
+
+Usage:
+    python bench/tickets.py [--tickets N] [--gates N] [--scans N] [--backend NAME ...] [--mode NAME ...] [--json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, 'nekokazu', 'ticket-app')
+
+
+def load_app(backend, directory):
+    """Import the ticket app with the requested storage backend"""
+    if backend == 'sqlite':
+        os.environ['TICKET_DB_PATH'] = os.path.join(directory, 'tickets.db')
+    else:
+        os.environ.pop('TICKET_DB_PATH', None)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    for name in ('main', 'storage'):
+        sys.modules.pop(name, None)
+    import main
+    return main
+
+
+def make_tickets(store, count):
+    ids = []
+    for i in range(count):
+        ticket_id = str(uuid.uuid4())
+        store.add({
+            'id': ticket_id,
+            'name': f'bench {i}',
+            'description': '',
+            'created_at': '2025-01-01T00:00:00',
+            'used': False,
+            'used_at': None,
+        })
+        ids.append(ticket_id)
+    return ids
+
+
+def store_redeem(app):
+    store = app.tickets_storage
+
+    def redeem(ticket_id):
+        return store.redeem(ticket_id, '2025-01-01T12:00:00')[0] == 'ok'
+    return redeem
+
+
+def http_redeem(app):
+    local = threading.local()
+
+    def redeem(ticket_id):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.app.test_client()
+        return client.post(f'/api/tickets/{ticket_id}/verify').status_code == 200
+    return redeem
+
+
+MODES = {'store': store_redeem, 'http': http_redeem}
+
+
+def run(backend, mode, tickets, gates, scans):
+    """Redeem every ticket ``scans`` times from ``gates`` threads at once"""
+    with tempfile.TemporaryDirectory() as directory:
+        app = load_app(backend, directory)
+        ids = make_tickets(app.tickets_storage, tickets)
+        redeem = MODES[mode](app)
+
+        # Every gate walks the same tickets from a different offset, so the
+        # scans of one ticket land on several gates at roughly the same time
+        work = [[ids[(i + gate * tickets // gates) % tickets] for i in range(tickets)] * scans
+                for gate in range(gates)]
+        wins = [Counter() for _ in range(gates)]
+        latencies = [[] for _ in range(gates)]
+        start = threading.Barrier(gates + 1)
+
+        def gate(n):
+            start.wait()
+            for ticket_id in work[n]:
+                began = time.perf_counter_ns()
+                if redeem(ticket_id):
+                    wins[n][ticket_id] += 1
+                latencies[n].append(time.perf_counter_ns() - began)
+
+        threads = [threading.Thread(target=gate, args=(n,)) for n in range(gates)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        total = sum(wins, Counter())
+        samples = sorted(sample for gate_samples in latencies for sample in gate_samples)
+        return {
+            'backend': backend,
+            'mode': mode,
+            'requests': len(samples),
+            'redeemed': len(total),
+            'missed': tickets - len(total),
+            'double_redemptions': sum(1 for count in total.values() if count > 1),
+            'requests_per_s': len(samples) / elapsed,
+            'p50_us': samples[len(samples) // 2] / 1000,
+            'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1000,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=2000, help='tickets to create per run')
+    parser.add_argument('--gates', type=int, default=16, help='concurrent scanner threads')
+    parser.add_argument('--scans', type=int, default=2, help='times each gate scans every ticket')
+    parser.add_argument('--backend', action='append', choices=('memory', 'sqlite'), help='backends (default: all)')
+    parser.add_argument('--mode', action='append', choices=sorted(MODES), help='modes (default: all)')
+    parser.add_argument('--switch-interval', type=float, default=1e-6,
+                        help='sys.setswitchinterval while running, small values force more thread interleaving')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    sys.setswitchinterval(args.switch_interval)
+    rows = [run(backend, mode, args.tickets, args.gates, args.scans)
+            for backend in args.backend or ('memory', 'sqlite')
+            for mode in args.mode or ('store', 'http')]
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        header = f"{'backend':<8} {'mode':<6} {'requests':>9} {'redeemed':>9} {'missed':>7} {'double':>7} {'req/s':>10} {'p50 us':>9} {'p99 us':>9}"
+        print(header)
+        print('-' * len(header))
+        for row in rows:
+            print(
+                f"{row['backend']:<8} {row['mode']:<6} {row['requests']:>9} {row['redeemed']:>9} "
+                f"{row['missed']:>7} {row['double_redemptions']:>7} {row['requests_per_s']:>10.0f} "
+                f"{row['p50_us']:>9.1f} {row['p99_us']:>9.1f}"
+            )
+
+    if any(row['double_redemptions'] or row['missed'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
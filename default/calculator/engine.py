@@ -0,0 +1,759 @@
+"""Expression engine for the calculator API.
+
+Expressions are tokenized and parsed into a small whitelisted AST, which is
+then compiled into a reusable Python callable. Compiled expressions are kept
+in a bounded LRU cache keyed by the normalized expression text, so repeated
+expressions skip tokenizing and parsing entirely.
+"""
+
+import math
+import multiprocessing
+import operator
+import queue
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+
+class ExpressionError(ValueError):
+    """Raised when an expression cannot be tokenized, parsed or compiled"""
+
+
+class ExpressionCostError(ExpressionError):
+    """Raised when an expression is too expensive to evaluate"""
+
+
+class EvaluationTimeout(ExpressionCostError):
+    """Raised when an isolated evaluation misses its deadline"""
+
+
+# Cost limits checked before an expression is compiled
+MAX_TOKENS = 500
+MAX_DEPTH = 50
+MAX_EXPONENT_BITS = 64
+
+# Integer results are written out as decimal text, which Python refuses past
+# sys.get_int_max_str_digits() digits (0 means no limit), so cap their size there
+_MAX_STR_DIGITS = getattr(sys, 'get_int_max_str_digits', lambda: 0)()
+MAX_INTEGER_BITS = min(1 << 20, int(_MAX_STR_DIGITS * math.log2(10))) if _MAX_STR_DIGITS else 1 << 20
+
+
+# Whitelisted functions (same names the front end sends)
+FUNCTIONS = {
+    'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'asin': math.asin,
+    'acos': math.acos,
+    'atan': math.atan,
+    'sqrt': math.sqrt,
+    'log': math.log10,
+    'ln': math.log,
+    'exp': math.exp,
+    'abs': abs,
+    'pow': math.pow,
+}
+
+CONSTANTS = {
+    'π': math.pi,
+    'pi': math.pi,
+    'e': math.e,
+}
+
+BINARY_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '//': operator.floordiv,
+    '%': operator.mod,
+    '**': operator.pow,
+}
+
+_SYMBOLS = str.maketrans({'÷': '/', '×': '*'})
+
+_TOKEN_RE = re.compile(r"""
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<op>\*\*|//|[-+*/%(),])
+  | (?P<space>\s+)
+""", re.VERBOSE)
+
+
+def normalize(expression):
+    """Normalize display symbols and whitespace into the canonical form"""
+    expression = expression.translate(_SYMBOLS).replace('^', '**')
+    return ' '.join(expression.split())
+
+
+def tokenize(expression):
+    """Split a normalized expression into (kind, value) tokens"""
+    tokens = []
+    pos = 0
+    length = len(expression)
+    while pos < length:
+        match = _TOKEN_RE.match(expression, pos)
+        if match is None:
+            raise ExpressionError(f'unexpected character {expression[pos]!r}')
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append((kind, match.group()))
+            if len(tokens) > MAX_TOKENS:
+                raise ExpressionCostError(f'expression is longer than {MAX_TOKENS} tokens')
+        pos = match.end()
+    tokens.append(('end', ''))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser producing tuple-based AST nodes
+
+    Node shapes:
+        ('num', value)
+        ('name', identifier)
+        ('call', function_name, [args])
+        ('neg', operand) / ('pos', operand)
+        ('bin', op, left, right)
+
+    Operator precedence and associativity follow Python, so results match
+    what the previous ``eval`` based implementation produced.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, text = self.advance()
+        if text != value:
+            raise ExpressionError(f'expected {value!r}, got {text or "end"!r}')
+
+    def parse(self):
+        node = self.expr()
+        if self.peek()[0] != 'end':
+            raise ExpressionError(f'unexpected token {self.peek()[1]!r}')
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek()[1] in ('+', '-'):
+            op = self.advance()[1]
+            node = ('bin', op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek()[1] in ('*', '/', '//', '%'):
+            op = self.advance()[1]
+            node = ('bin', op, node, self.unary())
+        return node
+
+    def unary(self):
+        # Every nested construct recurses through here, so it bounds the depth
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise ExpressionCostError(f'expression is nested deeper than {MAX_DEPTH} levels')
+        try:
+            text = self.peek()[1]
+            if text == '-':
+                self.advance()
+                return ('neg', self.unary())
+            if text == '+':
+                self.advance()
+                return ('pos', self.unary())
+            return self.power()
+        finally:
+            self.depth -= 1
+
+    def power(self):
+        node = self.atom()
+        if self.peek()[1] == '**':
+            self.advance()
+            # Right associative, and binds tighter than a unary minus on its left
+            node = ('bin', '**', node, self.unary())
+        return node
+
+    def atom(self):
+        kind, text = self.advance()
+        if kind == 'number':
+            if any(c in text for c in '.eE'):
+                return ('num', float(text))
+            return ('num', int(text))
+        if kind == 'name':
+            if self.peek()[1] == '(':
+                if text not in FUNCTIONS:
+                    raise ExpressionError(f'unknown function {text!r}')
+                self.advance()
+                args = []
+                if self.peek()[1] != ')':
+                    args.append(self.expr())
+                    while self.peek()[1] == ',':
+                        self.advance()
+                        args.append(self.expr())
+                self.expect(')')
+                return ('call', text, args)
+            return ('name', text)
+        if text == '(':
+            node = self.expr()
+            self.expect(')')
+            return node
+        raise ExpressionError(f'unexpected token {text or "end"!r}')
+
+
+def parse(expression):
+    """Parse a normalized expression into an AST"""
+    return _Parser(tokenize(expression)).parse()
+
+
+def parse_tokens(tokens):
+    """Parse already lexed (kind, value) tokens, as tokenize returns them"""
+    if len(tokens) > MAX_TOKENS:
+        raise ExpressionCostError(f'expression is longer than {MAX_TOKENS} tokens')
+    return _Parser(list(tokens) + [('end', '')]).parse()
+
+
+def variable_names(node):
+    """Return the set of free variable names referenced by an AST"""
+    kind = node[0]
+    if kind == 'name':
+        return set() if node[1] in CONSTANTS else {node[1]}
+    if kind == 'num':
+        return set()
+    if kind == 'call':
+        return set().union(*[variable_names(arg) for arg in node[2]])
+    if kind in ('neg', 'pos'):
+        return variable_names(node[1])
+    return variable_names(node[2]) | variable_names(node[3])
+
+
+def integer_bits(node):
+    """Estimate an upper bound on the bit length of an integer-valued node
+
+    Returns None for nodes that evaluate to floats, whose cost is bounded by
+    the float range. Raises ExpressionCostError as soon as the estimated
+    integer growth exceeds MAX_INTEGER_BITS, before anything is computed.
+    """
+    kind = node[0]
+
+    if kind == 'num':
+        return node[1].bit_length() if isinstance(node[1], int) else None
+
+    if kind == 'name':
+        return None
+
+    if kind == 'call':
+        arg_bits = [integer_bits(arg) for arg in node[2]]
+        # abs() is the only whitelisted function that keeps integers integral
+        if node[1] == 'abs' and len(arg_bits) == 1:
+            return arg_bits[0]
+        return None
+
+    if kind in ('neg', 'pos'):
+        return integer_bits(node[1])
+
+    op, left, right = node[1], integer_bits(node[2]), integer_bits(node[3])
+    if left is None or right is None:
+        return None
+
+    if op in ('+', '-'):
+        bits = max(left, right) + 1
+    elif op == '*':
+        bits = left + right
+    elif op == '/':
+        return None
+    elif op == '//':
+        bits = left
+    elif op == '%':
+        bits = right
+    else:
+        exponent = node[3]
+        if exponent[0] == 'num':
+            exponent = abs(exponent[1])
+        elif right > MAX_EXPONENT_BITS:
+            raise ExpressionCostError('exponent is too large')
+        else:
+            exponent = 1 << right
+        base = node[2]
+        if base[0] == 'num' and abs(base[1]) > 1:
+            # A literal base has an exact size, so 10 ** 4000 is not overestimated
+            bits = math.floor(exponent * math.log2(abs(base[1]))) + 1
+        else:
+            bits = left * exponent
+
+    if bits > MAX_INTEGER_BITS:
+        raise ExpressionCostError(f'result would exceed {MAX_INTEGER_BITS} bits')
+    return bits
+
+
+def compile_ast(node, functions=FUNCTIONS, constants=CONSTANTS):
+    """Compile an AST into a callable taking a variables mapping
+
+    ``functions`` and ``constants`` are resolved once at compile time, so the
+    same AST can be compiled against a different function table.
+    """
+    kind = node[0]
+
+    if kind == 'num':
+        value = node[1]
+        return lambda env: value
+
+    if kind == 'name':
+        name = node[1]
+        if name in constants:
+            value = constants[name]
+            return lambda env: value
+
+        def lookup(env):
+            try:
+                return env[name]
+            except KeyError:
+                raise ExpressionError(f'unknown name {name!r}') from None
+        return lookup
+
+    if kind == 'call':
+        func = functions[node[1]]
+        args = [compile_ast(arg, functions, constants) for arg in node[2]]
+        if len(args) == 1:
+            arg, = args
+            return lambda env: func(arg(env))
+        return lambda env: func(*[arg(env) for arg in args])
+
+    if kind == 'neg':
+        operand = compile_ast(node[1], functions, constants)
+        return lambda env: -operand(env)
+
+    if kind == 'pos':
+        operand = compile_ast(node[1], functions, constants)
+        return lambda env: +operand(env)
+
+    if kind == 'bin':
+        op = BINARY_OPERATORS[node[1]]
+        left = compile_ast(node[2], functions, constants)
+        right = compile_ast(node[3], functions, constants)
+        return lambda env: op(left(env), right(env))
+
+    raise ExpressionError(f'unknown node {kind!r}')
+
+
+def vector_functions():
+    """Function whitelist mapped onto NumPy ufuncs for vectorized evaluation"""
+    import numpy as np
+
+    return {
+        'sin': np.sin,
+        'cos': np.cos,
+        'tan': np.tan,
+        'asin': np.arcsin,
+        'acos': np.arccos,
+        'atan': np.arctan,
+        'sqrt': np.sqrt,
+        'log': np.log10,
+        'ln': np.log,
+        'exp': np.exp,
+        'abs': np.abs,
+        'pow': np.power,
+    }
+
+
+class ExpressionCache:
+    """Bounded LRU cache of compiled expressions with hit/miss counters
+
+    ``functions`` is the function table expressions are compiled against. It
+    may be a zero-argument factory, which is called on the first compile so
+    optional dependencies are only imported when actually used.
+    """
+
+    def __init__(self, maxsize=1024, functions=FUNCTIONS):
+        self.maxsize = maxsize
+        self.functions = functions
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, expression):
+        """Return the compiled callable for an expression, compiling on a miss"""
+        key = normalize(expression)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        if callable(self.functions):
+            self.functions = self.functions()
+        tree = parse(key)
+        integer_bits(tree)
+        compiled = compile_ast(tree, self.functions)
+
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+expression_cache = ExpressionCache()
+vector_cache = ExpressionCache(functions=vector_functions)
+
+
+def evaluate(expression, variables=None):
+    """Evaluate an expression through the compiled expression cache
+
+    Raises ExpressionError for complex results (e.g. ``(-1) ** 0.5``), which
+    the API has no way to represent.
+    """
+    return _real(expression_cache.get(expression)(variables or {}))
+
+
+def evaluate_tokens(tokens, variables=None):
+    """Evaluate lexed tokens without going through the expression cache
+
+    For one-off expressions such as live-preview prefixes, which would only
+    push frequently used expressions out of the cache.
+    """
+    tree = parse_tokens(tokens)
+    integer_bits(tree)
+    return _real(compile_ast(tree)(variables or {}))
+
+
+def _real(result):
+    if isinstance(result, complex):
+        raise ExpressionError('result is a complex number')
+    return result
+
+
+def evaluate_vectorized(expression, variables):
+    """Evaluate an expression over NumPy arrays of its free variables
+
+    All variable arrays are broadcast against each other, and the result is
+    always a float64 array of the broadcast shape. Domain errors and division
+    by zero produce NaN/inf instead of raising, as NumPy ufuncs do.
+    """
+    import numpy as np
+
+    names = list(variables)
+    arrays = np.broadcast_arrays(*[np.asarray(variables[name], dtype=np.float64) for name in names])
+    env = dict(zip(names, arrays))
+    shape = arrays[0].shape if arrays else ()
+
+    compiled = vector_cache.get(expression)
+    with np.errstate(all='ignore'):
+        result = compiled(env)
+    return np.broadcast_to(np.asarray(result, dtype=np.float64), shape)
+
+
+def _vector_function(expression, variable):
+    """Compile an expression into a one-variable vectorized function"""
+    import numpy as np
+
+    compiled = vector_cache.get(expression)
+
+    def function(x):
+        with np.errstate(all='ignore'):
+            result = compiled({variable: x})
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), x.shape)
+    return function
+
+
+def _bisect(f, lo, hi, f_lo):
+    """Shrink every sign-change bracket [lo, hi] at once until none can shrink
+
+    Stops when each bracket is down to two adjacent floats, which takes at
+    most about 2100 halvings even for a bracket spanning the float64 range.
+    Returns the final midpoints.
+    """
+    import numpy as np
+
+    while True:
+        # Halve each end first so wide brackets cannot overflow to inf
+        mid = lo / 2 + hi / 2
+        shrinking = (mid > lo) & (mid < hi)
+        if not np.any(shrinking):
+            return lo / 2 + hi / 2
+        f_mid = f(mid)
+        left = shrinking & (np.sign(f_mid) == np.sign(f_lo))
+        right = shrinking & ~left
+        lo = np.where(left, mid, lo)
+        f_lo = np.where(left, f_mid, f_lo)
+        hi = np.where(right, mid, hi)
+
+
+def _sign_changes(xs, ys):
+    """Brackets (lo, hi, f(lo)) between adjacent finite samples of opposite sign"""
+    import numpy as np
+
+    finite = np.isfinite(ys)
+    signs = np.sign(ys)
+    brackets = finite[:-1] & finite[1:] & (signs[:-1] * signs[1:] < 0)
+    return xs[:-1][brackets], xs[1:][brackets], ys[:-1][brackets]
+
+
+def _is_root(f, points, scale):
+    """Whether f vanishes at each converged bracket point
+
+    At a real crossing, bisection ends next to the root and |f| there is
+    rounding noise. Across a pole (tan at π/2, 1/x at 0), |f| is huge there
+    instead. Residuals are compared with the largest |f| seen on the grid.
+    """
+    import numpy as np
+
+    if not points.size:
+        return np.zeros(0, dtype=bool)
+    return np.abs(f(points)) <= 1e-9 * scale
+
+
+def solve(expression, variable, a, b, samples=10001, max_roots=1000):
+    """Find the roots of an expression in [a, b]
+
+    The expression is sampled on a uniform grid in one vectorized call, and
+    every sign change is then refined by bisection over all brackets at once.
+    Sign changes across poles (e.g. tan at π/2) are discarded because the
+    function does not approach zero there.
+    """
+    import numpy as np
+
+    if not a < b:
+        raise ValueError('区間は a < b で指定してください')
+
+    f = _vector_function(expression, variable)
+    xs = np.linspace(a, b, samples)
+    ys = f(xs)
+
+    finite = np.isfinite(ys)
+    exact = xs[finite & (ys == 0)]
+    scale = float(np.abs(ys[finite]).max()) if finite.any() else 0.0
+
+    roots = _bisect(f, *_sign_changes(xs, ys))
+    roots = roots[_is_root(f, roots, scale)]
+
+    roots = np.unique(np.concatenate([exact, roots]))
+    if roots.size > max_roots:
+        raise ExpressionCostError(f'more than {max_roots} roots in the interval')
+    return roots
+
+
+def integrate(expression, variable, a, b, panels=256, order=8):
+    """Definite integral of an expression over [a, b]
+
+    Uses composite Gauss-Legendre quadrature, evaluating every node of every
+    panel in one vectorized call. Returns the integral and an error estimate
+    from comparing against the result with half as many panels.
+
+    Gauss nodes never land on a singularity, so the quadrature alone would
+    return a finite number for a divergent integral (0 for 1/x on [-1, 1]).
+    The integrand is therefore also checked at the interior panel edges, and
+    every sign change between samples is bisected to look for a pole. Either
+    kind of singularity raises ValueError. Singularities at a or b itself are
+    allowed, since many of those are integrable (1/sqrt(x) on [0, 1]).
+    """
+    import numpy as np
+
+    if a == b:
+        return 0.0, 0.0
+    if not (math.isfinite(a) and math.isfinite(b)):
+        raise ValueError('積分区間は有限の値で指定してください')
+
+    f = _vector_function(expression, variable)
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+
+    def quadrature(count):
+        edges = np.linspace(a, b, count + 1)
+        half = (edges[1:] - edges[:-1])[:, None] / 2
+        centers = (edges[1:] + edges[:-1])[:, None] / 2
+        points = centers + half * nodes
+        values = f(points)
+        if not np.all(np.isfinite(values)):
+            raise ValueError('被積分関数が区間内で有限ではありません')
+        return float((values * weights * half).sum()), edges[1:-1], points, values
+
+    result, edges, points, values = quadrature(panels)
+    edge_values = f(edges)
+    if not np.all(np.isfinite(edge_values)):
+        raise ValueError('被積分関数が区間内で発散します')
+
+    xs = np.concatenate([points.ravel(), edges])
+    ys = np.concatenate([values.ravel(), edge_values])
+    by_x = np.argsort(xs)
+    xs, ys = xs[by_x], ys[by_x]
+    crossings = _bisect(f, *_sign_changes(xs, ys))
+    poles = crossings[~_is_root(f, crossings, float(np.abs(ys).max()))]
+    if poles.size:
+        raise ValueError(f'被積分関数が x = {poles[0]:.10g} 付近で発散します')
+
+    error = abs(result - quadrature(panels // 2)[0])
+    return result, error
+
+
+class RunningStats:
+    """Streaming aggregates over NumPy chunks (count, sum, mean, min, max, stdev)
+
+    Chunks are merged with Chan's parallel variance update, so the mean and
+    standard deviation stay numerically stable without keeping the values.
+    Non-finite values are counted as invalid and left out of the aggregates.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.invalid = 0
+        self.sum = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        import numpy as np
+
+        finite = values[np.isfinite(values)]
+        self.invalid += values.size - finite.size
+        n = finite.size
+        if n == 0:
+            return
+
+        chunk_mean = float(finite.mean())
+        chunk_m2 = float(((finite - chunk_mean) ** 2).sum())
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.m2 += chunk_m2 + delta * delta * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+        self.sum += float(finite.sum())
+        self.min = min(self.min, float(finite.min()))
+        self.max = max(self.max, float(finite.max()))
+
+    def stdev(self):
+        """Sample standard deviation, as statistics.stdev computes it"""
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def summary(self):
+        empty = self.count == 0
+        return {
+            'count': self.count,
+            'invalid': self.invalid,
+            'sum': self.sum,
+            'mean': None if empty else self.mean,
+            'min': None if empty else self.min,
+            'max': None if empty else self.max,
+            'stdev': self.stdev(),
+        }
+
+
+def _worker_loop(conn):
+    """Evaluate expressions received over a pipe until it is closed"""
+    # Signal readiness so startup time never counts against a deadline
+    conn.send(None)
+    while True:
+        try:
+            expression = conn.recv()
+        except EOFError:
+            return
+        try:
+            if isinstance(expression, str):
+                conn.send((True, evaluate(expression)))
+            else:
+                conn.send((True, evaluate_tokens(expression)))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class IsolatedEvaluator:
+    """Evaluate expressions in a pool of worker processes with a hard deadline
+
+    A worker that misses the deadline is killed and replaced, so a runaway
+    evaluation can never pin the calling process. Workers are started on the
+    first evaluation.
+    """
+
+    def __init__(self, processes=2, timeout=1.0):
+        self.processes = processes
+        self.timeout = timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _start_worker(self):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_loop, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        conn.recv()
+        return process, conn
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._started:
+                for _ in range(self.processes):
+                    self._idle.put(self._start_worker())
+                self._started = True
+
+    def _replace(self, process, conn):
+        process.kill()
+        process.join()
+        conn.close()
+        return self._start_worker()
+
+    def evaluate(self, expression):
+        """Evaluate an expression in a worker, raising EvaluationTimeout on deadline
+
+        ``expression`` may also be a list of tokens, evaluated with evaluate_tokens.
+        """
+        self._ensure_started()
+        process, conn = self._idle.get()
+        try:
+            conn.send(expression)
+            if not conn.poll(self.timeout):
+                process, conn = self._replace(process, conn)
+                raise EvaluationTimeout(f'evaluation exceeded {self.timeout} seconds')
+            ok, value = conn.recv()
+        except (EOFError, OSError):
+            process, conn = self._replace(process, conn)
+            raise ExpressionError('evaluation worker exited unexpectedly') from None
+        finally:
+            self._idle.put((process, conn))
+
+        if ok:
+            return value
+        raise value
+
+    def close(self):
+        """Stop all idle workers"""
+        while True:
+            try:
+                process, conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            process.kill()
+            process.join()
+            conn.close()
@@ -0,0 +1,113 @@
+"""Incremental expression state for the live-preview WebSocket.
+
+The browser sends keystroke deltas instead of the whole expression. Each
+connection keeps a LiveExpression whose token list is updated in place:
+tokens the edit cannot affect are kept, and only the text from the last of
+them onwards is re-lexed. The partially typed expression is then completed
+(dangling operators dropped, open parentheses closed) into parser tokens,
+which engine.evaluate_tokens evaluates without normalizing and lexing the
+text again. Previews bypass the compiled expression cache: nearly every
+prefix is seen once, and caching them would evict the entries that
+/api/calculate reuses.
+
+Only lexing is incremental; every preview parses, cost-checks and compiles
+the whole completed token list. A parsed prefix cannot simply be kept: the
+next operator can rebind it ("2*3" becomes the left operand of "+4" but the
+right operand of "^4"), and completed() rewrites the tail on every edit. The
+parser input is capped at engine.MAX_TOKENS, where the full pass takes under
+a millisecond, so a re-parse per keystroke is well within budget.
+"""
+
+import bisect
+import re
+
+from engine import ExpressionError, FUNCTIONS
+
+# Maximum length of a live expression
+MAX_LIVE_LENGTH = 2000
+
+_LIVE_TOKEN_RE = re.compile(r"""
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<op>\*\*|//|[-+*/%(),^×÷])
+  | (?P<space>\s+)
+  | (?P<error>.)
+""", re.VERBOSE)
+
+_CANONICAL = {'^': '**', '×': '*', '÷': '/'}
+
+# How far past its end a token match can look: a number checks for an
+# exponent, so "1" followed by "e+" may still become "1e+5"
+_LOOKAHEAD = 3
+
+
+class LiveExpression:
+    """A partially typed expression updated by (pos, delete, insert) deltas"""
+
+    def __init__(self):
+        self.text = ''
+        # (kind, text, start, end) for every non-space token
+        self.tokens = []
+        self._ends = []
+
+    def apply(self, pos, delete=0, insert=''):
+        """Replace ``delete`` characters at ``pos`` with ``insert``"""
+        if not 0 <= pos <= len(self.text) or delete < 0 or pos + delete > len(self.text):
+            raise ExpressionError('edit is outside the expression')
+        text = self.text[:pos] + insert + self.text[pos + delete:]
+        if len(text) > MAX_LIVE_LENGTH:
+            raise ExpressionError(f'expression is longer than {MAX_LIVE_LENGTH} characters')
+        self.text = text
+
+        # A token is unaffected only if its match never looked at the edited
+        # text. Anything ending closer than _LOOKAHEAD may grow or merge with
+        # what follows ("1" + "e" + "5" is "1e5", "*" + "*" is "**"), so re-lex
+        # from the end of the last token that is certainly complete
+        keep = bisect.bisect_right(self._ends, pos - _LOOKAHEAD)
+        start = self._ends[keep - 1] if keep else 0
+        del self.tokens[keep:]
+        del self._ends[keep:]
+        self._lex(start)
+
+    def _lex(self, pos):
+        text = self.text
+        while pos < len(text):
+            # Unknown characters become error tokens, so the state stays
+            # consistent and a later edit can still turn them into a number
+            match = _LIVE_TOKEN_RE.match(text, pos)
+            if match.lastgroup != 'space':
+                self.tokens.append((match.lastgroup, match.group(), match.start(), match.end()))
+                self._ends.append(match.end())
+            pos = match.end()
+
+    def completed(self):
+        """Return the longest previewable form as parser tokens, or None
+
+        Trailing operators, commas, open parentheses and function names that
+        are still waiting for their arguments are dropped, and any remaining
+        open parentheses are closed. The tokens are (kind, value) pairs with
+        canonical operators, as engine.tokenize produces them.
+        """
+        end = len(self.tokens)
+        while end:
+            kind, text = self.tokens[end - 1][:2]
+            if kind == 'number' or text == ')' or (kind == 'name' and text not in FUNCTIONS):
+                break
+            end -= 1
+        if not end:
+            return None
+
+        tokens = []
+        depth = 0
+        for kind, text, _, _ in self.tokens[:end]:
+            if kind == 'error':
+                raise ExpressionError(f'unexpected character {text!r}')
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+                if depth < 0:
+                    raise ExpressionError("unmatched ')'")
+            tokens.append((kind, _CANONICAL.get(text, text)))
+        tokens.extend([('op', ')')] * depth)
+        return tokens
@@ -1,8 +1,36 @@
 import functions_framework
-from flask import send_file, jsonify
-import os
+from flask import send_file, jsonify, Response
+import csv
+import io
+import itertools
+import json
 import math
-import re
+import os
+
+from engine import (
+    evaluate, evaluate_tokens, evaluate_vectorized, normalize, parse, variable_names, solve, integrate,
+    ExpressionCostError, IsolatedEvaluator, RunningStats,
+    CONSTANTS, FUNCTIONS,
+)
+from live import LiveExpression
+
+# Maximum number of expressions accepted by /api/calculate/batch
+MAX_BATCH_SIZE = 10000
+
+# Maximum length of one line of /api/calculate/stream input
+MAX_STREAM_LINE_BYTES = 64 * 1024
+
+# Number of CSV rows evaluated per NumPy chunk in /api/calculate/dataset
+DATASET_CHUNK_ROWS = 8192
+
+# Maximum number of points evaluated by /api/calculate/sweep
+MAX_SWEEP_POINTS = 1000000
+
+# Optional isolated evaluation: set CALC_EVAL_TIMEOUT (seconds) to run every
+# expression in a worker process that is killed when it misses the deadline
+EVAL_TIMEOUT = float(os.environ.get('CALC_EVAL_TIMEOUT', 0))
+EVAL_PROCESSES = int(os.environ.get('CALC_EVAL_PROCESSES', 2))
+isolated_evaluator = IsolatedEvaluator(EVAL_PROCESSES, EVAL_TIMEOUT) if EVAL_TIMEOUT > 0 else None
 
 @functions_framework.http
 def main(request):
@@ -31,75 +59,397 @@ def main(request):
         try:
             data = request.get_json()
             expression = data.get('expression', '')
+        except Exception:
+            return jsonify({'success': False, 'error': '計算エラー'}), 400, headers
 
-            if not expression:
-                return jsonify({'success': False, 'error': '式が入力されていません'}), 400, headers
-
-            # Calculate the result
-            result = safe_eval(expression)
+        body, status = calculate(expression)
+        return jsonify(body), status, headers
 
-            # Format result
-            if isinstance(result, float):
-                if result.is_integer():
-                    result = int(result)
-                else:
-                    result = round(result, 10)
+    # API endpoint for batch calculation
+    if request.path == '/api/calculate/batch' and request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        expressions = data.get('expressions')
 
-            return jsonify({
-                'success': True,
-                'result': result
-            }), 200, headers
-
-        except ZeroDivisionError:
+        if not isinstance(expressions, list):
+            return jsonify({'success': False, 'error': '式のリストが必要です'}), 400, headers
+        if len(expressions) > MAX_BATCH_SIZE:
             return jsonify({
                 'success': False,
-                'error': '0で割ることはできません'
+                'error': f'一度に計算できる式は{MAX_BATCH_SIZE}件までです'
             }), 400, headers
+
+        results = [calculate(expression)[0] for expression in expressions]
+        return jsonify({
+            'success': True,
+            'results': results
+        }), 200, headers
+
+    # API endpoint for vectorized variable sweeps
+    if request.path == '/api/calculate/sweep' and request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        expression = data.get('expression', '')
+
+        if not expression:
+            return jsonify({'success': False, 'error': '式が入力されていません'}), 400, headers
+
+        try:
+            variables = sweep_variables(data.get('variables') or {})
+            result = format_column(evaluate_vectorized(expression, variables))
+        except ExpressionCostError:
+            return jsonify({'success': False, 'error': '計算量が大きすぎます'}), 400, headers
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400, headers
         except Exception as e:
-            return jsonify({
-                'success': False,
-                'error': '計算エラー'
-            }), 400, headers
+            return jsonify({'success': False, 'error': '計算エラー'}), 400, headers
+
+        return jsonify({
+            'success': True,
+            'result': result
+        }), 200, headers
+
+    # API endpoint for streaming NDJSON calculation
+    if request.path == '/api/calculate/stream' and request.method == 'POST':
+        return Response(
+            calculate_stream(request.stream),
+            mimetype='application/x-ndjson',
+            headers=headers
+        )
+
+    # API endpoint for evaluating an expression over CSV columns.
+    # The CSV is the raw request body so it can be read as a stream.
+    if request.path == '/api/calculate/dataset' and request.method == 'POST':
+        expression = request.args.get('expression', '')
+
+        if not expression:
+            return jsonify({'success': False, 'error': '式が入力されていません'}), 400, headers
+
+        try:
+            names = variable_names(parse(normalize(expression)))
+            chunks = dataset_chunks(request.stream, expression, names)
+            if request.args.get('output') == 'csv':
+                # Pull the first chunk now so header and expression errors become a 400
+                first = next(chunks, None)
+                return Response(
+                    dataset_csv(first, chunks),
+                    mimetype='text/csv',
+                    headers=headers
+                )
+
+            stats = RunningStats()
+            for result in chunks:
+                stats.update(result)
+        except ExpressionCostError:
+            return jsonify({'success': False, 'error': '計算量が大きすぎます'}), 400, headers
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400, headers
+        except Exception as e:
+            return jsonify({'success': False, 'error': '計算エラー'}), 400, headers
+
+        return jsonify({
+            'success': True,
+            'rows': stats.count + stats.invalid,
+            'aggregates': stats.summary()
+        }), 200, headers
+
+    # API endpoints for numeric root finding and definite integrals
+    if request.path in ('/api/calculate/solve', '/api/calculate/integrate') and request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        expression = data.get('expression', '')
+        variable = data.get('variable', 'x')
+
+        if not expression:
+            return jsonify({'success': False, 'error': '式が入力されていません'}), 400, headers
+
+        try:
+            a, b = float(data['a']), float(data['b'])
+            if request.path == '/api/calculate/solve':
+                body = {'roots': format_column(solve(expression, variable, a, b))}
+            else:
+                value, error = integrate(expression, variable, a, b)
+                body = {'result': format_result(value), 'error_estimate': error}
+        except ExpressionCostError:
+            return jsonify({'success': False, 'error': '計算量が大きすぎます'}), 400, headers
+        except (KeyError, TypeError):
+            return jsonify({'success': False, 'error': '区間 a, b が必要です'}), 400, headers
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400, headers
+        except Exception as e:
+            return jsonify({'success': False, 'error': '計算エラー'}), 400, headers
+
+        return jsonify({'success': True, **body}), 200, headers
 
     return jsonify({'error': 'Not found'}), 404, headers
 
 
-def safe_eval(expression):
-    """Safely evaluate mathematical expressions"""
+def calculate(expression):
+    """Evaluate one expression into the API response body and status code"""
+    if not expression:
+        return {'success': False, 'error': '式が入力されていません'}, 400
 
-    # Replace symbols
-    expression = expression.replace('π', str(math.pi))
-    expression = expression.replace('^', '**')
-    expression = expression.replace('÷', '/')
-    expression = expression.replace('×', '*')
-
-    # Replace function names with math module equivalents
-    expression = re.sub(r'\bsin\(', 'math.sin(', expression)
-    expression = re.sub(r'\bcos\(', 'math.cos(', expression)
-    expression = re.sub(r'\btan\(', 'math.tan(', expression)
-    expression = re.sub(r'\basin\(', 'math.asin(', expression)
-    expression = re.sub(r'\bacos\(', 'math.acos(', expression)
-    expression = re.sub(r'\batan\(', 'math.atan(', expression)
-    expression = re.sub(r'\bsqrt\(', 'math.sqrt(', expression)
-    expression = re.sub(r'\blog\(', 'math.log10(', expression)
-    expression = re.sub(r'\bln\(', 'math.log(', expression)
-    expression = re.sub(r'\bexp\(', 'math.exp(', expression)
-    expression = re.sub(r'\babs\(', 'abs(', expression)
-    expression = re.sub(r'\bpow\(', 'math.pow(', expression)
-
-    # Create a safe namespace with only math functions
-    safe_dict = {
-        'math': math,
-        'abs': abs,
-        '__builtins__': {}
-    }
+    return evaluation_body(lambda: safe_eval(expression))
+
+
+def evaluation_body(evaluate):
+    """Run an evaluation into the API response body and status code"""
+    try:
+        # Calculate the result
+        result = format_result(evaluate())
+        # Serialize here, so a result JSON can't hold (an int past the
+        # int-to-str digit limit, or an overflow to inf) is a 400 for this
+        # expression only
+        json.dumps(result, allow_nan=False)
 
-    # Evaluate the expression
-    result = eval(expression, safe_dict)
+        return {
+            'success': True,
+            'result': result
+        }, 200
 
+    except ZeroDivisionError:
+        return {
+            'success': False,
+            'error': '0で割ることはできません'
+        }, 400
+    except ExpressionCostError:
+        return {
+            'success': False,
+            'error': '計算量が大きすぎます'
+        }, 400
+    except Exception as e:
+        return {
+            'success': False,
+            'error': '計算エラー'
+        }, 400
+
+
+def format_result(result):
+    """Collapse integral floats to int and round the rest to 10 digits"""
+    if isinstance(result, float):
+        if result.is_integer():
+            return int(result)
+        return round(result, 10)
     return result
 
 
+def calculate_stream(stream):
+    """Evaluate an NDJSON stream of expressions, yielding one result line each
+
+    Each input line is a JSON string or an object with an ``expression`` key.
+    Lines are read and answered one at a time, so memory use does not depend
+    on the size of the input.
+    """
+    for line in read_lines(stream):
+        if line is None:
+            yield json.dumps({'success': False, 'error': '式が長すぎます'}) + '\n'
+            continue
+        if not line.strip():
+            continue
+
+        try:
+            item = json.loads(line)
+            expression = item.get('expression', '') if isinstance(item, dict) else item
+            yield json.dumps(calculate(expression)[0]) + '\n'
+        except Exception:
+            yield json.dumps({'success': False, 'error': '計算エラー'}) + '\n'
+
+
+def read_lines(stream):
+    """Read lines of at most MAX_STREAM_LINE_BYTES, yielding None for longer ones"""
+    while True:
+        line = stream.readline(MAX_STREAM_LINE_BYTES + 1)
+        if not line:
+            return
+        if len(line) > MAX_STREAM_LINE_BYTES and not line.endswith(b'\n'):
+            # Skip the rest of the oversized line without buffering it
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(MAX_STREAM_LINE_BYTES + 1)
+            yield None
+            continue
+        yield line
+
+
+def dataset_chunks(stream, expression, names):
+    """Evaluate an expression over a CSV stream, yielding one result array per chunk
+
+    Only the columns the expression refers to are converted to floats, and at
+    most DATASET_CHUNK_ROWS rows are held in memory at a time.
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = next(reader, None)
+    if header is None:
+        raise ValueError('CSVファイルが空です')
+
+    header = [name.strip() for name in header]
+    missing = sorted(names - set(header))
+    if missing:
+        raise ValueError(f'列が見つかりません: {", ".join(missing)}')
+    indexes = {name: header.index(name) for name in names}
+
+    rows = []
+    for row in reader:
+        rows.append(row)
+        if len(rows) == DATASET_CHUNK_ROWS:
+            yield evaluate_chunk(rows, expression, indexes)
+            rows = []
+    if rows:
+        yield evaluate_chunk(rows, expression, indexes)
+
+
+def evaluate_chunk(rows, expression, indexes):
+    """Evaluate one chunk of CSV rows, with unparsable cells becoming NaN"""
+    import numpy as np
+
+    variables = {}
+    for name, index in indexes.items():
+        cells = [row[index] if index < len(row) else '' for row in rows]
+        try:
+            variables[name] = np.asarray(cells, dtype=np.float64)
+        except ValueError:
+            variables[name] = np.array([to_float(cell) for cell in cells], dtype=np.float64)
+
+    result = evaluate_vectorized(expression, variables)
+    if result.ndim == 0:
+        result = np.full(len(rows), float(result))
+    return result
+
+
+def to_float(cell):
+    try:
+        return float(cell)
+    except ValueError:
+        return float('nan')
+
+
+def dataset_csv(first, chunks):
+    """Render result chunks as a single-column CSV
+
+    There is one line per input row, so rows that evaluate to NaN or an
+    infinity get an empty cell and the column stays aligned with the input.
+    """
+    yield 'result\n'
+    if first is None:
+        return
+    for result in itertools.chain([first], chunks):
+        yield ''.join('\n' if value is None else f'{value}\n' for value in format_column(result))
+
+
+def sweep_variables(spec):
+    """Build NumPy arrays from the variables of a sweep request
+
+    Each variable is either a list of values, a linspace range
+    ``{"start", "stop", "num"}`` or an arange range ``{"start", "stop", "step"}``.
+    """
+    import numpy as np
+
+    if not isinstance(spec, dict):
+        raise ValueError('variables はオブジェクトで指定してください')
+
+    variables = {}
+    for name, value in spec.items():
+        if not name.isidentifier() or name in FUNCTIONS or name in CONSTANTS:
+            raise ValueError(f'変数名が不正です: {name}')
+
+        if isinstance(value, list):
+            array = np.asarray(value, dtype=np.float64)
+        elif isinstance(value, dict) and 'num' in value:
+            num = int(value['num'])
+            if num > MAX_SWEEP_POINTS:
+                raise ValueError(f'点数は{MAX_SWEEP_POINTS}点までです')
+            array = np.linspace(float(value['start']), float(value['stop']), num)
+        elif isinstance(value, dict) and 'step' in value:
+            start, stop, step = float(value['start']), float(value['stop']), float(value['step'])
+            if step == 0 or (stop - start) / step > MAX_SWEEP_POINTS:
+                raise ValueError(f'点数は{MAX_SWEEP_POINTS}点までです')
+            array = np.arange(start, stop, step)
+        else:
+            raise ValueError(f'変数の指定が不正です: {name}')
+
+        if array.size > MAX_SWEEP_POINTS:
+            raise ValueError(f'点数は{MAX_SWEEP_POINTS}点までです')
+        variables[name] = array
+
+    # The variables are broadcast against each other, so check the combined
+    # shape before anything of that size is allocated
+    try:
+        shape = np.broadcast_shapes(*[array.shape for array in variables.values()])
+    except ValueError:
+        shapes = ', '.join(f'{name}: {list(array.shape)}' for name, array in variables.items())
+        raise ValueError(f'変数の形をそろえられません（{shapes}）') from None
+    if math.prod(shape) > MAX_SWEEP_POINTS:
+        raise ValueError(f'点数は{MAX_SWEEP_POINTS}点までです')
+
+    return variables
+
+
+def format_column(result):
+    """Round a result array to 10 digits, mapping NaN and infinities to null
+
+    A 0-d result (an expression without variables) becomes a single value.
+    """
+    import numpy as np
+
+    rounded = np.round(np.asarray(result, dtype=np.float64), 10)
+    if rounded.ndim == 0:
+        value = float(rounded)
+        return value if math.isfinite(value) else None
+    column = rounded.astype(object)
+    column[~np.isfinite(rounded)] = None
+    return column.tolist()
+
+
+def live_preview(live, message):
+    """Apply one keystroke delta to a LiveExpression and preview the result
+
+    A delta is ``{"pos": int, "delete": int, "insert": str}``; ``{"reset": ""}``
+    replaces the whole expression.
+    """
+    try:
+        delta = json.loads(message)
+        if 'reset' in delta:
+            live.apply(0, len(live.text), str(delta['reset']))
+        else:
+            live.apply(int(delta.get('pos', len(live.text))), int(delta.get('delete', 0)), str(delta.get('insert', '')))
+        tokens = live.completed()
+    except Exception:
+        return {'success': False, 'error': '計算エラー'}
+
+    if tokens is None:
+        return {'success': True, 'result': None, 'expression': ''}
+    body = evaluation_body(lambda: safe_eval_tokens(tokens))[0]
+    body['expression'] = ' '.join(text for _, text in tokens)
+    return body
+
+
+def register_live_preview(app):
+    """Serve the /ws/calculate live-preview WebSocket on a Flask app
+
+    WebSockets need a long-lived server (Cloud Run, or the local runner
+    below); Cloud Functions only serve the HTTP endpoints.
+    """
+    from flask_sock import Sock
+
+    sock = Sock(app)
+
+    @sock.route('/ws/calculate')
+    def calculate_socket(ws):
+        live = LiveExpression()
+        while True:
+            ws.send(json.dumps(live_preview(live, ws.receive())))
+
+
+def safe_eval(expression):
+    """Safely evaluate mathematical expressions"""
+    if isolated_evaluator is not None:
+        return isolated_evaluator.evaluate(expression)
+    return evaluate(expression)
+
+
+def safe_eval_tokens(tokens):
+    """safe_eval for lexed tokens, bypassing the expression cache"""
+    if isolated_evaluator is not None:
+        return isolated_evaluator.evaluate(tokens)
+    return evaluate_tokens(tokens)
+
+
 if __name__ == '__main__':
     # For local testing
     from flask import Flask, request as flask_request
@@ -110,5 +460,7 @@ if __name__ == '__main__':
     def catch_all(path):
         return main(flask_request)
 
+    register_live_preview(app)
+
     port = int(os.environ.get('PORT', 3000))
     app.run(host='0.0.0.0', port=port, debug=False)
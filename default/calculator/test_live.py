@@ -0,0 +1,56 @@
+import json
+import random
+
+import pytest
+
+import main
+from engine import expression_cache
+from live import LiveExpression
+
+
+def lexed(text):
+    live = LiveExpression()
+    live.apply(0, 0, text)
+    return live.tokens
+
+
+def type_keys(text):
+    live = LiveExpression()
+    for pos, key in enumerate(text):
+        live.apply(pos, 0, key)
+    return live
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1e5', 100000),
+    ('2.5e-3', 0.0025),
+    ('2**10', 1024),
+    ('7//2', 3),
+    ('.5*4', 2),
+])
+def test_typing_key_by_key_matches_a_full_lex(text, expected):
+    live = type_keys(text)
+    assert live.tokens == lexed(text)
+    body = main.live_preview(live, json.dumps({'pos': len(text), 'delete': 0, 'insert': ''}))
+    assert body['result'] == expected
+
+
+def test_random_edits_match_a_full_lex():
+    rng = random.Random(0)
+    alphabet = '0123456789.eE+-*/^()%, sinx'
+    for _ in range(300):
+        live = LiveExpression()
+        for _ in range(30):
+            pos = rng.randint(0, len(live.text))
+            delete = rng.randint(0, min(2, len(live.text) - pos))
+            insert = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 3)))
+            live.apply(pos, delete, insert)
+            assert live.tokens == lexed(live.text)
+
+
+def test_previews_do_not_fill_the_expression_cache():
+    before = expression_cache.stats()['size']
+    live = LiveExpression()
+    for pos, key in enumerate('12345+67890*3'):
+        main.live_preview(live, json.dumps({'pos': pos, 'delete': 0, 'insert': key}))
+    assert expression_cache.stats()['size'] == before
@@ -0,0 +1,100 @@
+import pytest
+from flask import Flask, request
+
+import main
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+
+    @app.route('/<path:path>', methods=['GET', 'POST'])
+    def catch_all(path):
+        return main.main(request)
+
+    return app.test_client()
+
+
+def test_huge_integer_result_is_a_400(client):
+    response = client.post('/api/calculate', json={'expression': '2**20000'})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_batch_with_huge_integer_fails_only_that_item(client):
+    response = client.post('/api/calculate/batch', json={'expressions': ['1+1', '2**20000', '3*4']})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[0] == {'success': True, 'result': 2}
+    assert results[1]['success'] is False
+    assert results[2] == {'success': True, 'result': 12}
+
+
+def test_sweep_without_variables_returns_the_value(client):
+    response = client.post('/api/calculate/sweep', json={'expression': '2*3', 'variables': {}})
+    assert response.status_code == 200
+    assert response.get_json()['result'] == 6
+
+
+def test_sweep_rejects_a_broadcast_larger_than_the_limit(client):
+    response = client.post('/api/calculate/sweep', json={
+        'expression': 'x+y',
+        'variables': {'x': {'start': 0, 'stop': 1, 'num': 1000}, 'y': [[v] for v in range(2000)]},
+    })
+    assert response.status_code == 400
+
+
+def test_sweep_rejects_mismatched_lengths(client):
+    response = client.post('/api/calculate/sweep', json={
+        'expression': 'x+y',
+        'variables': {'x': [1, 2, 3], 'y': [1, 2]},
+    })
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_complex_result_is_a_400(client):
+    response = client.post('/api/calculate', json={'expression': '(-1)**0.5'})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_integer_results_up_to_the_digit_limit_are_returned(client):
+    response = client.post('/api/calculate', json={'expression': '10**4000'})
+    assert response.status_code == 200
+    assert response.get_json()['result'] == 10 ** 4000
+
+
+def test_dataset_csv_keeps_one_line_per_row(client):
+    response = client.post(
+        '/api/calculate/dataset?expression=a*b&output=csv',
+        data='a,b\n1,2\n3,4\nx,5\n6,0.5\n',
+    )
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'result\n2.0\n12.0\n\n3.0\n'
+
+
+def test_solve_over_a_wide_bracket_finds_only_the_real_root(client):
+    response = client.post('/api/calculate/solve', json={'expression': 'x-0.5', 'a': 0, 'b': 1e308})
+    assert response.status_code == 200
+    assert response.get_json()['roots'] == [0.5]
+
+
+@pytest.mark.parametrize('expression', ['1/x', '1/(x-0.3)', 'tan(x*2)'])
+def test_integral_across_a_pole_is_reported_as_divergent(client, expression):
+    response = client.post('/api/calculate/integrate', json={'expression': expression, 'a': -1, 'b': 1})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_integral_with_an_integrable_endpoint_singularity(client):
+    response = client.post('/api/calculate/integrate', json={'expression': '1/sqrt(x)', 'a': 0, 'b': 1})
+    assert response.status_code == 200
+    assert abs(response.get_json()['result'] - 2) < 0.01
+
+
+@pytest.mark.parametrize('expression', ['1e308*10', '1e400', '-1e308*10'])
+def test_overflow_to_infinity_is_a_400(client, expression):
+    response = client.post('/api/calculate', json={'expression': expression})
+    assert response.status_code == 400
+    assert 'Infinity' not in response.get_data(as_text=True)
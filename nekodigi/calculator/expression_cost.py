@@ -0,0 +1,95 @@
+"""式の計算量の静的な見積もり（巨大なべき乗や深いネストでワーカーが止まらないようにする）
+
+calculator・calculator2・streamlit3/calculator-app はそれぞれのディレクトリから
+デプロイするので、このファイルを同じ内容で3つのディレクトリに置いている。
+変更するときは3つとも同じにする（calculator/test_main.py で一致を確かめている）。
+
+深さは括弧・単項演算子・右側の被演算子の入れ子だけを数える。1+1+…+1 のような
+左結合の長い式は入れ子ではないので数えず、ループでたどる（長さは
+MAX_EXPRESSION_LENGTH で抑える）。
+"""
+
+import ast
+import math
+import sys
+
+# 整数の結果は JSON に書ける桁数（sys.get_int_max_str_digits()、0 は無制限）までに抑える
+_MAX_STR_DIGITS = getattr(sys, 'get_int_max_str_digits', lambda: 0)()
+MAX_INTEGER_BITS = min(1 << 20, int(_MAX_STR_DIGITS * math.log2(10))) if _MAX_STR_DIGITS else 1 << 20
+MAX_EXPONENT_BITS = 64
+MAX_DEPTH = 50
+# 式の長さの上限（これより長い平らな式は ast.parse 自体の再帰が深くなりすぎる）
+MAX_EXPRESSION_LENGTH = 4000
+
+
+def check_expression_cost(expression):
+    """式を実行せずに静的に見積もり、計算量が大きすぎる場合は ValueError を送出する"""
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ValueError('式が長すぎます')
+    tree = ast.parse(expression, mode='eval')
+    _integer_bits(tree.body, 1)
+
+
+def _integer_bits(node, depth):
+    """整数の計算結果のビット長の上限を見積もる（浮動小数点の場合は None）"""
+    if depth > MAX_DEPTH:
+        raise ValueError('式のネストが深すぎます')
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, complex):
+        raise ValueError('複素数は使用できません')
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        if isinstance(node.value, int):
+            return node.value.bit_length()
+        return None
+
+    if isinstance(node, ast.UnaryOp):
+        return _integer_bits(node.operand, depth + 1)
+
+    if isinstance(node, ast.BinOp):
+        # 左結合の連なりは同じ深さのまま、一番左の被演算子から順に見積もる
+        chain = []
+        while isinstance(node, ast.BinOp):
+            chain.append(node)
+            node = node.left
+        bits = _integer_bits(node, depth)
+        for binop in reversed(chain):
+            bits = _binop_bits(binop, bits, _integer_bits(binop.right, depth + 1))
+        return bits
+
+    raise ValueError('数値の四則演算以外は使用できません')
+
+
+def _binop_bits(node, left, right):
+    """二項演算の結果のビット長の上限（どちらかが浮動小数点なら None）"""
+    if left is None or right is None or isinstance(node.op, ast.Div):
+        return None
+
+    if isinstance(node.op, (ast.Add, ast.Sub, ast.BitOr, ast.BitXor, ast.BitAnd)):
+        bits = max(left, right) + 1
+    elif isinstance(node.op, ast.Mult):
+        bits = left + right
+    elif isinstance(node.op, (ast.FloorDiv, ast.RShift)):
+        bits = left
+    elif isinstance(node.op, ast.Mod):
+        bits = right
+    elif isinstance(node.op, (ast.Pow, ast.LShift)):
+        if isinstance(node.right, ast.Constant):
+            exponent = abs(node.right.value)
+        elif right > MAX_EXPONENT_BITS:
+            raise ValueError('計算量が大きすぎます')
+        else:
+            exponent = 1 << right
+        if isinstance(node.op, ast.LShift):
+            bits = left + exponent
+        elif isinstance(node.left, ast.Constant) and abs(node.left.value) > 1:
+            # 底が定数なら大きさは正確に出せる（10 ** 4000 を過大に見積もらない）
+            bits = math.floor(exponent * math.log2(abs(node.left.value))) + 1
+        else:
+            bits = left * exponent
+    else:
+        raise ValueError('使用できない演算子です')
+
+    if bits > MAX_INTEGER_BITS:
+        raise ValueError('計算量が大きすぎます')
+    return bits
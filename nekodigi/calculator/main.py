@@ -1,8 +1,14 @@
+import json
 import os
 from flask import Flask, render_template, jsonify, request
 
+from expression_cost import check_expression_cost
+
 app = Flask(__name__, template_folder='.')
 
+# /api/calculate/batch で一度に受け付ける式の最大数
+MAX_BATCH_SIZE = 10000
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -12,13 +18,40 @@ def calculate():
     try:
         data = request.get_json()
         expression = data.get('expression', '')
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+
+    body, status = evaluate_expression(expression)
+    return jsonify(body), status
 
+@app.route('/api/calculate/batch', methods=['POST'])
+def calculate_batch():
+    data = request.get_json(silent=True) or {}
+    expressions = data.get('expressions')
+
+    if not isinstance(expressions, list):
+        return jsonify({'error': '式のリストが必要です', 'success': False}), 400
+    if len(expressions) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'一度に計算できる式は{MAX_BATCH_SIZE}件までです', 'success': False}), 400
+
+    results = [evaluate_expression(expression)[0] for expression in expressions]
+    return jsonify({'results': results, 'success': True})
+
+def evaluate_expression(expression):
+    """1つの式を計算し、レスポンス本体とステータスコードを返す"""
+    try:
         # 基本的な数学演算のみを許可
+        check_expression_cost(expression)
         result = eval(expression, {"__builtins__": {}}, {})
+        # 負の数の非整数乗などは複素数になるが、JSON では返せない
+        if isinstance(result, complex):
+            raise ValueError('計算結果が複素数になりました')
+        # JSON にできない結果（桁数の多すぎる整数・inf・nan など）はこの式だけのエラーにする
+        json.dumps(result, allow_nan=False)
 
-        return jsonify({'result': result, 'success': True})
+        return {'result': result, 'success': True}, 200
     except Exception as e:
-        return jsonify({'error': str(e), 'success': False}), 400
+        return {'error': str(e), 'success': False}, 400
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 3000))
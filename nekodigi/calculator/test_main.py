@@ -0,0 +1,64 @@
+from pathlib import Path
+
+import pytest
+
+from main import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_huge_integer_result_is_a_400(client):
+    response = client.post('/api/calculate', json={'expression': '2**20000'})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_batch_with_huge_integer_fails_only_that_item(client):
+    response = client.post('/api/calculate/batch', json={'expressions': ['1+1', '2**20000', '3*4']})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[0] == {'result': 2, 'success': True}
+    assert results[1]['success'] is False
+    assert results[2] == {'result': 12, 'success': True}
+
+
+@pytest.mark.parametrize('expression', ['(-1)**0.5', '1j'])
+def test_complex_result_is_a_400(client, expression):
+    response = client.post('/api/calculate', json={'expression': expression})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('expression', ['1e308*10', '1e400', '-1e308*10'])
+def test_overflow_to_infinity_is_a_400(client, expression):
+    response = client.post('/api/calculate', json={'expression': expression})
+    assert response.status_code == 400
+    assert 'Infinity' not in response.get_data(as_text=True)
+
+
+def test_long_flat_sum_is_not_too_deep(client):
+    response = client.post('/api/calculate', json={'expression': '+'.join(['1'] * 250)})
+    assert response.status_code == 200
+    assert response.get_json()['result'] == 250
+
+
+def test_overlong_expression_is_a_400(client):
+    response = client.post('/api/calculate', json={'expression': '+'.join(['1'] * 3000)})
+    assert response.status_code == 400
+
+
+def test_expression_cost_copies_are_identical():
+    # 3つのアプリはそれぞれ単独でデプロイするので、同じ見積もりのコピーを持っている
+    here = Path(__file__).resolve().parent
+    copies = [here / 'expression_cost.py',
+              here.parent / 'calculator2' / 'expression_cost.py',
+              here.parent / 'streamlit3' / 'calculator-app' / 'expression_cost.py']
+    assert len({path.read_bytes() for path in copies}) == 1
+
+
+@pytest.mark.parametrize('expression', ['-' * 60 + '1', '1+(' * 60 + '1' + ')' * 60])
+def test_deep_nesting_is_a_400(client, expression):
+    response = client.post('/api/calculate', json={'expression': expression})
+    assert response.status_code == 400
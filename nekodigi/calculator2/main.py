@@ -1,9 +1,14 @@
 import functions_framework
 from flask import Flask, send_from_directory, jsonify, request
-import os
+import json
+
+from expression_cost import check_expression_cost
 
 app = Flask(__name__, static_folder='.', static_url_path='')
 
+# /api/calculate/batch で一度に受け付ける式の最大数
+MAX_BATCH_SIZE = 10000
+
 @app.route('/')
 def index():
     return send_from_directory('.', 'index.html')
@@ -13,13 +18,46 @@ def calculate():
     try:
         data = request.json
         expression = data.get('expression', '')
+    except Exception as e:
+        return jsonify({'error': '計算エラー'}), 400
+
+    body, status = evaluate_expression(expression)
+    return jsonify(body), status
+
+@app.route('/api/calculate/batch', methods=['POST'])
+def calculate_batch():
+    data = request.get_json(silent=True) or {}
+    expressions = data.get('expressions')
+
+    if not isinstance(expressions, list):
+        return jsonify({'error': '式のリストが必要です'}), 400
+    if len(expressions) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'一度に計算できる式は{MAX_BATCH_SIZE}件までです'}), 400
+
+    results = [evaluate_expression(expression)[0] for expression in expressions]
+    return jsonify({'results': results})
+
+def evaluate_expression(expression):
+    """1つの式を計算し、レスポンス本体とステータスコードを返す"""
+    try:
+        check_expression_cost(expression)
         # 安全な計算のためにeval使用（本番環境では注意が必要）
         result = eval(expression)
-        return jsonify({'result': result})
+        # 負の数の非整数乗などは複素数になるが、JSON では返せない
+        if isinstance(result, complex):
+            raise ValueError('計算結果が複素数になりました')
+        # JSON にできない結果（桁数の多すぎる整数・inf・nan など）はこの式だけのエラーにする
+        try:
+            json.dumps(result, allow_nan=False)
+        except (TypeError, ValueError):
+            return {'error': '計算エラー'}, 400
+        return {'result': result}, 200
     except ZeroDivisionError:
-        return jsonify({'error': '0で割ることはできません'}), 400
+        return {'error': '0で割ることはできません'}, 400
+    except ValueError as e:
+        return {'error': str(e)}, 400
     except Exception as e:
-        return jsonify({'error': '計算エラー'}), 400
+        return {'error': '計算エラー'}, 400
 
 @functions_framework.http
 def main(request):
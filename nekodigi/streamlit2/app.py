@@ -6,7 +6,7 @@ import json
 from datetime import datetime
 from openai import OpenAI
 import base64
-import requests
+from firebase_client import FirebaseClient
 
 # ページ設定
 st.set_page_config(
@@ -27,13 +27,17 @@ FIREBASE_CONFIG = {
     "databaseURL": "https://sandbox-35d1d-default-rtdb.firebaseio.com",
 }
 
-# Firebase Realtime DBへのアクセス用URL生成
-def get_firebase_db_url():
-    base_url = FIREBASE_CONFIG["databaseURL"]
+# Firebase Realtime DB の保存先パス
+def get_firebase_results_path():
     if DEVELOPER_ID and APP_ID:
-        return f"{base_url}/pracClass/{DEVELOPER_ID}/apps/{APP_ID}/results.json"
+        return f"pracClass/{DEVELOPER_ID}/apps/{APP_ID}/results"
     return None
 
+# Firebase REST クライアント（接続を使い回す・タイムアウトと再試行付き）
+@st.cache_resource
+def get_firebase_client():
+    return FirebaseClient(FIREBASE_CONFIG["databaseURL"])
+
 # OpenAI クライアント初期化
 @st.cache_resource
 def get_openai_client():
@@ -51,8 +55,8 @@ def save_to_firebase(image_name: str, analysis_result: dict):
             st.warning("DEVELOPER_ID または APP_ID が設定されていません")
             return False
 
-        db_url = get_firebase_db_url()
-        if not db_url:
+        results_path = get_firebase_results_path()
+        if not results_path:
             return False
 
         # タイムスタンプをキーとして使用
@@ -68,15 +72,7 @@ def save_to_firebase(image_name: str, analysis_result: dict):
             "timestamp": timestamp
         }
 
-        # Firebaseのauthクエリパラメータ（Web SDKのAPIキーを使用）
-        url = f"{db_url}?auth={FIREBASE_CONFIG['apiKey']}"
-        url = db_url.replace(".json", f"/{safe_timestamp}.json")
-
-        response = requests.put(
-            url,
-            json=payload,
-            timeout=10
-        )
+        response = get_firebase_client().put(f"{results_path}/{safe_timestamp}", payload)
 
         return response.status_code in [200, 201]
     except Exception as e:
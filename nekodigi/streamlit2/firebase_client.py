@@ -0,0 +1,79 @@
+"""Firebase Realtime Database の REST クライアント（解析結果の保存用）
+
+requests.Session を使い回して接続をプールする（keep-alive）ので、呼び出しごとに
+TCP + TLS ハンドシェイクをやり直さない。接続・読み込みのタイムアウトを必ず付け、
+5xx と 429 と通信エラーはジッター付き指数バックオフで再試行する。
+
+設定（環境変数）:
+    FIREBASE_CONNECT_TIMEOUT  接続タイムアウト秒（既定 3.05）
+    FIREBASE_READ_TIMEOUT     読み込みタイムアウト秒（既定 10）
+    FIREBASE_MAX_RETRIES      再試行回数（既定 3）
+    FIREBASE_BACKOFF          バックオフの基準秒（既定 0.1）
+"""
+
+import os
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# 再試行の待ち時間の上限（秒）
+MAX_BACKOFF = 5.0
+
+
+class FirebaseClient:
+    """接続プール・タイムアウト・再試行付きの Firebase REST クライアント"""
+
+    def __init__(self, database_url, connect_timeout=None, read_timeout=None, max_retries=None, backoff=None):
+        self.database_url = database_url.rstrip('/')
+        connect_timeout = connect_timeout if connect_timeout is not None else float(os.environ.get('FIREBASE_CONNECT_TIMEOUT', 3.05))
+        read_timeout = read_timeout if read_timeout is not None else float(os.environ.get('FIREBASE_READ_TIMEOUT', 10))
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('FIREBASE_MAX_RETRIES', 3))
+        self.backoff = backoff if backoff is not None else float(os.environ.get('FIREBASE_BACKOFF', 0.1))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        """パス（例: pracClass/dev/apps/app/results/xxx）の REST URL"""
+        return f"{self.database_url}/{path.strip('/')}.json"
+
+    def _retry_delay(self, attempt, response):
+        # 429 の Retry-After があればそれに従い、なければ full jitter の指数バックオフ
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_BACKOFF)
+            except ValueError:
+                pass
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * (2 ** attempt)))
+
+    def request(self, method, path, **kwargs):
+        """リクエストを送り、Response を返す
+
+        5xx / 429 / 接続エラー / タイムアウトは max_retries 回まで再試行する。
+        再試行しきった 5xx / 429 はその Response を返し、通信エラーは例外を送出する。
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(path)
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            time.sleep(self._retry_delay(attempt, response))
+            attempt += 1
+
+    def put(self, path, data, **kwargs):
+        # 同じキーへの PUT は送り直しても結果が変わらないので、再試行してよい
+        return self.request('PUT', path, json=data, **kwargs)
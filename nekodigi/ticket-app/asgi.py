@@ -0,0 +1,184 @@
+"""ASGI 版のエントリーポイント（uvicorn asgi:app --port 3000）
+
+チケットの作成・検証・確認と統計を asyncio で処理する。Firebase の応答を
+待っている間もイベントループは他のリクエストを処理できるので、スレッド数に
+縛られずに1インスタンスで数千件の検証を同時に抱えられる。
+それ以外のルート（画面・QRコード画像・一括検証・エクスポート・再集計・メトリクス）は main.py の
+Flask アプリをそのまま使う。
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import main
+from firebase_client import AsyncFirebaseClient
+
+# 同時に張る Firebase への接続数（HTTP/1.1 なので同時に送れるリクエスト数の上限）
+ASYNC_POOL_SIZE = int(os.environ.get('FIREBASE_ASYNC_POOL_SIZE', 200))
+
+firebase = AsyncFirebaseClient(main.DATABASE_URL, pool_size=ASYNC_POOL_SIZE)
+
+# 応答の後に実行する処理（参照を持っておかないと途中で回収される）
+_background_tasks = set()
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def firebase_get(path):
+    """Firebaseからデータを取得"""
+    try:
+        response = await firebase.get(main.firebase_path(path))
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except Exception as e:
+        print(f"Firebase GET error: {e}")
+        return None
+
+async def firebase_patch(path, data, **kwargs):
+    """Firebaseのデータを更新（統計のインクリメントを含むときは max_retries=0 で呼ぶ）"""
+    try:
+        response = await firebase.patch(main.firebase_path(path), data, **kwargs)
+        return response.status_code == 200
+    except Exception as e:
+        print(f"Firebase PATCH error: {e}")
+        return False
+
+async def collect_qr_codes(futures, count, deadline):
+    """main.collect_qr_codes の asyncio 版（待っている間イベントループを止めない）"""
+    qr_codes = [None] * count
+    waiting = {asyncio.wrap_future(future): start for start, future in futures}
+    done, pending = await asyncio.wait(waiting, timeout=max(0, deadline - time.monotonic()))
+    for future in done:
+        if future.exception() is None:
+            chunk = future.result()
+            start = waiting[future]
+            qr_codes[start:start + len(chunk)] = chunk
+    for future in pending:
+        future.cancel()
+    return qr_codes
+
+async def run_steps(steps):
+    """main.run_steps の asyncio 版"""
+    try:
+        call = next(steps)
+        while True:
+            method, *args = call
+            call = steps.send(await getattr(firebase, method)(*args))
+    except StopIteration as done:
+        return done.value
+
+async def prefetch_etag(ticket_id):
+    """main.prefetch_etag の asyncio 版"""
+    try:
+        await run_steps(main.prefetch_steps(ticket_id))
+    except Exception as e:
+        print(f"Firebase GET error: {e}")
+
+def respond(result):
+    body, status = result
+    return JSONResponse(body, status)
+
+async def create_ticket(request):
+    """チケットを作成（main.create_ticket と同じ仕様）"""
+    try:
+        deadline = time.monotonic() + main.QR_RENDER_TIMEOUT
+        event_name, ticket_count, error = main.create_params(await request.json())
+        if error:
+            return respond(error)
+
+        records = main.new_ticket_records(event_name, ticket_count)
+        payloads, futures = main.start_qr_codes(records, event_name)
+
+        if not await firebase_patch("", main.create_updates(records, event_name), max_retries=0):
+            main.cancel_qr_codes(futures)
+            return respond(main.error_result('チケットの保存に失敗しました'))
+
+        if futures is None:
+            qr_codes = await asyncio.to_thread(main.generate_qr_codes, payloads)
+        else:
+            qr_codes = await collect_qr_codes(futures, ticket_count, deadline)
+
+        return respond(main.create_result(records, qr_codes))
+
+    except Exception as e:
+        return respond(main.error_result(str(e)))
+
+async def validate_ticket(request):
+    """チケットを検証・使用（main.validate_ticket と同じ仕様）"""
+    try:
+        ticket_id, error = main.scan_params(await request.json(), 'valid')
+        if error:
+            return respond(error)
+
+        status, ticket = await run_steps(main.redeem_steps(ticket_id, datetime.now().isoformat()))
+
+        if status == 'ok':
+            run_in_background(firebase_patch("", main.redeemed_stats(ticket), max_retries=0))
+
+        return respond(main.redeem_result(status, ticket))
+
+    except Exception as e:
+        return respond(main.error_result(str(e)))
+
+async def check_ticket(request):
+    """チケット状態を確認（main.check_ticket と同じ仕様）"""
+    try:
+        ticket_id, error = main.scan_params(await request.json(), 'found')
+        if error:
+            return respond(error)
+
+        ticket, prefetch = await run_steps(main.lookup_steps(ticket_id))
+        if prefetch:
+            run_in_background(prefetch_etag(ticket_id))
+
+        return respond(main.check_result(ticket))
+
+    except Exception as e:
+        return respond(main.error_result(str(e)))
+
+async def get_stats(request):
+    """統計情報を取得（main.get_stats と同じ仕様）"""
+    try:
+        counters = await firebase_get(main.stats_path(request.query_params.get('event_name')))
+        return respond(main.stats_result(counters))
+
+    except Exception as e:
+        return respond(main.error_result(str(e)))
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    if _background_tasks:
+        await asyncio.wait(_background_tasks)
+    await firebase.aclose()
+
+app = Starlette(
+    routes=[
+        Route('/api/create-ticket', create_ticket, methods=['POST']),
+        Route('/api/validate-ticket', validate_ticket, methods=['POST']),
+        Route('/api/check-ticket', check_ticket, methods=['POST']),
+        Route('/api/stats', get_stats, methods=['GET']),
+        # 残りのルートは Flask アプリに任せる
+        Mount('/', app=WSGIMiddleware(main.app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 3000)))
@@ -0,0 +1,289 @@
+"""Firebase Realtime Database の REST クライアント
+
+requests.Session を使い回して接続をプールする（keep-alive）ので、呼び出しごとに
+TCP + TLS ハンドシェイクをやり直さない。接続・読み込みのタイムアウトを必ず付け、
+5xx と 429 と通信エラーはジッター付き指数バックオフで再試行する。
+呼び出しごとのレイテンシは metrics() で確認できる。
+
+FirebaseClient は requests を使う同期版、AsyncFirebaseClient は httpx を使う
+asyncio 版（ASGI で動かす asgi.py 用）。設定・再試行・集計は共通。
+
+設定（環境変数）:
+    FIREBASE_CONNECT_TIMEOUT  接続タイムアウト秒（既定 3.05）
+    FIREBASE_READ_TIMEOUT     読み込みタイムアウト秒（既定 10）
+    FIREBASE_MAX_RETRIES      再試行回数（既定 3）
+    FIREBASE_BACKOFF          バックオフの基準秒（既定 0.1）
+    FIREBASE_POOL_SIZE        ホストあたりの最大接続数（既定 10）
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# 再試行の待ち時間の上限（秒）
+MAX_BACKOFF = 5.0
+# パーセンタイル計算に残す直近のレイテンシ数
+LATENCY_WINDOW = 1000
+# AsyncFirebaseClient で httpx.AsyncClient 1つに持たせる接続数
+ASYNC_SHARD_SIZE = 4
+
+
+class CallMetrics:
+    """メソッドごとの呼び出し回数・エラー・再試行・レイテンシ"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, elapsed_ms, retries, error):
+        self.calls += 1
+        self.retries += retries
+        self.errors += int(error)
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.recent.append(elapsed_ms)
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+
+        def percentile(fraction):
+            if not recent:
+                return None
+            return round(recent[min(len(recent) - 1, int(len(recent) * fraction))], 2)
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'mean_ms': round(self.total_ms / self.calls, 2) if self.calls else None,
+            'p50_ms': percentile(0.50),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(self.max_ms, 2),
+        }
+
+
+class _FirebaseClientBase:
+    """同期版・asyncio 版で共通の設定・再試行の待ち時間・集計"""
+
+    def __init__(self, database_url, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, pool_size=None):
+        self.database_url = database_url.rstrip('/')
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.environ.get('FIREBASE_CONNECT_TIMEOUT', 3.05))
+        self.read_timeout = read_timeout if read_timeout is not None else float(os.environ.get('FIREBASE_READ_TIMEOUT', 10))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('FIREBASE_MAX_RETRIES', 3))
+        self.backoff = backoff if backoff is not None else float(os.environ.get('FIREBASE_BACKOFF', 0.1))
+        self.pool_size = pool_size if pool_size is not None else int(os.environ.get('FIREBASE_POOL_SIZE', 10))
+
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def url(self, path):
+        """パス（例: pracClass/dev/apps/app/tickets/xxx）の REST URL"""
+        return f"{self.database_url}/{path.strip('/')}.json"
+
+    def _retry_delay(self, attempt, response):
+        # 429 の Retry-After があればそれに従い、なければ full jitter の指数バックオフ
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_BACKOFF)
+            except ValueError:
+                pass
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * (2 ** attempt)))
+
+    def _record(self, method, start, retries, error):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._metrics_lock:
+            self._metrics.setdefault(method.upper(), CallMetrics()).record(elapsed_ms, retries, error)
+
+    def metrics(self):
+        """メソッドごとのレイテンシ集計"""
+        with self._metrics_lock:
+            return {method: metrics.snapshot() for method, metrics in self._metrics.items()}
+
+
+class FirebaseClient(_FirebaseClientBase):
+    """接続プール・タイムアウト・再試行付きの Firebase REST クライアント"""
+
+    def __init__(self, database_url, **options):
+        super().__init__(database_url, **options)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, path, max_retries=None, **kwargs):
+        """リクエストを送り、Response を返す
+
+        5xx / 429 / 接続エラー / タイムアウトは max_retries 回まで再試行する。
+        再試行しきった 5xx / 429 はその Response を返し、通信エラーは例外を送出する。
+        サーバー側インクリメントのように送り直すと結果が変わる書き込みは
+        max_retries=0 で呼ぶ（応答が失われただけで書き込み自体は済んでいることがある）。
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(path)
+        start = time.perf_counter()
+        attempt = 0
+        response = None
+        error = False
+        try:
+            while True:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                    if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                        error = response.status_code >= 400
+                        return response
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= max_retries:
+                        error = True
+                        raise
+                    response = None
+                time.sleep(self._retry_delay(attempt, response))
+                attempt += 1
+        finally:
+            self._record(method, start, attempt, error)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def put(self, path, data, **kwargs):
+        return self.request('PUT', path, json=data, **kwargs)
+
+    def patch(self, path, data, **kwargs):
+        return self.request('PATCH', path, json=data, **kwargs)
+
+    def get_with_etag(self, path, **kwargs):
+        """値とその ETag を返す（条件付き書き込み用）"""
+        headers = {**kwargs.pop('headers', {}), 'X-Firebase-ETag': 'true'}
+        response = self.get(path, headers=headers, **kwargs)
+        response.raise_for_status()
+        return response.json(), response.headers.get('ETag')
+
+    def put_if_match(self, path, data, etag, **kwargs):
+        """ETag が一致するときだけ書き込む
+
+        (成功したか, 現在の値, 現在の ETag) を返す。一致しなかった場合（412）は
+        レスポンスに含まれる最新の値と ETag を返すので、読み直さずに再試行できる。
+        """
+        headers = {**kwargs.pop('headers', {}), 'if-match': etag}
+        response = self.put(path, data, headers=headers, **kwargs)
+        if response.status_code == 412:
+            return False, response.json(), response.headers.get('ETag')
+        response.raise_for_status()
+        return True, response.json(), response.headers.get('ETag')
+
+
+class AsyncFirebaseClient(_FirebaseClientBase):
+    """FirebaseClient の asyncio 版（httpx.AsyncClient の接続プールを使う）
+
+    待っている間はイベントループを明け渡すので、1プロセスで多数のリクエストを同時に扱える。
+    FIREBASE_POOL_SIZE は同時接続数の上限になる（HTTP/1.1 は1接続1リクエストずつ）。
+    接続は ASYNC_SHARD_SIZE 本ずつ複数の httpx.AsyncClient に分けて持つ。httpcore の
+    プールはリクエストの割り当てのたびに全接続を走査するので、1つの大きなプールだと
+    接続数に比例して CPU を食い、数百接続では I/O より先に CPU で頭打ちになる。
+    空いている接続枠をキューで配り、各クライアントの同時リクエスト数を接続数以下に
+    保つ（超えた分はキューで待つ）。
+    """
+
+    def __init__(self, database_url, **options):
+        super().__init__(database_url, **options)
+        self._clients = []
+        self._slots = None
+
+    def _open(self):
+        # httpx は asgi.py でしか使わないので、同期版だけ使うアプリでは import しない
+        import httpx
+
+        timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        self._slots = asyncio.Queue()
+        for start in range(0, self.pool_size, ASYNC_SHARD_SIZE):
+            size = min(ASYNC_SHARD_SIZE, self.pool_size - start)
+            client = httpx.AsyncClient(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+            )
+            self._clients.append(client)
+            for _ in range(size):
+                self._slots.put_nowait(client)
+        return self._slots
+
+    async def aclose(self):
+        clients, self._clients, self._slots = self._clients, [], None
+        for client in clients:
+            await client.aclose()
+
+    async def _send(self, method, url, **kwargs):
+        slots = self._slots if self._slots is not None else self._open()
+        client = await slots.get()
+        try:
+            return await client.request(method, url, **kwargs)
+        finally:
+            slots.put_nowait(client)
+
+    async def request(self, method, path, max_retries=None, **kwargs):
+        """リクエストを送り、httpx.Response を返す（再試行の条件は FirebaseClient と同じ）"""
+        import httpx
+
+        if max_retries is None:
+            max_retries = self.max_retries
+        url = self.url(path)
+        start = time.perf_counter()
+        attempt = 0
+        response = None
+        error = False
+        try:
+            while True:
+                try:
+                    response = await self._send(method, url, **kwargs)
+                    if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                        error = response.status_code >= 400
+                        return response
+                except httpx.TransportError:
+                    if attempt >= max_retries:
+                        error = True
+                        raise
+                    response = None
+                await asyncio.sleep(self._retry_delay(attempt, response))
+                attempt += 1
+        finally:
+            self._record(method, start, attempt, error)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def put(self, path, data, **kwargs):
+        return await self.request('PUT', path, json=data, **kwargs)
+
+    async def patch(self, path, data, **kwargs):
+        return await self.request('PATCH', path, json=data, **kwargs)
+
+    async def get_with_etag(self, path, **kwargs):
+        """値とその ETag を返す（条件付き書き込み用）"""
+        headers = {**kwargs.pop('headers', {}), 'X-Firebase-ETag': 'true'}
+        response = await self.get(path, headers=headers, **kwargs)
+        response.raise_for_status()
+        return response.json(), response.headers.get('ETag')
+
+    async def put_if_match(self, path, data, etag, **kwargs):
+        """ETag が一致するときだけ書き込む（戻り値は FirebaseClient.put_if_match と同じ）"""
+        headers = {**kwargs.pop('headers', {}), 'if-match': etag}
+        response = await self.put(path, data, headers=headers, **kwargs)
+        if response.status_code == 412:
+            return False, response.json(), response.headers.get('ETag')
+        response.raise_for_status()
+        return True, response.json(), response.headers.get('ETag')
@@ -0,0 +1,323 @@
+"""Local stand-in for the Firebase Realtime Database REST API.
+
+Implements the subset of the REST protocol the apps in this repo use, in
+memory, so they can be exercised and benchmarked without a real database:
+
+    GET     read a node; `X-Firebase-ETag: true` adds an ETag header;
+            `orderBy="$key"` with `startAt` / `limitToFirst` pages children
+    PUT     replace a node; `if-match: <etag>` makes it conditional and
+            answers 412 with the current value and ETag on mismatch
+    PATCH   multi-location update of the children named by the body keys
+    {".sv": {"increment": n}} server values in PUT and PATCH bodies
+    GET with `Accept: text/event-stream` streams put / patch / keep-alive
+            events for the node, starting with a put of its whole value
+
+An artificial per-request delay (``latency``) approximates the network
+round trip to the real service.
+
+Usage as a server:
+    python nekodigi/ticket-app/firebase_standin.py [--port 9000] [--latency-ms 20]
+
+Usage from Python:
+    standin = FirebaseStandIn(latency=0.02).start()
+    client = FirebaseClient(standin.url)
+    ...
+    standin.stop()
+"""
+
+import argparse
+import base64
+import copy
+import hashlib
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+NULL_ETAG = 'null_etag'
+# Seconds between keep-alive events on an idle stream
+KEEP_ALIVE_INTERVAL = 15.0
+
+
+def etag_of(value):
+    """Content hash of a node, the same for equal values"""
+    if value is None:
+        return NULL_ETAG
+    data = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.b64encode(hashlib.sha1(data).digest()).decode('ascii')
+
+
+def split_path(path):
+    path = unquote(path)
+    if path.endswith('.json'):
+        path = path[:-len('.json')]
+    return [part for part in path.split('/') if part]
+
+
+class Database:
+    """In-memory JSON tree with Realtime Database write semantics"""
+
+    def __init__(self):
+        self.root = None
+        self.lock = threading.Lock()
+        self.requests = 0
+        # (path parts, queue of (event, data)) for every open event stream
+        self.subscribers = []
+
+    def subscribe(self, parts):
+        """Open an event stream on a node; call with the lock held"""
+        events = queue.Queue()
+        events.put(('put', {'path': '/', 'data': copy.deepcopy(self.get(parts))}))
+        self.subscribers.append((parts, events))
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            self.subscribers = [(parts, q) for parts, q in self.subscribers if q is not events]
+
+    def _publish(self, parts, patch=None):
+        # Tell every stream whose node overlaps the written location
+        for sub_parts, events in self.subscribers:
+            if parts[:len(sub_parts)] == sub_parts:
+                path = '/' + '/'.join(parts[len(sub_parts):])
+                if patch is None:
+                    events.put(('put', {'path': path, 'data': copy.deepcopy(self.get(parts))}))
+                else:
+                    data = {key: copy.deepcopy(self.get(parts + [key])) for key in patch}
+                    events.put(('patch', {'path': path, 'data': data}))
+            elif sub_parts[:len(parts)] == parts:
+                events.put(('put', {'path': '/', 'data': copy.deepcopy(self.get(sub_parts))}))
+
+    def get(self, parts):
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _resolve(self, parts, value):
+        # Server values and nulls: nulls delete, empty objects do not exist
+        if isinstance(value, dict) and '.sv' in value:
+            current = self.get(parts)
+            return (current if isinstance(current, (int, float)) else 0) + value['.sv']['increment']
+        if isinstance(value, dict):
+            resolved = {}
+            for key, child in value.items():
+                child = self._resolve(parts + [key], child)
+                if child is not None:
+                    resolved[key] = child
+            return resolved or None
+        return value
+
+    def set(self, parts, value):
+        value = self._resolve(parts, value)
+        if not parts:
+            self.root = value
+            return
+        if self.root is None:
+            self.root = {}
+        node = self.root
+        trail = []
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            trail.append((node, part))
+            node = node[part]
+        if value is None:
+            node.pop(parts[-1], None)
+            # Drop parents left empty by the delete
+            for parent, part in reversed(trail):
+                if parent[part]:
+                    break
+                del parent[part]
+        else:
+            node[parts[-1]] = value
+
+    def write(self, parts, value):
+        self.set(parts, value)
+        self._publish(parts)
+
+    def update(self, parts, children):
+        # Applied under the caller's lock, so the whole update is atomic
+        for key, value in children.items():
+            self.set(parts + split_path(key), value)
+        if all('/' not in key.strip('/') for key in children):
+            self._publish(parts, patch=[key.strip('/') for key in children])
+        else:
+            for key in children:
+                self._publish(parts + split_path(key))
+
+
+class _Server(ThreadingHTTPServer):
+    # The socketserver default backlog of 5 drops connects from a large pool
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FirebaseStandIn:
+    """Threaded HTTP server speaking the Realtime Database REST protocol"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.db = Database()
+        self.latency = latency
+        self.server = _Server((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def drop_streams(self):
+        """Close every open event stream, as a network failure would"""
+        with self.db.lock:
+            for _, events in self.db.subscribers:
+                events.put(None)
+            self.db.subscribers = []
+
+    def stop(self):
+        self.drop_streams()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        standin = self
+        db = self.db
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment, like a real server
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length)) if length else None
+
+            def _send(self, status, value, etag=None):
+                body = json.dumps(value, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _begin(self):
+                if standin.latency:
+                    time.sleep(standin.latency)
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                return split_path(url.path), query
+
+            def _stream(self, parts):
+                with db.lock:
+                    db.requests += 1
+                    events = db.subscribe(parts)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    while True:
+                        try:
+                            item = events.get(timeout=KEEP_ALIVE_INTERVAL)
+                        except queue.Empty:
+                            item = ('keep-alive', None)
+                        if item is None:
+                            self.wfile.write(b'0\r\n\r\n')
+                            self.wfile.flush()
+                            return
+                        event, data = item
+                        chunk = f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8')
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        self.wfile.flush()
+                except OSError:
+                    pass
+                finally:
+                    db.unsubscribe(events)
+
+            def do_GET(self):
+                parts, query = self._begin()
+                if self.headers.get('Accept') == 'text/event-stream':
+                    self._stream(parts)
+                    return
+                with db.lock:
+                    db.requests += 1
+                    value = copy.deepcopy(db.get(parts))
+                if query.get('orderBy') == '"$key"' and isinstance(value, dict):
+                    keys = sorted(value)
+                    if 'startAt' in query:
+                        keys = [key for key in keys if key >= json.loads(query['startAt'])]
+                    if 'limitToFirst' in query:
+                        keys = keys[:int(query['limitToFirst'])]
+                    value = {key: value[key] for key in keys}
+                etag = etag_of(value) if self.headers.get('X-Firebase-ETag') == 'true' else None
+                self._send(200, value, etag)
+
+            def do_PUT(self):
+                parts, _ = self._begin()
+                body = self._body()
+                expected = self.headers.get('if-match')
+                status = 200
+                with db.lock:
+                    db.requests += 1
+                    if expected is not None and etag_of(db.get(parts)) != expected:
+                        status = 412
+                    else:
+                        db.write(parts, body)
+                    value = copy.deepcopy(db.get(parts))
+                self._send(status, value, etag_of(value))
+
+            def do_PATCH(self):
+                parts, _ = self._begin()
+                body = self._body()
+                if not isinstance(body, dict):
+                    self._send(400, {'error': 'PATCH body must be an object'})
+                    return
+                with db.lock:
+                    db.requests += 1
+                    db.update(parts, body)
+                self._send(200, body)
+
+            def do_DELETE(self):
+                parts, _ = self._begin()
+                with db.lock:
+                    db.requests += 1
+                    db.write(parts, None)
+                self._send(200, None)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='artificial delay per request')
+    args = parser.parse_args()
+
+    standin = FirebaseStandIn(args.host, args.port, args.latency_ms / 1000)
+    print(f'Firebase stand-in listening on {standin.url}', flush=True)
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,26 @@
 import os
 import json
+import atexit
+import multiprocessing
 import uuid
+import time
+import hashlib
+import hmac
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, make_response
 from flask_cors import CORS
-import qrcode
 import io
-import base64
-import requests
+from firebase_client import FirebaseClient
+from qr_render import render_png, render_png_data_urls, render_svg
+from ticket_cache import TicketCache
+from ticket_export import ExportHistory
+from ticket_token import signer_from_env
 
 # Firebase Realtime Database URL
-DATABASE_URL = "https://sandbox-35d1d-default-rtdb.firebaseio.com"
+DATABASE_URL = os.environ.get('FIREBASE_DATABASE_URL', "https://sandbox-35d1d-default-rtdb.firebaseio.com")
 
 app = Flask(__name__)
 CORS(app)
@@ -19,14 +29,137 @@ DEVELOPER_ID = os.environ.get('DEVELOPER_ID', 'default_dev')
 APP_ID = os.environ.get('APP_ID', 'default_app')
 BASE_PATH = f"pracClass/{DEVELOPER_ID}/apps/{APP_ID}"
 
-def get_firebase_ref(path):
-    """Firebaseパスの完全URLを取得"""
-    return f"{DATABASE_URL}/{BASE_PATH}/{path}.json"
-
-def firebase_get(path):
+# 接続を使い回す Firebase クライアント（タイムアウト・再試行付き）。get_firebase() で初回に作る
+firebase = None
+
+# 一括作成の上限枚数
+MAX_TICKET_COUNT = 1000
+# QRコード生成を待つ上限（秒）。間に合わなかった分は /api/tickets/<id>/qr で後から取得する
+QR_RENDER_TIMEOUT = float(os.environ.get('QR_RENDER_TIMEOUT', 10))
+# この枚数以下ならプロセスプールを使わずにその場で生成する
+QR_INLINE_COUNT = 4
+# 1タスクでまとめて生成する枚数
+QR_CHUNK_SIZE = 16
+# QR_WORKERS 未設定時のプロセス数の上限（CPU 数がこれより少なければ CPU 数）
+QR_DEFAULT_WORKERS = 4
+
+# 統計の再集計で1回に読むチケット数
+RECONCILE_PAGE_SIZE = 500
+# 条件付き書き込みで使用済みにする際の最大試行回数
+MAX_REDEEM_ATTEMPTS = 5
+# 覚えておくチケットの ETag の数
+ETAG_CACHE_SIZE = 10000
+# 使用済みとわかったチケットを覚えておく数
+USED_TICKET_CACHE_SIZE = 10000
+# 一括検証で1回に受け付けるスキャン数
+MAX_BULK_SCANS = 1000
+# オフライン用エクスポートを作り直す間隔（秒）と、差分の基準として覚えておく版の数
+EXPORT_MAX_AGE = float(os.environ.get('EXPORT_MAX_AGE', 5))
+EXPORT_KEEP_VERSIONS = 8
+# エクスポートの履歴を覚えておくイベントの数
+EXPORT_CACHE_EVENTS = 32
+
+# チケットID -> (値, ETag)。当たれば読み込みなしで条件付き書き込みから始められる
+_ticket_etags = OrderedDict()
+_ticket_etags_lock = threading.Lock()
+
+# チケットID -> 使用済みのチケット。使用済みは元に戻らないので、同じコードの再スキャンは読まずに弾ける
+_used_tickets = OrderedDict()
+_used_tickets_lock = threading.Lock()
+
+# QRコードのトークンに署名する鍵（TICKET_SIGNING_KEY）。未設定なら従来の JSON を載せる
+ticket_signer = signer_from_env()
+# 1 にすると署名なしの ticket_id を受け付けない（署名前に発行したチケットがなくなってから）
+REQUIRE_SIGNED_TICKETS = ticket_signer is not None and os.environ.get('REQUIRE_SIGNED_TICKETS') == '1'
+# 再集計など管理用 API のキー（X-Admin-Key ヘッダーで送る）。未設定なら管理用 API は使えない
+ADMIN_KEY = os.environ.get('ADMIN_KEY')
+
+# 応答を待たせずに統計カウンタを更新するためのスレッド
+_background = None
+# 一括検証でチケットを並行して読み書きするスレッド（接続プールと同じ数）
+_bulk_readers = None
+# tickets をストリーミング API で写したローカルキャッシュ（TICKET_CACHE=0 で無効）
+ticket_cache = None
+_services_lock = threading.RLock()
+
+# イベント名（None は全イベント）-> ExportHistory。古い順に EXPORT_CACHE_EVENTS 件まで
+_exports = OrderedDict()
+_exports_lock = threading.Lock()
+
+_qr_pool = None
+_qr_pool_lock = threading.Lock()
+
+# Firebase クライアント・スレッドプール・チケットキャッシュはモジュールの読み込み時には作らず、
+# 最初に使うときに作る。QRコード生成のワーカーは spawn で起動するので、python main.py で
+# 動かしているとワーカーごとにこのファイルが __mp_main__ として読み込み直される。
+# 読み込み時に作ると、ワーカーごとに SSE の接続やスレッドができてしまう
+
+def get_firebase():
+    """Firebase クライアント（初回に作る）"""
+    global firebase
+    with _services_lock:
+        if firebase is None:
+            firebase = FirebaseClient(DATABASE_URL)
+        return firebase
+
+def get_ticket_cache():
+    """チケットのローカルキャッシュ（初回に接続を始める。TICKET_CACHE=0 なら None）"""
+    global ticket_cache
+    if os.environ.get('TICKET_CACHE', '1') == '0':
+        return None
+    with _services_lock:
+        if ticket_cache is None:
+            ticket_cache = TicketCache(get_firebase().url(f"{BASE_PATH}/tickets")).start()
+        return ticket_cache
+
+def get_background():
+    """統計カウンタの更新などを応答の後で実行するスレッドプール"""
+    global _background
+    with _services_lock:
+        if _background is None:
+            _background = ThreadPoolExecutor(max_workers=2)
+        return _background
+
+def get_bulk_readers():
+    """一括検証でチケットを並行して読み書きするスレッドプール"""
+    global _bulk_readers
+    with _services_lock:
+        if _bulk_readers is None:
+            _bulk_readers = ThreadPoolExecutor(max_workers=get_firebase().pool_size)
+        return _bulk_readers
+
+def get_qr_pool():
+    """QRコード生成用のプロセスプール（初回に起動し、終了時に止める）
+
+    スレッドが動いているサーバーから fork すると、ロックを持ったままのスレッドの
+    状態まで子にコピーされるので spawn で起動する。spawn のワーカーは起動したスクリプト
+    （python main.py ならこのファイル）を読み込み直すが、読み込み時には接続もスレッドも
+    作らないので、ワーカーで動くのは qr_render の生成処理だけになる。
+    """
+    global _qr_pool
+    with _qr_pool_lock:
+        if _qr_pool is None:
+            workers = int(os.environ.get('QR_WORKERS', min(QR_DEFAULT_WORKERS, os.cpu_count() or 1)))
+            _qr_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(shutdown_qr_pool)
+        return _qr_pool
+
+def shutdown_qr_pool():
+    """QRコード生成用のプロセスプールを止める（未着手のタスクは取り消す）"""
+    global _qr_pool
+    with _qr_pool_lock:
+        pool, _qr_pool = _qr_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def firebase_path(path):
+    """アプリ配下の Firebase パス"""
+    return f"{BASE_PATH}/{path}"
+
+def firebase_get(path, params=None):
     """Firebaseからデータを取得"""
     try:
-        response = requests.get(get_firebase_ref(path))
+        response = get_firebase().get(firebase_path(path), params=params)
         if response.status_code == 200:
             return response.json()
         return None
@@ -37,40 +170,556 @@ def firebase_get(path):
 def firebase_put(path, data):
     """Firebaseにデータを保存"""
     try:
-        response = requests.put(get_firebase_ref(path), json=data)
+        response = get_firebase().put(firebase_path(path), data)
         return response.status_code == 200
     except Exception as e:
         print(f"Firebase PUT error: {e}")
         return False
 
-def firebase_patch(path, data):
-    """Firebaseのデータを更新"""
+def firebase_patch(path, data, **kwargs):
+    """Firebaseのデータを更新（統計のインクリメントを含むときは max_retries=0 で呼ぶ）"""
     try:
-        response = requests.patch(get_firebase_ref(path), json=data)
+        response = get_firebase().patch(firebase_path(path), data, **kwargs)
         return response.status_code == 200
     except Exception as e:
         print(f"Firebase PATCH error: {e}")
         return False
 
-def generate_qr_code(data):
-    """QRコードを生成してBase64エンコード"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="black", back_color="white")
+def increment(n=1):
+    """Firebase のサーバー側インクリメント"""
+    return {'.sv': {'increment': n}}
+
+def event_key(event_name):
+    """イベント名から Firebase のキーを作る（名前に . # $ [ ] / が含まれてもよいようにハッシュ化）"""
+    return hashlib.sha256(event_name.encode('utf-8')).hexdigest()[:20]
+
+def stats_updates(event_name, total=0, used=0):
+    """統計カウンタ（全体・イベント別）を増やすマルチパス更新"""
+    updates = {}
+    key = event_key(event_name)
+    for field, n in (('total', total), ('used', used)):
+        if n:
+            updates[f"stats/total/{field}"] = increment(n)
+            updates[f"stats/events/{key}/{field}"] = increment(n)
+    updates[f"stats/events/{key}/event_name"] = event_name
+    return updates
+
+def is_admin_request():
+    """X-Admin-Key ヘッダーが ADMIN_KEY と一致するか"""
+    key = request.headers.get('X-Admin-Key')
+    if not ADMIN_KEY or key is None:
+        return False
+    return hmac.compare_digest(key.encode('utf-8'), ADMIN_KEY.encode('utf-8'))
+
+def format_stats(counters):
+    total = (counters or {}).get('total', 0)
+    used = (counters or {}).get('used', 0)
+    return {
+        'total': total,
+        'used': used,
+        'unused': total - used
+    }
+
+def scan_tickets(page_size=RECONCILE_PAGE_SIZE):
+    """チケットをキー順にページ単位で読み出す"""
+    start_at = None
+    while True:
+        params = {'orderBy': '"$key"', 'limitToFirst': page_size}
+        if start_at is not None:
+            # startAt は指定したキー自体も含むので1件多く読んで先頭を捨てる
+            params['startAt'] = json.dumps(start_at)
+            params['limitToFirst'] = page_size + 1
+        page = firebase_get("tickets", params=params)
+        if page is None:
+            raise RuntimeError('チケットの読み込みに失敗しました')
+        keys = sorted(page)
+        if start_at is not None and keys and keys[0] == start_at:
+            keys = keys[1:]
+        for key in keys:
+            yield key, page[key]
+        if len(keys) < page_size:
+            return
+        start_at = keys[-1]
+
+def reconcile_stats(page_size=RECONCILE_PAGE_SIZE):
+    """全チケットを走査して統計カウンタを再計算し、上書きする
+
+    作成・使用時の増分更新が失敗したり、カウンタ導入前のチケットがあったりしても
+    これで正しい値に戻る。走査中に作成・使用されたチケットの増分は上書きで
+    失われることがあるので、利用の少ない時間帯に実行する。
+    """
+    totals = {'total': 0, 'used': 0}
+    events = {}
+    for _, ticket in scan_tickets(page_size):
+        event_name = ticket.get('event_name', 'イベント')
+        counters = events.setdefault(event_key(event_name), {'event_name': event_name, 'total': 0, 'used': 0})
+        used = int(bool(ticket.get('used')))
+        for target in (totals, counters):
+            target['total'] += 1
+            target['used'] += used
+
+    if not firebase_put("stats", {'total': totals, 'events': events}):
+        raise RuntimeError('統計の保存に失敗しました')
+    return totals, events
+
+def read_ticket(ticket_id):
+    """チケットを読む（キャッシュにあればネットワークに出ない）"""
+    cache = get_ticket_cache()
+    if cache is not None:
+        hit, ticket = cache.get(ticket_id)
+        # 作成直後でまだイベントが届いていないこともあるので、無ければ読みに行く
+        if hit and ticket:
+            return ticket
+    return firebase_get(f"tickets/{ticket_id}")
+
+def run_steps(steps):
+    """*_steps の手順を同期版の Firebase クライアントで実行し、その戻り値を返す
+
+    手順は Firebase への読み書きを (メソッド名, 引数...) で yield し、結果を send で
+    受け取るジェネレーター。asgi.run_steps は同じ手順を await で回すだけなので、
+    判定の処理は同期版と asyncio 版で1か所にまとまる。
+    """
+    try:
+        call = next(steps)
+        while True:
+            method, *args = call
+            call = steps.send(getattr(get_firebase(), method)(*args))
+    except StopIteration as done:
+        return done.value
+
+def prefetch_steps(ticket_id):
+    """続く validate-ticket が書き込み1回で済むように ETag を取っておく手順"""
+    ticket, etag = yield ('get_with_etag', firebase_path(f"tickets/{ticket_id}"))
+    if ticket:
+        remember_etag(ticket_id, ticket, etag)
+
+def prefetch_etag(ticket_id):
+    run_steps(prefetch_steps(ticket_id))
+
+def lookup_steps(ticket_id):
+    """check-ticket でチケットを読む手順。(チケット, ETag を裏で取っておくか) を返す
+
+    キャッシュにあればそれを返し、未使用なら続く validate-ticket に備えて ETag を
+    裏で取得させる。なければ ETag も一緒に読んで覚えておき、続く validate-ticket を
+    書き込み1回で済ませる。
+    """
+    cache = get_ticket_cache()
+    hit, ticket = cache.get(ticket_id) if cache is not None else (False, None)
+    if hit and ticket:
+        return ticket, not ticket.get('used')
+    ticket, etag = yield ('get_with_etag', firebase_path(f"tickets/{ticket_id}"))
+    if ticket:
+        remember_etag(ticket_id, ticket, etag)
+    return ticket, False
+
+def new_ticket_records(event_name, ticket_count):
+    """新しいチケットのレコード（チケットID -> レコード）"""
+    created_at = datetime.now().isoformat()
+    records = {}
+    for _ in range(ticket_count):
+        ticket_id = str(uuid.uuid4())
+        records[ticket_id] = {
+            'id': ticket_id,
+            'event_name': event_name,
+            'created_at': created_at,
+            'used': False,
+            'used_at': None
+        }
+    return records
+
+def create_updates(records, event_name):
+    """チケットと統計カウンタをまとめて書き込むマルチパス更新"""
+    updates = {f"tickets/{ticket_id}": record for ticket_id, record in records.items()}
+    updates.update(stats_updates(event_name, total=len(records)))
+    return updates
+
+def created_tickets(records, qr_codes):
+    """作成したチケットの応答用リスト"""
+    return [
+        {
+            'ticket_id': ticket_id,
+            'event_name': record['event_name'],
+            'qr_code': qr_code,
+            'created_at': record['created_at']
+        }
+        for (ticket_id, record), qr_code in zip(records.items(), qr_codes)
+    ]
+
+def remember_etag(ticket_id, ticket, etag):
+    with _ticket_etags_lock:
+        _ticket_etags[ticket_id] = (ticket, etag)
+        _ticket_etags.move_to_end(ticket_id)
+        while len(_ticket_etags) > ETAG_CACHE_SIZE:
+            _ticket_etags.popitem(last=False)
+
+def cached_etag(ticket_id):
+    with _ticket_etags_lock:
+        return _ticket_etags.pop(ticket_id, (None, None))
+
+def remember_used(ticket_id, ticket):
+    with _used_tickets_lock:
+        _used_tickets[ticket_id] = ticket
+        _used_tickets.move_to_end(ticket_id)
+        while len(_used_tickets) > USED_TICKET_CACHE_SIZE:
+            _used_tickets.popitem(last=False)
+
+def used_ticket(ticket_id):
+    with _used_tickets_lock:
+        return _used_tickets.get(ticket_id)
+
+def scanned_ticket_id(data):
+    """リクエストのチケットIDを取り出す
+
+    token（QRコードの署名付きトークン）があれば署名を確かめてチケットIDにする。
+    (チケットID, 偽物か) を返す。署名が合わないトークン・UUID の形でないID は
+    存在しようがないので、Firebase を読まずに偽物として扱う。
+    """
+    token = data.get('token')
+    if token is not None and not isinstance(token, str):
+        return None, True
+    if token:
+        ticket_id = ticket_signer.verify(token) if ticket_signer is not None else None
+        return ticket_id, ticket_id is None
+
+    ticket_id = data.get('ticket_id')
+    if not ticket_id:
+        return None, False
+    try:
+        canonical = str(uuid.UUID(ticket_id)) == ticket_id
+    except (TypeError, ValueError, AttributeError):
+        canonical = False
+    if not canonical or REQUIRE_SIGNED_TICKETS:
+        return None, True
+    return ticket_id, False
+
+def redeem_steps(ticket_id, used_at):
+    """チケットを ETag 条件付き書き込みで使用済みにする手順（run_steps で実行する）
+
+    ('ok' | 'used' | 'missing', チケット) を返す。他のゲートが先に書き込んで
+    ETag が変わっていれば 412 と一緒に最新の値が返るので、それを見て
+    使用済みなら 'used'、そうでなければその ETag で再試行する。
+    ETag を覚えているチケット（check-ticket 済みなど）は書き込み1回で済み、
+    キャッシュで使用済みとわかっているチケットはネットワークに出ない。
+    """
+    # 使用済みは元に戻らないので、キャッシュで使用済みならそれで確定
+    ticket = used_ticket(ticket_id)
+    if ticket is not None:
+        return 'used', ticket
+    cache = get_ticket_cache()
+    if cache is not None:
+        hit, ticket = cache.get(ticket_id)
+        if hit and ticket and ticket.get('used'):
+            return 'used', ticket
+
+    path = firebase_path(f"tickets/{ticket_id}")
+    ticket, etag = cached_etag(ticket_id)
+    if etag is None:
+        ticket, etag = yield ('get_with_etag', path)
+
+    for _ in range(MAX_REDEEM_ATTEMPTS):
+        if not ticket:
+            return 'missing', None
+        if ticket.get('used'):
+            remember_used(ticket_id, ticket)
+            # 通信エラーの再試行で自分の書き込みが先に通っていた場合は成功扱い
+            if ticket.get('used_at') == used_at:
+                return 'ok', ticket
+            return 'used', ticket
+
+        redeemed = {**ticket, 'used': True, 'used_at': used_at}
+        ok, current, etag = yield ('put_if_match', path, redeemed, etag)
+        if ok:
+            remember_used(ticket_id, redeemed)
+            return 'ok', redeemed
+        ticket = current
+
+    raise RuntimeError('チケットの更新が競合しました。もう一度お試しください')
+
+def redeem_ticket(ticket_id, used_at):
+    """チケットを使用済みにする（手順は redeem_steps）"""
+    return run_steps(redeem_steps(ticket_id, used_at))
+
+# error_result から respond までは、Flask のハンドラ（このファイル）と asyncio の
+# ハンドラ（asgi.py）で共通のリクエストの検証と応答の組み立て。(本文, ステータスコード) を
+# 返し、各ハンドラはそれを JSON にして返すだけにする
+
+def error_result(error, status=500):
+    return {'success': False, 'error': error}, status
+
+def not_found_result(flag):
+    """チケットが見つからないときの応答（flag は 'valid' か 'found'）"""
+    return {'success': False, flag: False, 'error': 'チケットが見つかりません'}, 200
+
+def create_params(data):
+    """作成リクエストの (イベント名, 枚数, エラー応答)"""
+    event_name = data.get('event_name', 'イベント')
+    ticket_count = int(data.get('ticket_count', 1))
+    if not 1 <= ticket_count <= MAX_TICKET_COUNT:
+        return event_name, ticket_count, error_result(f'チケット枚数は1〜{MAX_TICKET_COUNT}枚で指定してください', 400)
+    return event_name, ticket_count, None
+
+def create_result(records, qr_codes):
+    return {'success': True, 'tickets': created_tickets(records, qr_codes)}, 200
+
+def scan_params(data, flag):
+    """検証・確認リクエストの (チケットID, エラー応答)。flag は not_found_result に渡す"""
+    ticket_id, forged = scanned_ticket_id(data)
+    if forged:
+        return None, not_found_result(flag)
+    if not ticket_id:
+        return None, error_result('チケットIDが必要です', 400)
+    return ticket_id, None
+
+def redeem_result(status, ticket):
+    if status == 'missing':
+        return not_found_result('valid')
+    if status == 'used':
+        return {
+            'success': True,
+            'valid': False,
+            'error': '既に使用済みのチケットです',
+            'used_at': ticket.get('used_at')
+        }, 200
+    return {'success': True, 'valid': True, 'ticket': ticket}, 200
+
+def redeemed_stats(ticket):
+    """使用済みにしたチケットの統計カウンタ更新（応答の後で max_retries=0 で送る）"""
+    return stats_updates(ticket.get('event_name', 'イベント'), used=1)
+
+def check_result(ticket):
+    if not ticket:
+        return not_found_result('found')
+    return {'success': True, 'found': True, 'ticket': ticket}, 200
+
+def stats_path(event_name):
+    """統計カウンタのパス（event_name が None なら全体）"""
+    if event_name is None:
+        return "stats/total"
+    return f"stats/events/{event_key(event_name)}"
+
+def stats_result(counters):
+    return {'success': True, **format_stats(counters)}, 200
+
+def respond(result):
+    body, status = result
+    return jsonify(body), status
+
+def valid_ticket_ids(event_name=None):
+    """未使用のチケットID（キャッシュが使えればネットワークに出ない）"""
+    cache = get_ticket_cache()
+    if cache is not None and cache.ready:
+        with cache.lock:
+            tickets = list(cache.tickets.items())
+    else:
+        tickets = scan_tickets()
+    return [
+        ticket_id for ticket_id, ticket in tickets
+        if isinstance(ticket, dict) and not ticket.get('used')
+        and (event_name is None or ticket.get('event_name', 'イベント') == event_name)
+    ]
+
+def export_history(event_name=None):
+    """イベントのエクスポート履歴（統計カウンタのないイベントは None）
+
+    履歴は件数上限付きの LRU で持つ。知らないイベント名ごとに履歴を作ると
+    クエリ文字列だけでいくらでも増え、そのたびに全件を読むことになるので、
+    統計カウンタ（作成時に作られる）があるイベントだけを受け付ける。
+    """
+    with _exports_lock:
+        history = _exports.get(event_name)
+        if history is not None:
+            _exports.move_to_end(event_name)
+            return history
+
+    if event_name is not None:
+        # 通信エラーは「ない」と区別して例外にする
+        response = get_firebase().get(firebase_path(stats_path(event_name)))
+        response.raise_for_status()
+        if response.json() is None:
+            return None
+
+    with _exports_lock:
+        history = _exports.get(event_name)
+        if history is None:
+            history = _exports[event_name] = ExportHistory(
+                lambda: valid_ticket_ids(event_name), keep=EXPORT_KEEP_VERSIONS, max_age=EXPORT_MAX_AGE
+            )
+        _exports.move_to_end(event_name)
+        while len(_exports) > EXPORT_CACHE_EVENTS:
+            _exports.popitem(last=False)
+        return history
+
+def scan_time(value):
+    """スキャン時刻（ISO 8601）を used_at と同じローカル時刻にそろえる"""
+    if value is None:
+        return datetime.now()
+    scanned = datetime.fromisoformat(value)
+    if scanned.tzinfo is not None:
+        scanned = scanned.astimezone().replace(tzinfo=None)
+    return scanned
+
+def bulk_scan(item):
+    """一括検証の1件を (チケットID, スキャン時刻, 判定) にする（判定は読めたときは None）
+
+    形式の誤りはその1件だけの判定にして、まとめて送られた他のスキャンは処理する。
+    """
+    if not isinstance(item, dict):
+        return None, None, {'ticket_id': None, 'valid': False, 'error': 'スキャンはオブジェクトで指定してください'}
+    for key in ('token', 'ticket_id'):
+        if item.get(key) is not None and not isinstance(item[key], str):
+            return None, None, {'ticket_id': None, 'valid': False, 'error': f'{key} は文字列で指定してください'}
+
+    ticket_id, forged = scanned_ticket_id(item)
+    if forged:
+        # 読まずに「見つからない」と判定する
+        given = item.get('token') or item.get('ticket_id')
+        return None, None, {'ticket_id': given, 'valid': False, 'error': 'チケットが見つかりません'}
+    if not ticket_id:
+        return None, None, {'ticket_id': None, 'valid': False, 'error': 'チケットIDが必要です'}
+
+    scanned_at = item.get('scanned_at')
+    try:
+        if scanned_at is not None and not isinstance(scanned_at, str):
+            raise TypeError(scanned_at)
+        scanned = scan_time(scanned_at)
+    except (TypeError, ValueError):
+        return None, None, {'ticket_id': ticket_id, 'valid': False, 'error': f'scanned_at が読めません: {scanned_at}'}
+    return ticket_id, scanned, None
+
+def judge_scans(ticket_id, ticket, scans):
+    """1枚のチケットへのスキャンを判定する（保存済みの使用が優先）
+
+    scans は時刻順の (位置, スキャン時刻) のリスト。(位置 -> 判定, 書き込むチケット) を
+    返す（書き込み不要なら None）。未使用なら一番早いスキャンを有効にして使用済みにする。
+    使用済みなら、後から届いたスキャンの方が早い時刻でも保存済みの used_at を変えない
+    （その時点で入場は済んでいて、スキャナーの時計も当てにならない）。used_at と同じ
+    時刻のスキャン（送り直し）だけを有効のまま返す。nekokazu/ticket-app の
+    /api/tickets/verify-batch も同じ規則。
+    """
+    if not ticket:
+        return {index: {'ticket_id': ticket_id, 'valid': False, 'error': 'チケットが見つかりません'}
+                for index, _ in scans}, None
+
+    used = bool(ticket.get('used'))
+    first = ticket.get('used_at') if used else scans[0][1].isoformat()
+
+    verdicts = {}
+    for index, scanned in scans:
+        if scanned.isoformat() == first:
+            verdicts[index] = {'ticket_id': ticket_id, 'valid': True, 'used_at': first}
+        else:
+            verdicts[index] = {
+                'ticket_id': ticket_id,
+                'valid': False,
+                'error': '既に使用済みのチケットです',
+                'used_at': first
+            }
 
-    # Base64エンコード
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    if used:
+        return verdicts, None
+    return verdicts, {**ticket, 'used': True, 'used_at': first}
+
+def bulk_redeem_steps(ticket_id, scans):
+    """1枚のチケットへのスキャンを ETag 条件付き書き込みで反映する手順（run_steps で実行する）
+
+    (位置 -> 判定, 使用済みにしたチケット) を返す。使用済みにしたチケット（統計に
+    数える分）は書き込みが通ったときだけ返し、それ以外は None。書き込むのは未使用の
+    チケットだけで、同時に validate-ticket が同じチケットを使用済みにしていれば 412 で
+    その値を受け取って判定し直すので、二重に使用済みにも二重に数えもしない。
+    """
+    # 使用済みは元に戻らず、保存済みの used_at も変えないので、キャッシュだけで判定できる
+    known = used_ticket(ticket_id)
+    cache = get_ticket_cache()
+    if known is None and cache is not None:
+        hit, cached = cache.get(ticket_id)
+        known = cached if hit and cached and cached.get('used') else None
+    if known is not None:
+        return judge_scans(ticket_id, known, scans)
+
+    path = firebase_path(f"tickets/{ticket_id}")
+    ticket, etag = cached_etag(ticket_id)
+    if etag is None:
+        ticket, etag = yield ('get_with_etag', path)
+
+    for _ in range(MAX_REDEEM_ATTEMPTS):
+        verdicts, record = judge_scans(ticket_id, ticket, scans)
+        if record is None:
+            if ticket:
+                remember_used(ticket_id, ticket)
+            return verdicts, None
+
+        ok, current, etag = yield ('put_if_match', path, record, etag)
+        if ok:
+            remember_used(ticket_id, record)
+            return verdicts, record
+        ticket = current
+
+    raise RuntimeError('チケットの更新が競合しました。もう一度お試しください')
+
+def settle_scans(ticket_id, scans):
+    """1枚分のスキャンを反映する（get_bulk_readers() のスレッドで並行して実行する）"""
+    return run_steps(bulk_redeem_steps(ticket_id, sorted(scans, key=lambda scan: scan[1])))
+
+def used_stats_updates(used_counts):
+    """イベント名 -> 使用済みにした枚数 から統計カウンタの更新を作る"""
+    updates = {}
+    for event_name, used in used_counts.items():
+        updates.update(stats_updates(event_name, used=used))
+    if used_counts:
+        # 全体のカウンタはイベントごとの分を合計して1回で増やす
+        updates["stats/total/used"] = increment(sum(used_counts.values()))
+    return updates
+
+def render_qr_png(data):
+    """QRコードを生成してPNGのバイト列にする（1ビット、qr_render.py）"""
+    return render_png(data, box_size=10, border=4)
 
-    return f"data:image/png;base64,{img_str}"
+def generate_qr_code(data):
+    """QRコードを生成してBase64エンコード"""
+    return generate_qr_codes([data])[0]
+
+def generate_qr_codes(payloads):
+    """複数のQRコードをまとめて生成する"""
+    return render_png_data_urls(payloads, box_size=10, border=4)
+
+def ticket_qr_data(ticket_id, event_name):
+    """QRコードに埋め込む内容（署名鍵があれば署名付きトークン）"""
+    if ticket_signer is not None:
+        return ticket_signer.sign(ticket_id)
+    return json.dumps({
+        'ticket_id': ticket_id,
+        'event_name': event_name
+    })
+
+def submit_qr_codes(payloads):
+    """QRコード生成をプロセスプールに投入し、(開始位置, Future) のリストを返す"""
+    pool = get_qr_pool()
+    return [
+        (start, pool.submit(render_png_data_urls, payloads[start:start + QR_CHUNK_SIZE]))
+        for start in range(0, len(payloads), QR_CHUNK_SIZE)
+    ]
+
+def start_qr_codes(records, event_name):
+    """QRコードの内容と、枚数が多ければプロセスプールに投入した Future のリスト（少なければ None）"""
+    payloads = [ticket_qr_data(ticket_id, event_name) for ticket_id in records]
+    futures = submit_qr_codes(payloads) if len(payloads) > QR_INLINE_COUNT else None
+    return payloads, futures
+
+def cancel_qr_codes(futures):
+    for _, future in futures or []:
+        future.cancel()
+
+def collect_qr_codes(futures, count, deadline):
+    """期限までに生成できたQRコードを集める（間に合わなかった分は None）"""
+    qr_codes = [None] * count
+    done, not_done = wait([future for _, future in futures], timeout=max(0, deadline - time.monotonic()))
+    for start, future in futures:
+        if future in done and future.exception() is None:
+            chunk = future.result()
+            qr_codes[start:start + len(chunk)] = chunk
+    for future in not_done:
+        future.cancel()
+    return qr_codes
 
 @app.route('/')
 def index():
@@ -83,43 +732,62 @@ def index():
 
 @app.route('/api/create-ticket', methods=['POST'])
 def create_ticket():
-    """チケットを作成"""
+    """チケットを作成
+
+    全チケットを1回のマルチパス PATCH で保存し、QRコードはその間に
+    プロセスプールで並列に生成する。QR_RENDER_TIMEOUT 秒で打ち切るので、
+    大量作成でも応答時間は一定以内に収まる（間に合わなかったQRコードは
+    qr_code が null になり、/api/tickets/<id>/qr から取得できる）。
+    """
     try:
-        data = request.json
-        event_name = data.get('event_name', 'イベント')
-        ticket_count = int(data.get('ticket_count', 1))
-
-        tickets = []
-        for _ in range(ticket_count):
-            ticket_id = str(uuid.uuid4())
-            ticket_data = {
-                'id': ticket_id,
-                'event_name': event_name,
-                'created_at': datetime.now().isoformat(),
-                'used': False,
-                'used_at': None
-            }
+        deadline = time.monotonic() + QR_RENDER_TIMEOUT
+        event_name, ticket_count, error = create_params(request.json)
+        if error:
+            return respond(error)
 
-            # Firebaseに保存
-            if firebase_put(f"tickets/{ticket_id}", ticket_data):
-                # QRコード生成
-                qr_data = json.dumps({
-                    'ticket_id': ticket_id,
-                    'event_name': event_name
-                })
-                qr_image = generate_qr_code(qr_data)
-
-                tickets.append({
-                    'ticket_id': ticket_id,
-                    'event_name': event_name,
-                    'qr_code': qr_image,
-                    'created_at': ticket_data['created_at']
-                })
+        records = new_ticket_records(event_name, ticket_count)
 
-        return jsonify({
-            'success': True,
-            'tickets': tickets
-        })
+        # QRコード生成を先に投入して、Firebase への書き込みと並行させる
+        payloads, futures = start_qr_codes(records, event_name)
+
+        # Firebaseに一括保存（tickets/<id> と統計カウンタをまとめて1リクエストで書き込む）
+        # 統計のインクリメントを含むので再試行しない（応答が失われると二重に数えるため）
+        if not firebase_patch("", create_updates(records, event_name), max_retries=0):
+            cancel_qr_codes(futures)
+            return respond(error_result('チケットの保存に失敗しました'))
+
+        if futures is None:
+            qr_codes = generate_qr_codes(payloads)
+        else:
+            qr_codes = collect_qr_codes(futures, ticket_count, deadline)
+
+        return respond(create_result(records, qr_codes))
+
+    except Exception as e:
+        return respond(error_result(str(e)))
+
+@app.route('/api/tickets/<ticket_id>/qr', methods=['GET'])
+def get_ticket_qr(ticket_id):
+    """チケットのQRコード画像（一括作成時に生成が間に合わなかった分）
+
+    クエリ format=svg なら SVG で返す。
+    """
+    try:
+        ticket = read_ticket(ticket_id)
+
+        if not ticket:
+            return jsonify({
+                'success': False,
+                'error': 'チケットが見つかりません'
+            }), 404
+
+        data = ticket_qr_data(ticket_id, ticket.get('event_name', 'イベント'))
+        if request.args.get('format') == 'svg':
+            response = make_response(render_svg(data, box_size=10, border=4))
+            response.mimetype = 'image/svg+xml'
+            return response
+        png = render_qr_png(data)
+        return send_file(io.BytesIO(png), mimetype='image/png')
 
     except Exception as e:
         return jsonify({
@@ -130,44 +798,90 @@ def create_ticket():
 @app.route('/api/validate-ticket', methods=['POST'])
 def validate_ticket():
     """チケットを検証・使用"""
+    try:
+        ticket_id, error = scan_params(request.json, 'valid')
+        if error:
+            return respond(error)
+
+        # 未使用のときだけ使用済みにする（他のゲートと同時に読み取っても1回だけ成功する）
+        status, ticket = redeem_ticket(ticket_id, datetime.now().isoformat())
+
+        if status == 'ok':
+            # 統計カウンタは応答の後で更新する（失敗しても再集計で直る）
+            get_background().submit(firebase_patch, "", redeemed_stats(ticket), max_retries=0)
+
+        return respond(redeem_result(status, ticket))
+
+    except Exception as e:
+        return respond(error_result(str(e)))
+
+@app.route('/api/validate-tickets', methods=['POST'])
+def validate_tickets():
+    """スキャンをまとめて検証・使用（オフラインだったスキャナーの再送用）
+
+    {"scans": [{"ticket_id" か "token": ..., "scanned_at": ISO 8601}, ...]} を受け取り、
+    チケットごとに並行して ETag 条件付き書き込みで使用済みにし、最後に統計カウンタを
+    1回で増やす。判定の規則は judge_scans（未使用なら一番早いスキャンが有効、使用済みなら
+    保存済みの使用が優先）。形式の誤ったスキャンはその1件だけを無効と判定する。
+    判定は送られた順に返す。書き込みに失敗したらそのまま送り直せばよい（同じスキャンは
+    有効のまま返る）。
+
+    使用済みにするチケットは1枚ごとに読み込み1回と条件付き書き込み1回になる。
+    REST のマルチパス PATCH には if-match を付けられないので、別のゲートと同時に
+    使用済みにしても1回だけ通すには1枚ずつの条件付き書き込みが要る。読み込みは
+    ETag を覚えているチケットでは省き、キャッシュで使用済みとわかるチケットは
+    読み込みも書き込みもしない。
+    """
     try:
         data = request.json
-        ticket_id = data.get('ticket_id')
+        items = data.get('scans')
 
-        if not ticket_id:
+        if not isinstance(items, list) or not 1 <= len(items) <= MAX_BULK_SCANS:
             return jsonify({
                 'success': False,
-                'error': 'チケットIDが必要です'
+                'error': f'scans は1〜{MAX_BULK_SCANS}件のリストで指定してください'
             }), 400
 
-        # チケット情報を取得
-        ticket = firebase_get(f"tickets/{ticket_id}")
-
-        if not ticket:
+        verdicts = [None] * len(items)
+        scans = {}
+        for index, item in enumerate(items):
+            ticket_id, scanned, verdict = bulk_scan(item)
+            if verdict is not None:
+                verdicts[index] = verdict
+            else:
+                scans.setdefault(ticket_id, []).append((index, scanned))
+
+        # チケットごとに条件付き書き込みで反映する（別のゲートの書き込みとは ETag で競合を検知する）
+        futures = {ticket_id: get_bulk_readers().submit(settle_scans, ticket_id, ticket_scans)
+                   for ticket_id, ticket_scans in scans.items()}
+        used_counts = {}
+        failed = False
+        for ticket_id, future in futures.items():
+            try:
+                ticket_verdicts, redeemed = future.result()
+            except Exception as e:
+                print(f"Firebase redeem error: {e}")
+                failed = True
+                continue
+            for index, verdict in ticket_verdicts.items():
+                verdicts[index] = verdict
+            if redeemed is not None:
+                event_name = redeemed.get('event_name', 'イベント')
+                used_counts[event_name] = used_counts.get(event_name, 0) + 1
+
+        # 統計は書き込みが通った分だけ数える（失敗しても再集計で直る）
+        if used_counts:
+            firebase_patch("", used_stats_updates(used_counts), max_retries=0)
+
+        if failed:
             return jsonify({
                 'success': False,
-                'valid': False,
-                'error': 'チケットが見つかりません'
-            })
-
-        if ticket.get('used'):
-            return jsonify({
-                'success': True,
-                'valid': False,
-                'error': '既に使用済みのチケットです',
-                'used_at': ticket.get('used_at')
-            })
-
-        # チケットを使用済みにする
-        firebase_patch(f"tickets/{ticket_id}", {
-            'used': True,
-            'used_at': datetime.now().isoformat()
-        })
+                'error': 'チケットの更新に失敗しました'
+            }), 500
 
         return jsonify({
             'success': True,
-            'valid': True,
-            'ticket': ticket
+            'results': verdicts
         })
 
     except Exception as e:
@@ -176,33 +890,38 @@ def validate_ticket():
             'error': str(e)
         }), 500
 
-@app.route('/api/check-ticket', methods=['POST'])
-def check_ticket():
-    """チケット状態を確認（使用しない）"""
+@app.route('/api/tickets/export', methods=['GET'])
+def export_tickets():
+    """オフライン検証用の未使用チケット一覧（形式は ticket_export.py）
+
+    クエリ event_name でイベントを絞り込む（統計カウンタのないイベントは 404）。since に前回の X-Ticket-Export-Version を
+    渡すと差分だけを返す（その版を覚えていなければ全件）。一覧は EXPORT_MAX_AGE 秒ごとに
+    作り直すので、それまでの変更は次の版に入る。使用したチケットは /api/validate-tickets で送る。
+    """
     try:
-        data = request.json
-        ticket_id = data.get('ticket_id')
+        since = request.args.get('since')
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'since が不正です'
+        }), 400
 
-        if not ticket_id:
+    try:
+        history = export_history(request.args.get('event_name'))
+        if history is None:
             return jsonify({
                 'success': False,
-                'error': 'チケットIDが必要です'
-            }), 400
-
-        ticket = firebase_get(f"tickets/{ticket_id}")
+                'error': 'イベントが見つかりません'
+            }), 404
 
-        if not ticket:
-            return jsonify({
-                'success': False,
-                'found': False,
-                'error': 'チケットが見つかりません'
-            })
+        version, data = history.export(since)
 
-        return jsonify({
-            'success': True,
-            'found': True,
-            'ticket': ticket
-        })
+        response = make_response(data)
+        response.mimetype = 'application/octet-stream'
+        response.headers['X-Ticket-Export-Version'] = str(version)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
 
     except Exception as e:
         return jsonify({
@@ -210,28 +929,53 @@ def check_ticket():
             'error': str(e)
         }), 500
 
+@app.route('/api/check-ticket', methods=['POST'])
+def check_ticket():
+    """チケット状態を確認（使用しない）"""
+    try:
+        ticket_id, error = scan_params(request.json, 'found')
+        if error:
+            return respond(error)
+
+        ticket, prefetch = run_steps(lookup_steps(ticket_id))
+        if prefetch:
+            get_background().submit(prefetch_etag, ticket_id)
+
+        return respond(check_result(ticket))
+
+    except Exception as e:
+        return respond(error_result(str(e)))
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    """統計情報を取得"""
+    """統計情報を取得
+
+    作成・使用のたびに更新しているカウンタを読むだけなので、チケット数に関係なく一定時間で返る。
+    クエリ event_name を指定するとそのイベントの統計を返す。
+    """
     try:
-        tickets = firebase_get("tickets")
+        counters = firebase_get(stats_path(request.args.get('event_name')))
+        return respond(stats_result(counters))
 
-        if not tickets:
-            return jsonify({
-                'success': True,
-                'total': 0,
-                'used': 0,
-                'unused': 0
-            })
+    except Exception as e:
+        return respond(error_result(str(e)))
 
-        total = len(tickets)
-        used = sum(1 for t in tickets.values() if t.get('used'))
+@app.route('/api/stats/reconcile', methods=['POST'])
+def post_reconcile_stats():
+    """統計カウンタをチケットから再集計する（Cloud Scheduler などから X-Admin-Key 付きで定期実行）"""
+    if not is_admin_request():
+        return jsonify({
+            'success': False,
+            'error': '管理用のキーが必要です'
+        }), 403
+
+    try:
+        totals, events = reconcile_stats()
 
         return jsonify({
             'success': True,
-            'total': total,
-            'used': used,
-            'unused': total - used
+            **format_stats(totals),
+            'events': len(events)
         })
 
     except Exception as e:
@@ -240,6 +984,23 @@ def get_stats():
             'error': str(e)
         }), 500
 
+@app.route('/api/firebase-metrics', methods=['GET'])
+def get_firebase_metrics():
+    """Firebase 呼び出しのレイテンシ集計とキャッシュの状態"""
+    cache = get_ticket_cache()
+    if cache is not None:
+        cache = {
+            'ready': cache.ready,
+            'tickets': len(cache.tickets),
+            'events': cache.events,
+            'reconnects': cache.reconnects
+        }
+    return jsonify({
+        'success': True,
+        'metrics': get_firebase().metrics(),
+        'ticket_cache': cache
+    })
+
 def main(request):
     """Cloud Functions エントリーポイント"""
     with app.request_context(request.environ):
@@ -0,0 +1,260 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+# ストリーミング API に接続しないようにしてから読み込む
+os.environ.setdefault('TICKET_CACHE', '0')
+
+import main
+from firebase_client import FirebaseClient
+from firebase_standin import FirebaseStandIn
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    standin = FirebaseStandIn().start()
+    monkeypatch.setattr(main, 'firebase', FirebaseClient(standin.url, backoff=0))
+    yield standin
+    standin.stop()
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+def stored(standin, path):
+    return standin.db.get([part for part in main.firebase_path(path).split('/') if part])
+
+
+def test_qr_pool_uses_spawn_and_stops_its_workers():
+    payloads = [f'ticket-{i}' for i in range(main.QR_CHUNK_SIZE * 2)]
+    futures = main.submit_qr_codes(payloads)
+    qr_codes = main.collect_qr_codes(futures, len(payloads), time.monotonic() + 30)
+    assert qr_codes == main.generate_qr_codes(payloads)
+
+    pool = main.get_qr_pool()
+    assert pool._mp_context.get_start_method() == 'spawn'
+    assert pool._max_workers <= main.QR_DEFAULT_WORKERS
+    processes = list(pool._processes.values())
+
+    main.shutdown_qr_pool()
+    assert main._qr_pool is None
+    assert not any(process.is_alive() for process in processes)
+
+
+def test_spawned_worker_import_starts_nothing():
+    # spawn のワーカーは python main.py のスクリプトを __mp_main__ として読み込み直す
+    script = (
+        "import runpy, threading\n"
+        "module = runpy.run_path('main.py', run_name='__mp_main__')\n"
+        "assert module['firebase'] is None and module['ticket_cache'] is None\n"
+        "assert module['_background'] is None and module['_bulk_readers'] is None\n"
+        "assert threading.enumerate() == [threading.main_thread()], threading.enumerate()\n"
+    )
+    env = {k: v for k, v in os.environ.items() if k != 'TICKET_CACHE'}
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-c', script], cwd=directory, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+
+def test_lost_create_response_is_not_counted_twice(standin, client, monkeypatch):
+    send = main.firebase.session.request
+
+    def lose_patch_response(method, url, **kwargs):
+        response = send(method, url, **kwargs)
+        if method == 'PATCH':
+            raise requests.ReadTimeout()
+        return response
+
+    monkeypatch.setattr(main.firebase.session, 'request', lose_patch_response)
+    response = client.post('/api/create-ticket', json={'event_name': 'ライブ', 'ticket_count': 2})
+    assert response.status_code == 500
+    assert stored(standin, 'stats/total/total') == 2
+
+
+def test_reconcile_requires_the_admin_key(standin, client, monkeypatch):
+    assert client.post('/api/stats/reconcile').status_code == 403
+    monkeypatch.setattr(main, 'ADMIN_KEY', 'secret')
+    assert client.post('/api/stats/reconcile', headers={'X-Admin-Key': 'wrong'}).status_code == 403
+
+    client.post('/api/create-ticket', json={'event_name': 'ライブ', 'ticket_count': 3})
+    response = client.post('/api/stats/reconcile', headers={'X-Admin-Key': 'secret'})
+    assert response.status_code == 200
+    assert response.get_json()['total'] == 3
+
+
+def scan_flow(post):
+    """作成 → 確認 → 使用 → 再使用 の応答（ID・時刻は比べられないので除く）"""
+    created = post('/api/create-ticket', {'event_name': 'ライブ', 'ticket_count': 1})
+    ticket_id = created[0]['tickets'][0]['ticket_id']
+    steps = [
+        post('/api/check-ticket', {}),
+        post('/api/check-ticket', {'ticket_id': 'not-a-uuid'}),
+        post('/api/check-ticket', {'ticket_id': ticket_id}),
+        post('/api/validate-ticket', {'ticket_id': ticket_id}),
+        post('/api/validate-ticket', {'ticket_id': ticket_id}),
+    ]
+    for body, _ in steps:
+        body.pop('ticket', None)
+        body.pop('used_at', None)
+    return steps
+
+
+def test_flask_and_asgi_handlers_answer_alike(standin, client, monkeypatch):
+    from starlette.testclient import TestClient
+
+    import asgi
+    from firebase_client import AsyncFirebaseClient
+
+    def flask_post(path, data):
+        response = client.post(path, json=data)
+        return response.get_json(), response.status_code
+
+    flask_steps = scan_flow(flask_post)
+
+    monkeypatch.setattr(asgi, 'firebase', AsyncFirebaseClient(main.firebase.database_url, backoff=0))
+    with TestClient(asgi.app) as asgi_client:
+        def asgi_post(path, data):
+            response = asgi_client.post(path, json=data)
+            return response.json(), response.status_code
+
+        asgi_steps = scan_flow(asgi_post)
+
+    assert [status for _, status in flask_steps] == [400, 200, 200, 200, 200]
+    assert flask_steps[3][0]['valid'] is True and flask_steps[4][0]['valid'] is False
+    assert flask_steps == asgi_steps
+
+    # 統計は応答の後で更新されるので、届くまで待つ
+    deadline = time.monotonic() + 5
+    while stored(standin, 'stats/total') != {'total': 2, 'used': 2} and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stored(standin, 'stats/total') == {'total': 2, 'used': 2}
+
+
+def create_ticket_ids(client, count):
+    response = client.post('/api/create-ticket', json={'event_name': 'ライブ', 'ticket_count': count})
+    return [ticket['ticket_id'] for ticket in response.get_json()['tickets']]
+
+
+
+def test_concurrent_redeems_accept_exactly_one(standin, client, monkeypatch):
+    ticket_id, = create_ticket_ids(client, 1)
+    send = main.firebase.request
+    both_read = threading.Barrier(2)
+    statuses = []
+
+    def write_together(method, path, *args, **kwargs):
+        # 両方のゲートが同じ ETag を持った状態で条件付き書き込みを送らせる
+        if method == 'PUT' and 'if-match' in kwargs.get('headers', {}):
+            if len(statuses) < 2:
+                both_read.wait(timeout=5)
+            response = send(method, path, *args, **kwargs)
+            statuses.append(response.status_code)
+            return response
+        return send(method, path, *args, **kwargs)
+
+    monkeypatch.setattr(main.firebase, 'request', write_together)
+    results = []
+
+    def validate():
+        response = main.app.test_client().post('/api/validate-ticket', json={'ticket_id': ticket_id})
+        results.append((response.status_code, response.get_json()['valid']))
+
+    gates = [threading.Thread(target=validate) for _ in range(2)]
+    for gate in gates:
+        gate.start()
+    for gate in gates:
+        gate.join(timeout=10)
+
+    assert sorted(results) == [(200, False), (200, True)]
+    # 負けた方は 412 で最新の値を受け取り、読み直さずに使用済みと判定する
+    assert sorted(statuses) == [200, 412]
+    assert stored(standin, f'tickets/{ticket_id}/used') is True
+
+def test_bulk_scans_with_bad_values_fail_only_those_items(standin, client):
+    ticket_id, = create_ticket_ids(client, 1)
+    response = client.post('/api/validate-tickets', json={'scans': [
+        {'ticket_id': ['a']},
+        {'token': {'a': 1}},
+        'junk',
+        {},
+        {'ticket_id': ticket_id, 'scanned_at': 5},
+        {'ticket_id': ticket_id, 'scanned_at': '2026-01-01T18:00:00'},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['valid'] for result in results] == [False] * 5 + [True]
+    assert results[4]['ticket_id'] == ticket_id
+    assert stored(standin, 'stats/total/used') == 1
+
+
+def test_bulk_scan_racing_a_single_validate_counts_once(standin, client, monkeypatch):
+    ticket_id, = create_ticket_ids(client, 1)
+    send = main.firebase.request
+    raced = []
+
+    def validate_first(method, path, *args, **kwargs):
+        # 一括検証が読んでから書くまでの間に、別のゲートが同じチケットを使用済みにする
+        if method in ('PUT', 'PATCH') and not raced:
+            raced.append(method)
+            status, ticket = main.redeem_ticket(ticket_id, '2026-01-01T19:00:00')
+            assert status == 'ok'
+            main.firebase_patch("", main.redeemed_stats(ticket), max_retries=0)
+        return send(method, path, *args, **kwargs)
+
+    monkeypatch.setattr(main.firebase, 'request', validate_first)
+    response = client.post('/api/validate-tickets', json={'scans': [
+        {'ticket_id': ticket_id, 'scanned_at': '2026-01-01T18:00:00'},
+    ]})
+    # 先に保存された使用が優先で、スキャン時刻が早くても used_at は書き換えない
+    result = response.get_json()['results'][0]
+    assert result['valid'] is False and result['used_at'] == '2026-01-01T19:00:00'
+    assert stored(standin, f'tickets/{ticket_id}/used_at') == '2026-01-01T19:00:00'
+    assert stored(standin, 'stats/total/used') == 1
+
+
+def test_bulk_scans_keep_the_stored_redemption(standin, client):
+    used_id, fresh_id = create_ticket_ids(client, 2)
+    assert client.post('/api/validate-ticket', json={'ticket_id': used_id}).get_json()['valid'] is True
+    used_at = stored(standin, f'tickets/{used_id}/used_at')
+    # 統計は応答の後で更新されるので、届いてから数え始める
+    deadline = time.monotonic() + 5
+    while stored(standin, 'stats/total/used') != 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    requests = standin.db.requests
+
+    scans = [
+        {'ticket_id': used_id, 'scanned_at': '2000-01-01T00:00:00'},
+        {'ticket_id': fresh_id, 'scanned_at': '2026-01-01T18:05:00'},
+        {'ticket_id': fresh_id, 'scanned_at': '2026-01-01T18:00:00'},
+    ]
+    results = client.post('/api/validate-tickets', json={'scans': scans}).get_json()['results']
+    assert [result['valid'] for result in results] == [False, False, True]
+    assert results[0]['used_at'] == used_at
+    assert stored(standin, f'tickets/{used_id}/used_at') == used_at
+    assert stored(standin, f'tickets/{fresh_id}/used_at') == '2026-01-01T18:00:00'
+    # 使用済みのチケットは覚えているので読まず、書き込むのは未使用だった1枚だけ（+ 統計）
+    assert standin.db.requests - requests == 3
+
+    # 送り直しても同じ判定で、もう書き込まない
+    assert client.post('/api/validate-tickets', json={'scans': scans}).get_json()['results'] == results
+
+
+def test_export_history_is_bounded_and_skips_unknown_events(standin, client, monkeypatch):
+    monkeypatch.setattr(main, '_exports', main.OrderedDict())
+    monkeypatch.setattr(main, 'EXPORT_CACHE_EVENTS', 2)
+
+    assert client.get('/api/tickets/export?event_name=nope').status_code == 404
+    assert len(main._exports) == 0
+
+    for name in ('a', 'b', 'c'):
+        client.post('/api/create-ticket', json={'event_name': name, 'ticket_count': 1})
+        assert client.get(f'/api/tickets/export?event_name={name}').status_code == 200
+    assert list(main._exports) == ['b', 'c']
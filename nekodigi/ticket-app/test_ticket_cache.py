@@ -0,0 +1,107 @@
+import os
+import time
+
+import pytest
+
+# ストリーミング API に接続しないようにしてから読み込む
+os.environ.setdefault('TICKET_CACHE', '0')
+
+import main
+from firebase_client import FirebaseClient
+from firebase_standin import FirebaseStandIn
+from ticket_cache import TicketCache
+
+
+@pytest.fixture
+def standin():
+    standin = FirebaseStandIn().start()
+    yield standin
+    standin.stop()
+
+
+@pytest.fixture
+def firebase(standin):
+    return FirebaseClient(standin.url, backoff=0)
+
+
+@pytest.fixture
+def cache(firebase):
+    firebase.put('tickets', {'a': {'used': False}, 'b': {'used': False}})
+    cache = TicketCache(firebase.url('tickets'))
+    yield cache
+    cache.stop()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_primes_from_the_first_put(cache):
+    assert cache.get('a') == (False, None)
+    assert cache.start().wait_ready(5)
+    assert cache.get('a') == (True, {'used': False})
+    # 読み込み済みなら、無いことも確定する
+    assert cache.get('missing') == (True, None)
+
+
+def test_applies_puts_patches_and_deletes(cache, firebase):
+    cache.start().wait_ready(5)
+
+    firebase.put('tickets/c', {'used': False})
+    firebase.patch('tickets/a', {'used': True, 'used_at': '2026-01-01T18:00:00'})
+    # 別々のノードへのマルチパス更新（tickets の外から）
+    firebase.patch('', {'tickets/b/used': True, 'tickets/d': {'used': False}, 'stats/total/used': 1})
+    firebase.request('DELETE', 'tickets/c')
+
+    wait_until(lambda: cache.get('d') == (True, {'used': False}))
+    assert cache.get('a') == (True, {'used': True, 'used_at': '2026-01-01T18:00:00'})
+    assert cache.get('b') == (True, {'used': True})
+    assert cache.get('c') == (True, None)
+    assert set(cache.tickets) == {'a', 'b', 'd'}
+
+
+def test_reprimes_after_the_stream_drops(cache, firebase, standin):
+    cache.start().wait_ready(5)
+
+    standin.drop_streams()
+    wait_until(lambda: not cache.ready)
+    # 切断中の変更は差分としては届かないが、再接続時の最初の put で反映される
+    assert cache.get('a') == (False, None)
+    firebase.put('tickets/a', {'used': True})
+    firebase.request('DELETE', 'tickets/b')
+
+    wait_until(lambda: cache.ready)
+    assert cache.reconnects >= 1
+    assert cache.get('a') == (True, {'used': True})
+    assert cache.get('b') == (True, None)
+
+
+def test_lookups_go_to_the_network_until_primed(cache, firebase, standin, monkeypatch):
+    # 起動していない（読み込み前の）キャッシュは使わずに Firebase から読む
+    monkeypatch.setenv('TICKET_CACHE', '1')
+    monkeypatch.setattr(main, 'ticket_cache', cache)
+    monkeypatch.setattr(main, 'BASE_PATH', '')
+    monkeypatch.setattr(main, 'firebase', firebase)
+    firebase.put('tickets/e', {'used': False})
+
+    assert main.read_ticket('e') == {'used': False}
+
+    cache.start().wait_ready(5)
+    firebase.put('tickets/f', {'used': False})
+    wait_until(lambda: cache.get('f')[1] is not None)
+    requests = standin.db.requests
+    # 読み込み後はネットワークに出ない
+    assert main.read_ticket('f') == {'used': False}
+    assert standin.db.requests == requests
+
+
+def test_stop_does_not_wait_for_the_next_event(cache):
+    cache.start().wait_ready(5)
+    start = time.monotonic()
+    cache.stop()
+    assert time.monotonic() - start < 1
+    cache._thread.join(5)
+    assert not cache._thread.is_alive()
@@ -0,0 +1,157 @@
+"""Firebase のストリーミング API で最新に保つチケットのローカルキャッシュ
+
+tickets 以下を REST のイベントストリーム（SSE）で購読し、プロセス内の dict に
+写しておく。購読開始時に届く最初の put イベントで全件を読み込み（プライミング）、
+その後は put / patch イベントを差分として適用する。接続が切れたら再接続し、
+再接続時の最初の put で全体を置き換えるので、切断中の変更も取りこぼさない。
+
+読み込み前・切断中は ready が False になり、呼び出し側はネットワークから読む。
+"""
+
+import json
+import random
+import socket
+import threading
+
+import requests
+
+# 再接続の待ち時間（秒）
+MIN_RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30.0
+# Firebase は約30秒ごとに keep-alive を送るので、それより長く何も届かなければ切断とみなす
+STREAM_READ_TIMEOUT = 90.0
+
+
+class TicketCache:
+    """tickets サブツリーのミラー"""
+
+    def __init__(self, url, connect_timeout=3.05):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.tickets = {}
+        self.lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._response = None
+        self._thread = None
+        self.events = 0
+        self.reconnects = 0
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='ticket-cache', daemon=True)
+        self._thread.start()
+        return self
+
+    def wait_ready(self, timeout=None):
+        """最初の読み込みが終わるまで待つ"""
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        self._stopped.set()
+        self._ready.clear()
+        response = self._response
+        if response is None:
+            return
+        # 読み込み中のスレッドがいる接続を close すると、次のデータ（keep-alive は約30秒ごと）が
+        # 届くまで待たされる。ソケットを shutdown して読み込みを終わらせ、閉じるのはスレッドに任せる
+        sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def get(self, ticket_id):
+        """(キャッシュを使えたか, チケット) を返す"""
+        if not self._ready.is_set():
+            return False, None
+        with self.lock:
+            ticket = self.tickets.get(ticket_id)
+            return True, dict(ticket) if isinstance(ticket, dict) else None
+
+    def _run(self):
+        delay = MIN_RECONNECT_DELAY
+        session = requests.Session()
+        while not self._stopped.is_set():
+            try:
+                self._stream(session)
+                delay = MIN_RECONNECT_DELAY
+            except Exception as e:
+                # stop() で接続を閉じたときもここに来る。スレッドは止めずに再接続する
+                if not self._stopped.is_set():
+                    print(f"Ticket cache stream error: {e}")
+            self._ready.clear()
+            if self._stopped.wait(random.uniform(delay / 2, delay)):
+                break
+            delay = min(MAX_RECONNECT_DELAY, delay * 2)
+            self.reconnects += 1
+
+    def _stream(self, session):
+        response = session.get(
+            self.url,
+            headers={'Accept': 'text/event-stream'},
+            stream=True,
+            timeout=(self.connect_timeout, STREAM_READ_TIMEOUT),
+        )
+        self._response = response
+        try:
+            response.raise_for_status()
+            response.encoding = 'utf-8'
+            event = None
+            data = []
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if line:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'event':
+                        event = value
+                    elif field == 'data':
+                        data.append(value)
+                    continue
+                # 空行でイベントが確定する
+                if event is not None and self._dispatch(event, '\n'.join(data)):
+                    return
+                event = None
+                data = []
+        finally:
+            self._response = None
+            response.close()
+
+    def _dispatch(self, event, data):
+        """イベントを適用する。ストリームを終えるべきなら True"""
+        if event in ('put', 'patch'):
+            message = json.loads(data)
+            with self.lock:
+                if event == 'put':
+                    self._put(message['path'], message['data'])
+                else:
+                    for key, value in (message['data'] or {}).items():
+                        self._put(f"{message['path'].rstrip('/')}/{key}", value)
+                self.events += 1
+            if message['path'] == '/' and event == 'put':
+                self._ready.set()
+            return False
+        # cancel（権限がなくなった）・auth_revoked（トークン失効）は再接続する
+        return event in ('cancel', 'auth_revoked')
+
+    def _put(self, path, value):
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            self.tickets = value if isinstance(value, dict) else {}
+            return
+        node = self.tickets
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[part] = {}
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
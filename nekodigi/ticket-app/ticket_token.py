@@ -0,0 +1,61 @@
+"""QRコードに載せる署名付きチケットトークン
+
+トークンはチケットID（UUID の16バイト）に HMAC-SHA256 の先頭 MAC_SIZE バイトを
+付けて base64url にした35文字。検証はプロセス内で MAC を定数時間比較するだけなので、
+でたらめな文字列や偽造したコードは Firebase を読まずに弾ける。
+
+鍵は環境変数 TICKET_SIGNING_KEY（全インスタンスで同じ値にする）。鍵を入れ替える
+ときは古い鍵を TICKET_SIGNING_KEY_PREVIOUS に移すと、古い鍵で作ったチケットも通る。
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import uuid
+
+# 80ビット。オンラインで総当たりするには現実的でない長さで、QRコードは小さいまま
+MAC_SIZE = 10
+TOKEN_LENGTH = 35
+
+
+def _mac(key, ticket_key):
+    return hmac.new(key, b'ticket:' + ticket_key, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+class TicketSigner:
+    """チケットIDの署名と検証"""
+
+    def __init__(self, key, previous=None):
+        self.keys = [k.encode('utf-8') if isinstance(k, str) else k for k in (key, previous) if k]
+        if not self.keys:
+            raise ValueError('署名鍵が必要です')
+
+    def sign(self, ticket_id):
+        """チケットID（UUID 文字列）のトークン"""
+        ticket_key = uuid.UUID(ticket_id).bytes
+        return base64.urlsafe_b64encode(ticket_key + _mac(self.keys[0], ticket_key)).rstrip(b'=').decode('ascii')
+
+    def verify(self, token):
+        """正しいトークンならチケットID、そうでなければ None"""
+        if not isinstance(token, str) or len(token) != TOKEN_LENGTH:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token + '=')
+        except (binascii.Error, ValueError):
+            return None
+        ticket_key, mac = raw[:16], raw[16:]
+        # どの鍵で署名されたかで時間が変わらないよう、全部の鍵と比べる
+        valid = False
+        for key in self.keys:
+            valid |= hmac.compare_digest(mac, _mac(key, ticket_key))
+        return str(uuid.UUID(bytes=ticket_key)) if valid else None
+
+
+def signer_from_env():
+    """TICKET_SIGNING_KEY があれば TicketSigner、なければ None（署名なしで動かす）"""
+    key = os.environ.get('TICKET_SIGNING_KEY')
+    if not key:
+        return None
+    return TicketSigner(key, os.environ.get('TICKET_SIGNING_KEY_PREVIOUS'))
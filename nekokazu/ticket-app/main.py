@@ -1,17 +1,110 @@
 import os
 import json
 import uuid
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, make_response
 from flask_cors import CORS
-import qrcode
-from io import BytesIO
+from qr_render import render_png, render_svg
+from storage import create_storage
+import ticket_export
 
 app = Flask(__name__)
 CORS(app)
 
-# メモリ内ストレージ（登録不要・シンプル・高可用性）
-tickets_storage = {}
+# チケットストレージ（TICKET_DB_PATH を設定すると SQLite に永続化し、ワーカー間で共有する）
+tickets_storage = create_storage()
+
+# /api/tickets のページサイズ
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+USED_FILTERS = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+# /api/tickets/verify-batch で1回に受け付けるスキャン数
+MAX_BATCH_SCANS = 1000
+
+# QRコード画像キャッシュの上限（バイト）
+QR_CACHE_BYTES = int(os.environ.get('QR_CACHE_BYTES', 64 * 1024 * 1024))
+
+class QRImageCache:
+    """合計サイズ上限付きの LRU キャッシュ（(チケットURL, 形式) -> (画像, ETag)）"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, image):
+        entry = (image, hashlib.sha256(image).hexdigest()[:32])
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.entries[key] = entry
+            self.size += len(image)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return entry
+
+qr_cache = QRImageCache(QR_CACHE_BYTES)
+
+# format クエリ -> (描画関数, MIME タイプ)
+QR_FORMATS = {
+    'png': (render_png, 'image/png'),
+    'svg': (render_svg, 'image/svg+xml'),
+}
+
+def ticket_verify_url(ticket_id):
+    base_url = request.host_url.rstrip('/')
+    return f"{base_url}/api/tickets/{ticket_id}/verify"
+
+def scan_time(value):
+    """スキャン時刻（ISO 8601）を used_at と同じローカル時刻にそろえる"""
+    if value is None:
+        return datetime.now()
+    scanned = datetime.fromisoformat(value)
+    if scanned.tzinfo is not None:
+        scanned = scanned.astimezone().replace(tzinfo=None)
+    return scanned
+
+def batch_scan(scan):
+    """verify-batch の1件を (チケットID, スキャン時刻, 判定) にする（判定は読めたときは None）"""
+    if not isinstance(scan, dict):
+        return None, None, {'ticket_id': None, 'valid': False, 'error': 'スキャンはオブジェクトで指定してください'}
+    ticket_id = scan.get('ticket_id')
+    if ticket_id is not None and not isinstance(ticket_id, str):
+        return None, None, {'ticket_id': None, 'valid': False, 'error': 'ticket_id は文字列で指定してください'}
+    if not ticket_id:
+        return None, None, {'ticket_id': None, 'valid': False, 'error': 'チケットIDが必要です'}
+
+    scanned_at = scan.get('scanned_at')
+    try:
+        if scanned_at is not None and not isinstance(scanned_at, str):
+            raise TypeError(scanned_at)
+        scanned = scan_time(scanned_at)
+    except (TypeError, ValueError):
+        return None, None, {'ticket_id': ticket_id, 'valid': False, 'error': f'scanned_at が読めません: {scanned_at}'}
+    return ticket_id, scanned, None
+
+def cached_qr(ticket_url, fmt='png'):
+    entry = qr_cache.get((ticket_url, fmt))
+    if entry is None:
+        image = QR_FORMATS[fmt][0](ticket_url, box_size=10, border=4)
+        if isinstance(image, str):  # SVG はテキスト
+            image = image.encode('utf-8')
+        entry = qr_cache.put((ticket_url, fmt), image)
+    return entry
 
 @app.route('/')
 def index():
@@ -25,6 +118,10 @@ def create_ticket():
         data = request.json
         ticket_id = str(uuid.uuid4())
 
+        for field in ('name', 'description'):
+            if not isinstance(data.get(field, ''), str):
+                return jsonify({'success': False, 'error': f'{field} は文字列で指定してください'}), 400
+
         ticket_data = {
             'id': ticket_id,
             'name': data.get('name', 'チケット'),
@@ -34,8 +131,11 @@ def create_ticket():
             'used_at': None
         }
 
-        # メモリに保存
-        tickets_storage[ticket_id] = ticket_data
+        # 保存
+        tickets_storage.add(ticket_data)
+
+        # チケットページはすぐQRコードを取りに来るので、先に描画しておく
+        cached_qr(ticket_verify_url(ticket_id))
 
         return jsonify({
             'success': True,
@@ -46,31 +146,103 @@ def create_ticket():
 
 @app.route('/api/tickets/<ticket_id>/qr', methods=['GET'])
 def get_qr_code(ticket_id):
-    """QRコード画像生成"""
+    """QRコード画像生成（クエリ format=svg なら SVG、それ以外は PNG）
+
+    画像はチケットIDとホストURLだけで決まるので、一度描画したものをキャッシュして返す。
+    内容は変わらないため immutable で長期キャッシュさせ、If-None-Match には 304 を返す。
+    """
+    try:
+        fmt = request.args.get('format', 'png')
+        if fmt not in QR_FORMATS:
+            return jsonify({'success': False, 'error': 'format は png か svg を指定してください'}), 400
+        image, etag = cached_qr(ticket_verify_url(ticket_id), fmt)
+
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(image)
+            response.mimetype = QR_FORMATS[fmt][1]
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/tickets/export', methods=['GET'])
+def export_tickets():
+    """オフライン検証用の未使用チケット一覧（形式は ticket_export.py）
+
+    クエリ since に前回の X-Ticket-Export-Version を渡すと、それ以降の差分だけを返す。
+    その版からの差分を作れないとき（再起動でメモリのストアが作り直されたなど）は全件を返す。
+    """
     try:
-        # QRコード生成
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
+        since = request.args.get('since')
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since が不正です'}), 400
 
-        # チケットURL
-        base_url = request.host_url.rstrip('/')
-        ticket_url = f"{base_url}/api/tickets/{ticket_id}/verify"
+    try:
+        data = None
+        if since is not None:
+            try:
+                version, added, removed = tickets_storage.changes_since(since)
+                data = ticket_export.encode(version, ticket_export.sorted_keys(added),
+                                            ticket_export.sorted_keys(removed), base=since)
+            except KeyError:
+                pass
+        if data is None:
+            version, ticket_ids = tickets_storage.snapshot()
+            data = ticket_export.encode(version, ticket_export.sorted_keys(ticket_ids))
 
-        qr.add_data(ticket_url)
-        qr.make(fit=True)
+        response = make_response(data)
+        response.mimetype = 'application/octet-stream'
+        response.headers['X-Ticket-Export-Version'] = str(version)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        img = qr.make_image(fill_color="black", back_color="white")
+@app.route('/api/tickets/verify-batch', methods=['POST'])
+def verify_tickets():
+    """オフラインで検証したスキャンをまとめて使用済みにする
 
-        # BytesIOに保存
-        img_io = BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
+    {"scans": [{"ticket_id": ..., "scanned_at": ISO 8601}, ...]} をスキャン時刻順に
+    使用済みにし、送られた順に結果を返す。形式の誤ったスキャンはその1件だけを無効と
+    判定する。未使用のチケットは一番早いスキャンが有効になり、使用済みのチケットは
+    後から届いたスキャンの方が早い時刻でも保存済みの使用が優先する（used_at は変えない）。
+    同じスキャンを送り直しても有効のまま返る。nekodigi/ticket-app の
+    /api/validate-tickets も同じ規則。
+    """
+    try:
+        scans = (request.json or {}).get('scans')
+        if not isinstance(scans, list) or not 1 <= len(scans) <= MAX_BATCH_SCANS:
+            return jsonify({'success': False, 'error': f'scans は1〜{MAX_BATCH_SCANS}件のリストで指定してください'}), 400
+
+        results = [None] * len(scans)
+        scanned = {}
+        for i, scan in enumerate(scans):
+            _, scanned_at, verdict = batch_scan(scan)
+            if verdict is not None:
+                results[i] = verdict
+            else:
+                scanned[i] = scanned_at
+
+        for i in sorted(scanned, key=scanned.get):
+            ticket_id = scans[i]['ticket_id']
+            used_at = scanned[i].isoformat()
+            status, ticket = tickets_storage.redeem(ticket_id, used_at)
+            if status == 'missing':
+                results[i] = {'ticket_id': ticket_id, 'valid': False, 'error': 'チケットが見つかりません'}
+            elif status == 'used' and ticket['used_at'] != used_at:
+                results[i] = {'ticket_id': ticket_id, 'valid': False, 'error': '既に使用済みのチケットです',
+                              'used_at': ticket['used_at']}
+            else:
+                results[i] = {'ticket_id': ticket_id, 'valid': True, 'used_at': ticket['used_at']}
 
-        return send_file(img_io, mimetype='image/png')
+        return jsonify({
+            'success': True,
+            'results': results
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -94,23 +266,20 @@ def get_ticket(ticket_id):
 def verify_ticket(ticket_id):
     """チケット検証・使用"""
     try:
-        ticket = tickets_storage.get(ticket_id)
-
-        if not ticket:
-            return jsonify({'success': False, 'error': 'チケットが見つかりません'}), 404
-
         if request.method == 'POST':
             # チケット使用
-            if ticket.get('used'):
+            status, ticket = tickets_storage.redeem(ticket_id, datetime.now().isoformat())
+            if status == 'used':
                 return jsonify({
                     'success': False,
                     'error': '既に使用済みのチケットです',
                     'ticket': ticket
                 }), 400
+        else:
+            ticket = tickets_storage.get(ticket_id)
 
-            ticket['used'] = True
-            ticket['used_at'] = datetime.now().isoformat()
-            tickets_storage[ticket_id] = ticket
+        if not ticket:
+            return jsonify({'success': False, 'error': 'チケットが見つかりません'}), 404
 
         return jsonify({
             'success': True,
@@ -121,20 +290,33 @@ def verify_ticket(ticket_id):
 
 @app.route('/api/tickets', methods=['GET'])
 def list_tickets():
-    """チケット一覧取得"""
+    """チケット一覧取得（新しい順・カーソルページング）
+
+    クエリ: limit（件数）, after（前ページの next_cursor）, used（true/false）
+    """
     try:
-        if not tickets_storage:
-            return jsonify({'success': True, 'tickets': []})
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if limit < 1:
+            return jsonify({'success': False, 'error': 'limit は1以上で指定してください'}), 400
+
+        used = request.args.get('used')
+        if used is not None:
+            used = USED_FILTERS.get(used.lower())
+            if used is None:
+                return jsonify({'success': False, 'error': 'used は true か false で指定してください'}), 400
 
-        # 辞書から配列に変換
-        ticket_list = list(tickets_storage.values())
-        # 作成日時でソート（新しい順）
-        ticket_list.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+        try:
+            tickets, next_cursor = tickets_storage.page(limit, request.args.get('after'), used)
+        except KeyError:
+            return jsonify({'success': False, 'error': 'カーソルが不正です'}), 400
 
         return jsonify({
             'success': True,
-            'tickets': ticket_list
+            'tickets': tickets,
+            'next_cursor': next_cursor
         })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit が不正です'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
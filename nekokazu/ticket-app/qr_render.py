@@ -0,0 +1,314 @@
+"""QRコードの高速描画（NumPy で1ビットPNG / SVG を直接作る）
+
+qrcode からはモードの判定・バージョン表・機能パターンの配置だけを借りる。誤り訂正語は
+表引きで計算し、マスクパターンを選ぶための8通りの配置と減点計算は NumPy で行う。
+できたモジュール行列を np.repeat で拡大して1ビットのPNGをそのまま書き出す。
+qrcode.make() + make_image と同じモジュール行列になる。
+
+SVG は黒いモジュールの横の連なりを1本の path にまとめる。
+
+nekokazu/ticket-app にも同じ内容のコピーを置いている（アプリごとのディレクトリからデプロイする
+ため）。変更するときは両方を同じにする（nekokazu/ticket-app/test_main.py で一致を確かめている）。
+"""
+
+import base64
+import bisect
+import struct
+import threading
+import zlib
+
+import numpy as np
+import qrcode
+from qrcode import LUT, base, util
+
+ERROR_CORRECT_L = qrcode.constants.ERROR_CORRECT_L
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 1ビットのパレット（0 = 黒, 1 = 白）
+_PALETTE = b'\x00\x00\x00\xff\xff\xff'
+
+# GF(256) の指数表（対数の和を255で割らずに引けるよう2周分）
+_EXP = [base.EXP_TABLE[i % 255] for i in range(510)]
+# 誤り訂正語数 -> 生成多項式の係数の対数（最高次を除く）
+_generators = {}
+
+_MASKS = (
+    lambda i, j: (i + j) % 2 == 0,
+    lambda i, j: i % 2 == 0,
+    lambda i, j: j % 3 == 0,
+    lambda i, j: (i + j) % 3 == 0,
+    lambda i, j: (i // 2 + j // 3) % 2 == 0,
+    lambda i, j: (i * j) % 2 + (i * j) % 3 == 0,
+    lambda i, j: ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+    lambda i, j: ((i * j) % 3 + (i + j) % 2) % 2 == 0,
+)
+
+# (バージョン, 誤り訂正レベル) -> _Layout
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+class _Layout:
+    """バージョンごとの固定部分（機能パターンと形式情報）とデータの配置順"""
+
+    def __init__(self, version, error_correction):
+        qr = qrcode.QRCode(version=version, error_correction=error_correction)
+        size = qr.modules_count = version * 4 + 17
+        # マスクの選択は形式情報を空けた状態で採点する（QRCode.best_mask_pattern と同じ）
+        self.test_base = self._base(qr, True, 0)
+        self.bases = [self._base(qr, False, mask) for mask in range(8)]
+        free = np.array([[m is None for m in row] for row in qr.modules])
+
+        # QRCode.map_data と同じ順（右下から2列ずつ上下にジグザグ）
+        rows, cols = [], []
+        upward = True
+        for col in range(size - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            for row in (range(size - 1, -1, -1) if upward else range(size)):
+                for c in (col, col - 1):
+                    if free[row, c]:
+                        rows.append(row)
+                        cols.append(c)
+            upward = not upward
+        self.rows = np.array(rows)
+        self.cols = np.array(cols)
+        self.mask_bits = np.array([mask(self.rows, self.cols) for mask in _MASKS])
+
+    @staticmethod
+    def _base(qr, test, mask):
+        size = qr.modules_count
+        qr.modules = [[None] * size for _ in range(size)]
+        qr.setup_position_probe_pattern(0, 0)
+        qr.setup_position_probe_pattern(size - 7, 0)
+        qr.setup_position_probe_pattern(0, size - 7)
+        qr.setup_position_adjust_pattern()
+        qr.setup_timing_pattern()
+        qr.setup_type_info(test, mask)
+        if qr.version >= 7:
+            qr.setup_type_number(test)
+        return np.array([[bool(m) for m in row] for row in qr.modules])
+
+
+def _layout(version, error_correction):
+    key = (version, error_correction)
+    layout = _layouts.get(key)
+    if layout is None:
+        layout = _Layout(version, error_correction)
+        with _layouts_lock:
+            layout = _layouts.setdefault(key, layout)
+    return layout
+
+
+class _Bits:
+    """QRData.write が書き込む先（util.BitBuffer の代わりに整数に詰める）"""
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def put(self, num, length):
+        self.value = (self.value << length) | num
+        self.length += length
+
+
+def _generator(ec_count):
+    logs = _generators.get(ec_count)
+    if logs is None:
+        if ec_count in LUT.rsPoly_LUT:
+            poly = LUT.rsPoly_LUT[ec_count]
+        else:
+            poly = base.Polynomial([1], 0)
+            for i in range(ec_count):
+                poly = poly * base.Polynomial([1, base.gexp(i)], 0)
+        logs = _generators[ec_count] = [base.glog(c) for c in list(poly)[1:]]
+    return logs
+
+
+def _ec_codewords(data, ec_count):
+    """Reed-Solomon の誤り訂正語（生成多項式で割った余り）"""
+    generator = _generator(ec_count)
+    remainder = [0] * ec_count
+    for byte in data:
+        factor = byte ^ remainder[0]
+        remainder = remainder[1:]
+        remainder.append(0)
+        if factor:
+            shift = base.LOG_TABLE[factor]
+            remainder = [r ^ _EXP[shift + g] for r, g in zip(remainder, generator)]
+    return remainder
+
+
+def _data_bits(data_list, version):
+    bits = _Bits()
+    for data in data_list:
+        bits.put(data.mode, 4)
+        bits.put(len(data), util.mode_sizes_for_version(version)[data.mode])
+        if data.mode == util.MODE_8BIT_BYTE:
+            bits.put(int.from_bytes(data.data, 'big'), len(data.data) * 8)
+        else:
+            data.write(bits)
+    return bits
+
+
+def codewords(version, error_correction, data_list):
+    """util.create_data と同じコード語列（誤り訂正語まで並べたもの）"""
+    bits = _data_bits(data_list, version)
+
+    blocks = base.rs_blocks(version, error_correction)
+    capacity = sum(block.data_count for block in blocks)
+    if bits.length > capacity * 8:
+        raise qrcode.exceptions.DataOverflowError(
+            f'Code length overflow. Data size ({bits.length}) > size available ({capacity * 8})'
+        )
+    # 終端（最大4ビットの0）を付けてバイト境界までそろえ、残りを埋め草で埋める
+    length = (bits.length + min(capacity * 8 - bits.length, 4) + 7) // 8
+    stream = (bits.value << (length * 8 - bits.length)).to_bytes(length, 'big')
+    stream = (stream + bytes([util.PAD0, util.PAD1]) * ((capacity - length) // 2 + 1))[:capacity]
+
+    data_blocks, ec_blocks = [], []
+    offset = 0
+    for block in blocks:
+        data_blocks.append(stream[offset:offset + block.data_count])
+        ec_blocks.append(_ec_codewords(data_blocks[-1], block.total_count - block.data_count))
+        offset += block.data_count
+
+    words = []
+    for i in range(max(len(block) for block in data_blocks)):
+        words.extend(block[i] for block in data_blocks if i < len(block))
+    for i in range(max(len(block) for block in ec_blocks)):
+        words.extend(block[i] for block in ec_blocks if i < len(block))
+    return words
+
+
+def _run_penalties(lines):
+    """同じ色が5つ以上続く箇所の減点（長さ - 2）。lines は (候補, 行, 列)"""
+    count, height, width = lines.shape
+    flat = lines.ravel()
+    starts = np.empty(flat.size, dtype=bool)
+    np.not_equal(flat[1:], flat[:-1], out=starts[1:])
+    starts[::width] = True
+    positions = np.flatnonzero(starts)
+    lengths = np.diff(np.append(positions, flat.size))
+    long_runs = lengths >= 5
+    return np.bincount(
+        positions[long_runs] // (height * width), weights=lengths[long_runs] - 2, minlength=count
+    ).astype(int)
+
+
+def _finder_penalties(lines):
+    """1:1:3:1:1 のファインダー似パターン（前後に明るい4モジュール）の減点"""
+    span = lines.shape[2] - 10
+    dark = [lines[:, :, i:i + span] for i in range(11)]
+    light = [~d for d in dark]
+    core = light[1] & dark[4] & light[5] & dark[6] & light[9]
+    before = dark[0] & dark[2] & dark[3] & light[7] & light[8] & light[10]
+    after = light[0] & light[2] & light[3] & dark[7] & dark[8] & dark[10]
+    return 40 * (core & (before | after)).sum(axis=(1, 2))
+
+
+def lost_points(candidates):
+    """候補（マスクごとのモジュール行列を重ねたもの）それぞれの util.lost_point"""
+    size = candidates.shape[1]
+    lines = np.concatenate((candidates, candidates.transpose(0, 2, 1)), axis=1)
+    points = _run_penalties(lines) + _finder_penalties(lines)
+    block = candidates[:, :-1, :-1]
+    points += 3 * (
+        (block == candidates[:, :-1, 1:]) & (block == candidates[:, 1:, :-1]) & (block == candidates[:, 1:, 1:])
+    ).sum(axis=(1, 2))
+    for i, dark_count in enumerate(candidates.sum(axis=(1, 2)).tolist()):
+        percent = float(dark_count) / (size ** 2)
+        points[i] += int(abs(percent * 100 - 50) / 5) * 10
+    return points
+
+
+def fit_version(data_list, error_correction):
+    """QRCode.best_fit と同じ、データが入る最小のバージョン"""
+    version = 1
+    while True:
+        needed = _data_bits(data_list, version).length
+        fitted = bisect.bisect_left(util.BIT_LIMIT_TABLE[error_correction], needed, version)
+        if fitted == 41:
+            raise qrcode.exceptions.DataOverflowError()
+        # 文字数欄の長さが変わるバージョンをまたいだら測り直す
+        if util.mode_sizes_for_version(fitted) is util.mode_sizes_for_version(version):
+            return fitted
+        version = fitted
+
+
+def qr_matrix(data, error_correction=ERROR_CORRECT_L):
+    """データのモジュール行列（bool の2次元配列、余白なし）"""
+    qr = qrcode.QRCode(error_correction=error_correction)
+    qr.add_data(data)
+    version = fit_version(qr.data_list, error_correction)
+    layout = _layout(version, error_correction)
+
+    words = np.array(codewords(version, error_correction, qr.data_list), dtype=np.uint8)
+    bits = np.zeros(len(layout.rows), dtype=bool)
+    unpacked = np.unpackbits(words)[:len(bits)]
+    bits[:len(unpacked)] = unpacked
+
+    # 8通りのマスクを重ねて一度に採点し、減点の最も少ないもの（同点なら番号の小さいもの）を使う
+    candidates = np.repeat(layout.test_base[None], len(_MASKS), axis=0)
+    candidates[:, layout.rows, layout.cols] = bits ^ layout.mask_bits
+    mask = int(np.argmin(lost_points(candidates)))
+
+    modules = layout.bases[mask].copy()
+    modules[layout.rows, layout.cols] = candidates[mask, layout.rows, layout.cols]
+    return modules
+
+
+def _chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(body, zlib.crc32(kind)))
+
+
+def render_png(data, box_size=10, border=4, error_correction=ERROR_CORRECT_L):
+    """QRコードの1ビット（パレット）PNG"""
+    modules = np.pad(qr_matrix(data, error_correction), border)
+    pixels = np.repeat(np.repeat(~modules, box_size, axis=0), box_size, axis=1)
+    width = pixels.shape[1]
+
+    # 各行の先頭にフィルタ種別 0（なし）を付ける
+    rows = np.packbits(pixels, axis=1)
+    scanlines = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rows
+
+    header = struct.pack('>IIBBBBB', width, width, 1, 3, 0, 0, 0)
+    return b''.join((
+        _PNG_SIGNATURE,
+        _chunk(b'IHDR', header),
+        _chunk(b'PLTE', _PALETTE),
+        _chunk(b'IDAT', zlib.compress(scanlines.tobytes())),
+        _chunk(b'IEND', b''),
+    ))
+
+
+def render_png_data_urls(payloads, box_size=10, border=4):
+    """複数のQRコードを data URL（Base64 の PNG）にする
+
+    プロセスプールのタスク単位。spawn で起動したワーカーはこのモジュールだけを
+    読み込めば済むよう、ここに置いている。
+    """
+    return [
+        'data:image/png;base64,' + base64.b64encode(render_png(data, box_size, border)).decode()
+        for data in payloads
+    ]
+
+
+def render_svg(data, box_size=10, border=4, error_correction=ERROR_CORRECT_L):
+    """QRコードの SVG（黒いモジュールを1本の path で描く）"""
+    modules = qr_matrix(data, error_correction)
+    size = len(modules) + border * 2
+    edges = np.diff(np.pad(modules, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    path = ''.join(
+        f'M{start + border} {row + border}h{end - start}v1h-{end - start}z'
+        for row, start, end in zip(rows.tolist(), starts.tolist(), ends.tolist())
+    )
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{path}"/></svg>'
+    )
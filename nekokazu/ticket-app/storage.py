@@ -0,0 +1,657 @@
+"""チケットの保存先
+
+MemoryTicketStore はプロセス内のメモリに詰めて保存する（再起動で消える・ワーカー間で
+共有されない）。SQLiteTicketStore は SQLite (WAL) に保存し、dict はサイズ上限付きの
+キャッシュとしてだけ使う。どちらも同じメソッドを持つので main.py からは差し替えられる。
+チケット dict（JSON にする形）はメソッドの出入り口でだけ作る。
+
+    get(ticket_id)                -> チケット dict または None
+    add(ticket)                   -> 保存
+    redeem(ticket_id, used_at)    -> ('ok' | 'used' | 'missing', チケット)
+    page(limit, after, used)      -> (新しい順のチケット一覧, 次ページのカーソル)
+    snapshot()                    -> (バージョン, 未使用のチケットID一覧)
+    changes_since(version)        -> (バージョン, 追加されたID, 使用済みになったID)
+
+バージョンは上位が世代（ストアを作るたび・DB ファイルごとの乱数）、下位
+VERSION_SEQ_BITS ビットが変更の連番。別の世代や未来のバージョンを
+changes_since に渡すと KeyError になるので、その場合は snapshot からやり直す。
+"""
+
+import os
+import queue
+import random
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+VERSION_SEQ_BITS = 40
+
+
+def _make_version(generation, seq):
+    return (generation << VERSION_SEQ_BITS) | seq
+
+
+def _split_version(version):
+    return version >> VERSION_SEQ_BITS, version & ((1 << VERSION_SEQ_BITS) - 1)
+
+
+def _new_generation():
+    return random.getrandbits(23) + 1
+
+
+def _to_micros(value):
+    """ISO 8601 の日時を UNIX 時間（マイクロ秒）にする（タイムゾーンなしはローカル時刻）"""
+    moment = datetime.fromisoformat(value)
+    return int(moment.replace(microsecond=0).timestamp()) * 1000000 + moment.microsecond
+
+
+def _from_micros(micros):
+    """_to_micros の逆（ローカル時刻の ISO 8601）"""
+    seconds, fraction = divmod(micros, 1000000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=fraction).isoformat()
+
+
+def _uuid_bytes(ticket_id):
+    """UUID 文字列を16バイトにする（UUID でなければ None）"""
+    try:
+        key = bytes.fromhex(ticket_id.replace('-', ''))
+    except (AttributeError, ValueError):
+        return None
+    return key if len(key) == 16 else None
+
+
+def _uuid_str(key):
+    h = key.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+class RowSet:
+    """行番号の集合（64分木のビットマップ）
+
+    一番下の段は64行ずつを1語のビットで持ち、その上の段は下の段の空でない語を
+    同じように持つ。追加・削除・「ある行より前で最大の要素」の検索は段数
+    （64**段数 行までで、100万行なら4段）回の語の操作で済み、件数に比例しない。
+    """
+
+    def __init__(self):
+        self.levels = [array('Q', [0])]
+
+    def _grow(self, row):
+        # 一番上の段が1語に収まるよう、足りなければ段を足す
+        while row >> (6 * len(self.levels)):
+            self.levels.append(array('Q', [1 if self.levels[-1][0] else 0]))
+
+    def add(self, row):
+        self._grow(row)
+        for level in self.levels:
+            word = row >> 6
+            if word >= len(level):
+                level.extend([0] * (word + 1 - len(level)))
+            old = level[word]
+            level[word] = old | (1 << (row & 63))
+            if old:
+                # 上の段にはこの語のビットがもう立っている
+                return
+            row = word
+
+    def discard(self, row):
+        for level in self.levels:
+            word = row >> 6
+            if word >= len(level):
+                return
+            level[word] &= ~(1 << (row & 63))
+            if level[word]:
+                return
+            row = word
+
+    def before(self, row):
+        """row より小さい最大の要素（なければ None）"""
+        depth = 0
+        while True:
+            if depth == len(self.levels):
+                return None
+            level = self.levels[depth]
+            word = row >> 6
+            if word < len(level):
+                mask = level[word] & ((1 << (row & 63)) - 1)
+            else:
+                # この段の語はすべて row より前
+                word = len(level) - 1
+                mask = level[word]
+            if mask:
+                break
+            row = word
+            depth += 1
+
+        # 見つかった語から、各段で一番大きいビットをたどって下りる
+        row = (word << 6) | (mask.bit_length() - 1)
+        for level in reversed(self.levels[:depth]):
+            row = (row << 6) | (level[row].bit_length() - 1)
+        return row
+
+    def __iter__(self):
+        for word, mask in enumerate(self.levels[0]):
+            while mask:
+                low = mask & -mask
+                yield (word << 6) | (low.bit_length() - 1)
+                mask ^= low
+
+
+class TicketIndex:
+    """作成順のチケットインデックス
+
+    チケットは作成順の行番号で持つ。使用済み・未使用は RowSet で別々に持ち、
+    カーソルの行から直前の要素をたどってページを切り出すので、一覧取得の
+    たびに全件をソートし直す必要がない。使用済みにするのも2つの RowSet の
+    ビットを付け替えるだけなので、1ページ・1枚の使用処理とも件数に比例しない
+    （段数を d として O(d + limit * d)）。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.used = RowSet()
+        self.unused = RowSet()
+        self.lock = threading.Lock()
+
+    def add(self, row, used=False):
+        with self.lock:
+            self.count = max(self.count, row + 1)
+            (self.used if used else self.unused).add(row)
+
+    def mark_used(self, row):
+        with self.lock:
+            self.unused.discard(row)
+            self.used.add(row)
+
+    def page(self, limit, before=None, used=None):
+        """before より前の行を新しい順に最大 limit 件と、続きがあるかを返す"""
+        with self.lock:
+            end = self.count if before is None else before
+            if used is None:
+                start = max(0, end - limit)
+                return list(range(end - 1, start - 1, -1)), start > 0
+
+            rows = self.used if used else self.unused
+            page = []
+            row = rows.before(end)
+            while row is not None and len(page) < limit:
+                page.append(row)
+                row = rows.before(row)
+            return page, row is not None
+
+    def unused_rows(self):
+        with self.lock:
+            return list(self.unused)
+
+
+class LockStripes:
+    """キーのハッシュで選ぶ固定数のロック（ロックストライピング）
+
+    チケットごとにロックを作るとチケット数だけメモリを使い、全体で1本にすると
+    すべてのゲートの使用処理が直列になる。固定本数に分けておけば、別々の
+    チケットの処理はほぼ並列に進み、同じチケットの処理だけが必ず直列になる。
+    """
+
+    def __init__(self, count=64):
+        self.locks = [threading.Lock() for _ in range(count)]
+
+    def for_key(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+
+class StringTable:
+    """同じ文字列を1つにまとめて番号で持つ（チケット名・説明は種類が少ない）"""
+
+    def __init__(self):
+        self.numbers = {}
+        self.values = []
+
+    def number(self, value):
+        number = self.numbers.get(value)
+        if number is None:
+            number = self.numbers[value] = len(self.values)
+            self.values.append(value)
+        return number
+
+    def __getitem__(self, number):
+        return self.values[number]
+
+
+class MemoryTicketStore:
+    """プロセス内メモリに保存するストア（登録不要・シンプル）
+
+    1枚ごとに dict を持つと、UUID・日時の文字列とキーだけで数百バイトになる。
+    ここでは作成順の行番号ごとに列を分けて詰めて持つ。
+
+    - ID は UUID の16バイトを連結した bytearray（行番号への dict はそのバイト列がキー）
+    - created_at / used_at は UNIX 時間（マイクロ秒）の配列
+    - 使用済みかどうかは1枚1ビットのビットマップ
+    - 名前・説明は StringTable の番号
+    """
+
+    def __init__(self, stripes=64):
+        self.rows = {}
+        self.ids = bytearray()
+        self.created_at = array('q')
+        self.used_at = array('q')
+        self.used = bytearray()
+        self.names = array('I')
+        self.descriptions = array('I')
+        self.strings = StringTable()
+        self.index = TicketIndex()
+        self.locks = LockStripes(stripes)
+        self.add_lock = threading.Lock()
+        # 追加・使用済み化した行を順に記録する（長さが変更の連番）
+        self.change_log = array('I')
+        self.generation = _new_generation()
+
+    def _is_used(self, row):
+        return bool(self.used[row >> 3] & (1 << (row & 7)))
+
+    def _ticket_id(self, row):
+        return _uuid_str(self.ids[row * 16:row * 16 + 16])
+
+    def _ticket(self, row):
+        used = self._is_used(row)
+        return {
+            'id': self._ticket_id(row),
+            'name': self.strings[self.names[row]],
+            'description': self.strings[self.descriptions[row]],
+            'created_at': _from_micros(self.created_at[row]),
+            'used': used,
+            'used_at': _from_micros(self.used_at[row]) if used else None,
+        }
+
+    def _set_used(self, row, used_at):
+        # ビットマップの1バイトは8枚で共有するので、同じバイトの更新は同じロックで直列にする
+        with self.locks.for_key(row >> 3):
+            if self._is_used(row):
+                return False
+            self.used_at[row] = used_at
+            self.used[row >> 3] |= 1 << (row & 7)
+            return True
+
+    def get(self, ticket_id):
+        row = self.rows.get(_uuid_bytes(ticket_id))
+        return None if row is None else self._ticket(row)
+
+    def add(self, ticket):
+        # 列は1本ずつ伸ばすので、途中で例外になると行がずれて以降の読み出しが壊れる。
+        # 検証・変換はすべて先に済ませ、列を伸ばす処理は例外にならないものだけにする
+        key = _uuid_bytes(ticket['id'])
+        if key is None:
+            raise ValueError(f"チケットIDが UUID ではありません: {ticket['id']}")
+        for field in ('name', 'description'):
+            if not isinstance(ticket[field], str):
+                raise TypeError(f'{field} は文字列で指定してください')
+        created_at = _to_micros(ticket['created_at'])
+        used = bool(ticket['used'])
+        used_at = _to_micros(ticket['used_at']) if used else 0
+
+        with self.add_lock:
+            if key in self.rows:
+                raise ValueError(f"チケットIDが重複しています: {ticket['id']}")
+            name = self.strings.number(ticket['name'])
+            description = self.strings.number(ticket['description'])
+            row = len(self.created_at)
+            self.ids += key
+            self.created_at.append(created_at)
+            self.used_at.append(0)
+            self.names.append(name)
+            self.descriptions.append(description)
+            if row % 8 == 0:
+                self.used.append(0)
+            if used:
+                self._set_used(row, used_at)
+            self.index.add(row, used)
+            # 検索できるようにするのは列をそろえた後
+            self.rows[key] = row
+            # 状態を変えてから記録する（記録済みの変更は必ず反映済み）
+            self.change_log.append(row)
+
+    def redeem(self, ticket_id, used_at):
+        """未使用なら使用済みにする（確認と更新を同じロックの中で行う）"""
+        row = self.rows.get(_uuid_bytes(ticket_id))
+        if row is None:
+            return 'missing', None
+
+        # 使用済みは元に戻らないので、ロックを取らずに先に確かめてよい
+        if self._is_used(row) or not self._set_used(row, _to_micros(used_at)):
+            return 'used', self._ticket(row)
+        self.index.mark_used(row)
+        self.change_log.append(row)
+        return 'ok', self._ticket(row)
+
+    def page(self, limit, after=None, used=None):
+        before = None
+        if after is not None:
+            before = self.rows.get(_uuid_bytes(after))
+            if before is None:
+                raise KeyError(after)
+        rows, more = self.index.page(limit, before, used)
+        next_cursor = self._ticket_id(rows[-1]) if more and rows else None
+        return [self._ticket(row) for row in rows], next_cursor
+
+    def snapshot(self):
+        # バージョンを先に読むので、一覧にはそれより新しい変更が入っていることがある
+        # （次の差分にもう一度入るだけで、適用し直しても結果は同じ）
+        version = _make_version(self.generation, len(self.change_log))
+        return version, [self._ticket_id(row) for row in self.index.unused_rows()]
+
+    def changes_since(self, version):
+        generation, since = _split_version(version)
+        end = len(self.change_log)
+        if generation != self.generation or since > end:
+            raise KeyError(version)
+        added = []
+        removed = []
+        for row in dict.fromkeys(self.change_log[since:end]):
+            (removed if self._is_used(row) else added).append(self._ticket_id(row))
+        return _make_version(self.generation, end), added, removed
+
+
+class LRUCache:
+    """件数上限付きの LRU キャッシュ"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0,
+    used_at TEXT
+);
+CREATE INDEX IF NOT EXISTS tickets_used_seq ON tickets (used, seq);
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_COLUMNS = 'id, name, description, created_at, used, used_at'
+_SELECT_BY_ID = f'SELECT {_COLUMNS} FROM tickets WHERE id = ?'
+_SELECT_SEQ = 'SELECT seq FROM tickets WHERE id = ?'
+_INSERT = 'INSERT INTO tickets (id, name, description, created_at, used, used_at) VALUES (?, ?, ?, ?, ?, ?)'
+_REDEEM = 'UPDATE tickets SET used = 1, used_at = ? WHERE id = ? AND used = 0'
+_INSERT_CHANGE = 'INSERT INTO changes (id) VALUES (?)'
+_SELECT_VERSION = 'SELECT COALESCE(MAX(version), 0) FROM changes'
+_SELECT_CHANGED = 'SELECT id, used FROM tickets WHERE id IN (SELECT id FROM changes WHERE version > ?)'
+
+
+def _row_to_ticket(row):
+    return {
+        'id': row[0],
+        'name': row[1],
+        'description': row[2],
+        'created_at': row[3],
+        'used': bool(row[4]),
+        'used_at': row[5],
+    }
+
+
+class _Write:
+    """書き込みスレッドに渡す1件分の処理と、その結果"""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout):
+        # タイムアウトしても書き込みは取り消されず、後からコミットされることがある
+        if not self.done.wait(timeout):
+            raise TimeoutError('書き込みがタイムアウトしました')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SQLiteTicketStore:
+    """SQLite (WAL) に保存し、dict をキャッシュとして使うストア
+
+    - 書き込みは専用スレッドが1本の接続でまとめてコミットする（グループコミット）。
+      各リクエストは自分の書き込みがコミットされるまで待つので、応答した時点で永続化済み。
+    - 読み込みはスレッドごとの接続で行う。WAL なので書き込み中でも読める。
+    - 使用済み化は UPDATE ... WHERE used = 0 の1文で行うので、複数ワーカー
+      （gunicorn のプロセス）から同じファイルを使っても二重に使用済みにならない。
+    - 他プロセスの書き込みは PRAGMA data_version で検知してキャッシュを捨てる。
+    - 起動時に全件を読み込まず、新しい順に cache_size 件だけキャッシュに載せる。
+    - 追加・使用済み化は同じトランザクションで changes に記録し、差分エクスポートに使う。
+    """
+
+    def __init__(self, path, cache_size=10000, max_batch=256, poll_interval=0.05, write_timeout=30.0):
+        self.path = path
+        self.cache = LRUCache(cache_size)
+        self.max_batch = max_batch
+        self.poll_interval = poll_interval
+        self.write_timeout = write_timeout
+        self._local = threading.local()
+        self._writes = queue.Queue()
+
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', ?)", (_new_generation(),))
+        self.generation = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        self._writer_conn = conn
+        self._data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        self._prime_cache(cache_size)
+
+        self._writer = threading.Thread(target=self._write_loop, name='ticket-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _prime_cache(self, count):
+        rows = self._writer_conn.execute(
+            f'SELECT {_COLUMNS} FROM tickets ORDER BY seq DESC LIMIT ?', (count,)
+        ).fetchall()
+        for row in reversed(rows):
+            self.cache.put(row[0], _row_to_ticket(row))
+
+    def _write_loop(self):
+        # このスレッドが止まると以降の書き込みがすべて返らなくなるので、
+        # どんな例外も待っている呼び出し側に渡してループを続ける
+        while True:
+            try:
+                batch = [self._writes.get(timeout=self.poll_interval)]
+            except queue.Empty:
+                self._check_external_writes()
+                continue
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._commit_batch(batch)
+            for write in batch:
+                write.done.set()
+            self._check_external_writes()
+
+    def _commit_batch(self, batch):
+        conn = self._writer_conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write in batch:
+                # 1件ずつセーブポイントで囲み、失敗した書き込みの途中までの変更だけを戻す
+                conn.execute('SAVEPOINT write')
+                try:
+                    write.result = write.fn(conn)
+                except Exception as e:
+                    write.error = e
+                    conn.execute('ROLLBACK TO write')
+                conn.execute('RELEASE write')
+            conn.execute('COMMIT')
+        except Exception as e:
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            for write in batch:
+                write.result = None
+                write.error = e
+
+    def _check_external_writes(self):
+        # data_version は「他の接続」がコミットしたときだけ変わる
+        try:
+            version = self._writer_conn.execute('PRAGMA data_version').fetchone()[0]
+        except sqlite3.Error:
+            # 読めなければ他プロセスの書き込みを見逃さないようにキャッシュを捨てる
+            self.cache.clear()
+            return
+        if version != self._data_version:
+            self._data_version = version
+            self.cache.clear()
+
+    def _write(self, fn):
+        write = _Write(fn)
+        self._writes.put(write)
+        return write.wait(self.write_timeout)
+
+    def get(self, ticket_id):
+        ticket = self.cache.get(ticket_id)
+        if ticket is not None:
+            return ticket
+        row = self._reader().execute(_SELECT_BY_ID, (ticket_id,)).fetchone()
+        if row is None:
+            return None
+        ticket = _row_to_ticket(row)
+        self.cache.put(ticket_id, ticket)
+        return ticket
+
+    def add(self, ticket):
+        values = (ticket['id'], ticket['name'], ticket['description'],
+                  ticket['created_at'], int(ticket['used']), ticket['used_at'])
+
+        def insert(conn):
+            conn.execute(_INSERT, values)
+            conn.execute(_INSERT_CHANGE, (ticket['id'],))
+
+        self._write(insert)
+        self.cache.put(ticket['id'], dict(ticket))
+
+    def redeem(self, ticket_id, used_at):
+        def update(conn):
+            changed = conn.execute(_REDEEM, (used_at, ticket_id)).rowcount
+            if changed:
+                conn.execute(_INSERT_CHANGE, (ticket_id,))
+            return changed, conn.execute(_SELECT_BY_ID, (ticket_id,)).fetchone()
+
+        changed, row = self._write(update)
+        if row is None:
+            return 'missing', None
+        ticket = _row_to_ticket(row)
+        self.cache.put(ticket_id, ticket)
+        return ('ok' if changed else 'used'), ticket
+
+    def page(self, limit, after=None, used=None):
+        conn = self._reader()
+        where = []
+        params = []
+        if after is not None:
+            row = conn.execute(_SELECT_SEQ, (after,)).fetchone()
+            if row is None:
+                raise KeyError(after)
+            where.append('seq < ?')
+            params.append(row[0])
+        if used is not None:
+            where.append('used = ?')
+            params.append(int(used))
+
+        sql = f'SELECT {_COLUMNS} FROM tickets'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY seq DESC LIMIT ?'
+        # 次ページの有無を知るために1件多く読む
+        rows = conn.execute(sql, (*params, limit + 1)).fetchall()
+
+        tickets = [_row_to_ticket(row) for row in rows[:limit]]
+        next_cursor = tickets[-1]['id'] if len(rows) > limit else None
+        return tickets, next_cursor
+
+    def _read_transaction(self, fn):
+        # バージョンと一覧を同じスナップショットから読む
+        conn = self._reader()
+        conn.execute('BEGIN')
+        try:
+            return fn(conn)
+        finally:
+            conn.execute('COMMIT')
+
+    def snapshot(self):
+        def read(conn):
+            seq = conn.execute(_SELECT_VERSION).fetchone()[0]
+            rows = conn.execute('SELECT id FROM tickets WHERE used = 0 ORDER BY seq').fetchall()
+            return _make_version(self.generation, seq), [row[0] for row in rows]
+
+        return self._read_transaction(read)
+
+    def changes_since(self, version):
+        generation, since = _split_version(version)
+        if generation != self.generation:
+            raise KeyError(version)
+
+        def read(conn):
+            seq = conn.execute(_SELECT_VERSION).fetchone()[0]
+            if since > seq:
+                raise KeyError(version)
+            added = []
+            removed = []
+            for ticket_id, used in conn.execute(_SELECT_CHANGED, (since,)):
+                (removed if used else added).append(ticket_id)
+            return _make_version(self.generation, seq), added, removed
+
+        return self._read_transaction(read)
+
+
+def create_storage():
+    """環境変数 TICKET_DB_PATH が設定されていれば SQLite、なければメモリに保存する"""
+    path = os.environ.get('TICKET_DB_PATH')
+    if path:
+        cache_size = int(os.environ.get('TICKET_CACHE_SIZE', 10000))
+        return SQLiteTicketStore(path, cache_size=cache_size)
+    return MemoryTicketStore()
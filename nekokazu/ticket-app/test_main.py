@@ -0,0 +1,127 @@
+import random
+from pathlib import Path
+
+import pytest
+
+import main
+from storage import MemoryTicketStore, SQLiteTicketStore, TicketIndex
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, 'tickets_storage', MemoryTicketStore())
+    return main.app.test_client()
+
+
+def create(client, name='チケット'):
+    response = client.post('/api/tickets/create', json={'name': name})
+    assert response.status_code == 200
+    return response.get_json()['ticket']['id']
+
+
+def test_used_filter_must_be_a_boolean(client):
+    response = client.get('/api/tickets?used=garbage')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_used_filter_pages_follow_redeems(client):
+    ids = [create(client) for _ in range(5)]
+    for ticket_id in ids[1::2]:
+        assert client.post(f'/api/tickets/{ticket_id}/verify').status_code == 200
+
+    used = client.get('/api/tickets?used=true').get_json()['tickets']
+    assert [t['id'] for t in used] == [ids[3], ids[1]]
+
+    first = client.get('/api/tickets?used=false&limit=2').get_json()
+    assert [t['id'] for t in first['tickets']] == [ids[4], ids[2]]
+    rest = client.get(f"/api/tickets?used=false&limit=2&after={first['next_cursor']}").get_json()
+    assert [t['id'] for t in rest['tickets']] == [ids[0]]
+    assert rest['next_cursor'] is None
+
+
+def test_ticket_index_pages_match_a_sorted_list():
+    rng = random.Random(7)
+    index = TicketIndex()
+    used = set()
+    # 64分木が3段になる件数で、段をまたぐ検索も通す
+    count = 64 * 64 + 300
+    for row in range(count):
+        if rng.random() < 0.1:
+            used.add(row)
+        index.add(row, row in used)
+    for row in rng.sample(range(count), 2000):
+        index.mark_used(row)
+        used.add(row)
+
+    for flag in (True, False):
+        expected = sorted((row for row in range(count) if (row in used) == flag), reverse=True)
+        for before in (None, 0, 1, 63, 64, 4095, 4096, count - 1, *rng.sample(range(count), 20)):
+            rows = [row for row in expected if before is None or row < before]
+            for limit in (0, 1, 50):
+                assert index.page(limit, before, flag) == (rows[:limit], len(rows) > limit)
+    assert index.unused_rows() == sorted(set(range(count)) - used)
+
+
+
+def test_verify_batch_judges_each_scan_and_keeps_the_stored_redemption(client):
+    used_id, fresh_id = create(client), create(client)
+    used_at = client.post(f'/api/tickets/{used_id}/verify').get_json()['ticket']['used_at']
+
+    response = client.post('/api/tickets/verify-batch', json={'scans': [
+        'junk',
+        {'ticket_id': ['a']},
+        {'ticket_id': fresh_id, 'scanned_at': 5},
+        {'ticket_id': used_id, 'scanned_at': '2000-01-01T00:00:00'},
+        {'ticket_id': fresh_id, 'scanned_at': '2026-01-01T18:05:00'},
+        {'ticket_id': fresh_id, 'scanned_at': '2026-01-01T18:00:00'},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['valid'] for result in results] == [False, False, False, False, False, True]
+    # 後から届いた早いスキャンより、保存済みの使用が優先する
+    assert results[3]['used_at'] == used_at
+    assert main.tickets_storage.get(used_id)['used_at'] == used_at
+    assert main.tickets_storage.get(fresh_id)['used_at'] == '2026-01-01T18:00:00'
+
+def test_sqlite_writer_survives_a_failing_write(tmp_path):
+    store = SQLiteTicketStore(str(tmp_path / 'tickets.db'), poll_interval=0.01, write_timeout=5)
+
+    def fail(conn):
+        conn.execute("INSERT INTO changes (id) VALUES ('partial')")
+        raise ZeroDivisionError
+
+    with pytest.raises(ZeroDivisionError):
+        store._write(fail)
+
+    ticket = {'id': '00000000-0000-4000-8000-000000000001', 'name': 'a', 'description': '',
+              'created_at': '2024-01-01T00:00:00', 'used': False, 'used_at': None}
+    store.add(ticket)
+    assert store.redeem(ticket['id'], '2024-01-01T01:00:00')[0] == 'ok'
+    # 失敗した書き込みの途中までの変更は残らない
+    changes = store._reader().execute('SELECT id FROM changes').fetchall()
+    assert changes == [(ticket['id'],), (ticket['id'],)]
+
+
+def test_bad_create_leaves_the_list_working(client):
+    ticket_id = create(client)
+    response = client.post('/api/tickets/create', json={'name': ['bad']})
+    assert response.status_code == 400
+
+    # 検証をすり抜けても、ストアの列はずれない
+    with pytest.raises(TypeError):
+        main.tickets_storage.add({'id': '00000000-0000-4000-8000-000000000002', 'name': ['bad'],
+                                  'description': '', 'created_at': '2024-01-01T00:00:00',
+                                  'used': False, 'used_at': None})
+    after_id = create(client)
+
+    response = client.get('/api/tickets')
+    assert response.status_code == 200
+    assert [t['id'] for t in response.get_json()['tickets']] == [after_id, ticket_id]
+
+
+@pytest.mark.parametrize('name', ['qr_render.py', 'ticket_export.py'])
+def test_shared_modules_match_the_nekodigi_copies(name):
+    # アプリごとのディレクトリからデプロイするので、nekodigi/ticket-app と同じ内容のコピーを持っている
+    here = Path(__file__).resolve().parent
+    assert (here / name).read_bytes() == (here.parent.parent / 'nekodigi' / 'ticket-app' / name).read_bytes()
@@ -0,0 +1,173 @@
+"""オフライン検証用のチケット一覧（有効なチケットIDのスナップショット）
+
+スキャナーはこれを取り込んで手元で検証し（二分探索で数マイクロ秒）、使用した
+チケットはまとめてサーバーに送り返す。ネットワークが切れていても入場を止めない。
+
+nekokazu/ticket-app にも同じ内容のコピーを置いている（アプリごとのディレクトリからデプロイする
+ため）。変更するときは両方を同じにする（nekokazu/ticket-app/test_main.py で一致を確かめている）。
+
+形式（ビッグエンディアンのバイナリ）:
+
+    ヘッダー  'TKX1' / 種類（0 = 全件, 1 = 差分）/ 予約3バイト /
+              基準バージョン u64 / バージョン u64 / 追加数 u32 / 削除数 u32
+    本体      追加するチケットID（UUID の16バイト、昇順）
+              削除するチケットID（同上。使用済みになった・消えたもの）
+
+全件の基準バージョンは 0。差分は基準バージョンの一覧に追加・削除を適用すると
+そのバージョンの一覧になる。同じ変更が次の差分にもう一度入ることがあるが、
+適用し直しても結果は変わらない。バージョンは比較用の値で、大小に意味はない。
+"""
+
+import bisect
+import hashlib
+import struct
+import threading
+import time
+import uuid
+
+MAGIC = b'TKX1'
+FULL = 0
+DELTA = 1
+HEADER = struct.Struct('>4sB3xQQII')
+KEY_SIZE = 16
+
+
+def ticket_key(ticket_id):
+    """チケットID（UUID 文字列）を16バイトにする。UUID でなければ None"""
+    try:
+        return uuid.UUID(ticket_id).bytes
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def sorted_keys(ticket_ids):
+    """チケットIDを16バイトにして昇順に連結する"""
+    keys = {ticket_key(ticket_id) for ticket_id in ticket_ids}
+    keys.discard(None)
+    return b''.join(sorted(keys))
+
+
+def split_keys(data):
+    return [data[i:i + KEY_SIZE] for i in range(0, len(data), KEY_SIZE)]
+
+
+def encode(version, added, removed=b'', base=None):
+    """エクスポートを組み立てる（added / removed は sorted_keys の結果）"""
+    kind = FULL if base is None else DELTA
+    header = HEADER.pack(MAGIC, kind, base or 0, version, len(added) // KEY_SIZE, len(removed) // KEY_SIZE)
+    return header + added + removed
+
+
+def decode(data):
+    """(種類, 基準バージョン, バージョン, 追加, 削除) を返す"""
+    magic, kind, base, version, added, removed = HEADER.unpack_from(data)
+    if magic != MAGIC or kind not in (FULL, DELTA):
+        raise ValueError('チケット一覧の形式が不正です')
+    start = HEADER.size
+    middle = start + added * KEY_SIZE
+    end = middle + removed * KEY_SIZE
+    if len(data) != end:
+        raise ValueError('チケット一覧の長さが不正です')
+    return kind, base, version, bytes(data[start:middle]), bytes(data[middle:end])
+
+
+class _Keys:
+    """連結した16バイトキーを bisect できる列として見せる"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // KEY_SIZE
+
+    def __getitem__(self, i):
+        return self.data[i * KEY_SIZE:(i + 1) * KEY_SIZE]
+
+
+class TicketSet:
+    """スキャナー側で持つ有効なチケットの集合（1枚16バイト）"""
+
+    def __init__(self):
+        self.version = None
+        self.data = b''
+
+    def apply(self, export):
+        """全件か差分を適用する。差分の基準が手元と違えば ValueError"""
+        kind, base, version, added, removed = decode(export)
+        if kind == FULL:
+            self.data = added
+        elif base != self.version:
+            raise ValueError('差分の基準バージョンが一致しません。全件を取り直してください')
+        elif added or removed:
+            keys = set(split_keys(self.data))
+            keys.update(split_keys(added))
+            keys.difference_update(split_keys(removed))
+            self.data = b''.join(sorted(keys))
+        self.version = version
+
+    def discard(self, ticket_id):
+        """手元で使用したチケットを外す"""
+        key = ticket_key(ticket_id)
+        if key is not None and key in self:
+            i = bisect.bisect_left(_Keys(self.data), key)
+            self.data = self.data[:i * KEY_SIZE] + self.data[(i + 1) * KEY_SIZE:]
+
+    def __contains__(self, ticket_id):
+        key = ticket_id if isinstance(ticket_id, bytes) else ticket_key(ticket_id)
+        if key is None:
+            return False
+        keys = _Keys(self.data)
+        i = bisect.bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+    def __len__(self):
+        return len(self.data) // KEY_SIZE
+
+
+class ExportHistory:
+    """作った全件スナップショットを覚えておき、その間の差分を返す
+
+    変更の履歴を持たない保存先（Firebase など）用。build() が返す有効な
+    チケットIDから一覧を作り、内容のハッシュをバージョンにする（同じ内容なら
+    どのインスタンスで作っても同じバージョンになる）。作り直しは max_age 秒に
+    1回まで。覚えていない基準バージョンを指定されたら全件を返す。
+    """
+
+    def __init__(self, build, keep=8, max_age=5.0):
+        self.build = build
+        self.keep = keep
+        self.max_age = max_age
+        self.snapshots = {}
+        self.current = None
+        self.built_at = 0.0
+        self.lock = threading.Lock()
+
+    def _refresh(self):
+        if self.current is not None and time.monotonic() - self.built_at < self.max_age:
+            return self.current
+        data = sorted_keys(self.build())
+        version = int.from_bytes(hashlib.sha256(data).digest()[:8], 'big') or 1
+        self.snapshots.pop(version, None)
+        self.snapshots[version] = data
+        while len(self.snapshots) > self.keep:
+            del self.snapshots[next(iter(self.snapshots))]
+        self.current = version
+        self.built_at = time.monotonic()
+        return version
+
+    def export(self, since=None):
+        """(バージョン, エクスポート) を返す"""
+        with self.lock:
+            version = self._refresh()
+            data = self.snapshots[version]
+            base = self.snapshots.get(since) if since is not None else None
+        if base is None:
+            return version, encode(version, data)
+        old = set(split_keys(base))
+        new = set(split_keys(data))
+        return version, encode(
+            version,
+            b''.join(sorted(new - old)),
+            b''.join(sorted(old - new)),
+            base=since,
+        )